@@ -0,0 +1,300 @@
+'''
+Run Benchmarks
+--part of the benchmarks for the NASA-CCRI-Extreme-Precipitation code--
+Description: This script times the processing stages of the repository on synthetic fixtures (see
+synthetic_fixtures.py) and compares the results with a saved baseline, so performance regressions show up
+without the NASA archives.
+    -- imerg_saver: saveIMERGfiles.process_nc_files with regridding to the GISS grid, 6 hour resampling and
+       unit conversion. Its files are the granules on the resampling interval.
+    -- giss_saver: saveGISSfiles.process_nc_files.
+    -- compare_viz: IMERG_GISS_hist_stats.createCompareViz in month mode for January, on the outputs of the
+       two savers (so they must run first) with an empty summary store.
+    -- event_ranking_cold: stream_events and top_events over the Giovanni CSVs with an empty CSV cache, and
+       event_ranking_warm: the same once the cache exists.
+    -- etc_catalog: etc_catalog.convert_etc_pickles, and track_density: track_density.track_density_cube
+       on that catalog.
+Every repeat of a stage runs in a new process with an empty output folder, so its peak RSS (resident memory,
+including worker processes) is its own. The result of a stage is the median wall and CPU time of the
+repeats, the files and MB read per second of wall time, and the largest peak RSS. A stage is a regression if its
+wall time or peak RSS is more than tolerance above the baseline of the same fixture size; the script then
+exits with status 1. Without a baseline of fixture_size for the current fixtures in baseline_file, the script
+stops with status 1 before running anything unless save_baseline is True, so a missing baseline never passes
+as a run without regressions.
+
+This script takes the following user inputs which are set in the "USER INPUTS" section:
+    -- fixture_size: 'small', 'medium' or 'large' (see fixture_sizes in synthetic_fixtures.py).
+    -- work_folder: the folder for the fixtures, the stage outputs and the results. Fixtures are kept between
+       runs and only generated again when their parameters change.
+    -- stages: the stages to run, in order.
+    -- repeats: the number of times each stage is run.
+    -- workers: the number of worker processes of the savers.
+    -- baseline_file: the JSON file with the baseline of every fixture size.
+    -- save_baseline: set this to True to save the results as the baseline of fixture_size.
+    -- tolerance: the fraction above the baseline at which a stage is a regression.
+'''
+
+#---------------------------IMPORTS--------------------------------#
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+
+benchmark_folder = os.path.dirname(os.path.abspath(__file__))
+for code_folder in ['probability-density-functions', 'top-precipitation-events', 'teleconnection-analysis']:
+    sys.path.append(os.path.join(benchmark_folder, '..', code_folder))
+import saveIMERGfiles
+import saveGISSfiles
+import IMERG_GISS_hist_stats
+from precipitation_events import read_giovanni_files, stream_events, top_events
+from etc_catalog import convert_etc_pickles, load_etc_catalog
+from track_density import track_density_cube
+from synthetic_fixtures import fixture_sizes, generate_fixtures
+
+#------------------------------------------------------------------#
+
+#---------------------------USER INPUTS--------------------------------#
+fixture_size = 'small'
+work_folder = os.path.join(tempfile.gettempdir(), 'ccri_benchmarks')
+stages = ['imerg_saver', 'giss_saver', 'compare_viz', 'event_ranking_cold', 'event_ranking_warm',
+          'etc_catalog', 'track_density']
+repeats = 3
+workers = 1
+baseline_file = os.path.join(benchmark_folder, 'baseline.json')
+save_baseline = False
+tolerance = 0.25
+#-------------------------END OF USER INPUTS----------------------------#
+
+#---------------------------FUNCTIONS--------------------------------#
+
+def imerg_saver_stage(paths, output_folder, workers, state):
+    failures = saveIMERGfiles.process_nc_files(paths['imerg_years'], paths['imerg_folder'], output_folder, 'precipitation',
+                                               True, True, paths['regions'], paths['mask_folder'], paths['regrid_file'], 6, 24,
+                                               workers, 'nearest', rebuild=True)
+    if failures:
+        raise RuntimeError(f"imerg_saver failed for {', '.join(failures)}")
+    return [os.path.join(paths['imerg_folder'], str(year), file) for year in paths['imerg_years']
+            for file in os.listdir(os.path.join(paths['imerg_folder'], str(year)))
+            if saveIMERGfiles.matches_resample_rate(saveIMERGfiles.extract_start_time(file), 6)]
+
+
+def giss_saver_stage(paths, output_folder, workers, state):
+    failures = saveGISSfiles.process_nc_files(paths['giss_years'], paths['giss_folder'], output_folder, 'prec',
+                                              paths['regions'], paths['mask_folder'], workers, rebuild=True)
+    if failures:
+        raise RuntimeError(f"giss_saver failed for {', '.join(failures)}")
+    return [os.path.join(paths['giss_folder'], str(year), file) for year in paths['giss_years']
+            for file in os.listdir(os.path.join(paths['giss_folder'], str(year)))]
+
+
+def compare_viz_setup(paths, output_folder):
+    saver_outputs = {name: os.path.join(os.path.dirname(output_folder), name) for name in ['giss_saver', 'imerg_saver']}
+    for name, folder in saver_outputs.items():
+        if not os.path.exists(folder):
+            raise FileNotFoundError(f'compare_viz needs the outputs of {name}; run {name} first')
+    return saver_outputs
+
+
+def compare_viz_stage(paths, output_folder, workers, state):
+    year = paths['imerg_years'][0]
+    IMERG_GISS_hist_stats.createCompareViz('month', [year], paths['regions'], 'precipitation', state['giss_saver'],
+                                           state['imerg_saver'], output_folder, months_list=['JAN'])
+    return [os.path.join(state[name], str(year), region, f'{year}_01_{region}_precipitation.npz')
+            for name in ['giss_saver', 'imerg_saver'] for region in paths['regions']]
+
+
+def event_ranking_stage(paths, output_folder, workers, state):
+    cache_folder = state if state is not None else os.path.join(output_folder, 'giovanni_cache')
+    events = stream_events(read_giovanni_files(paths['csv_files'], cache_folder), break_threshold=0.2)
+    top_events(events, k=50, weights=(0.45, 0.45, 0.10), min_measurements=2)
+    return paths['csv_files']
+
+
+def event_ranking_warm_setup(paths, output_folder):
+    # Builds the CSV cache before the timed run
+    cache_folder = os.path.join(output_folder, 'giovanni_cache')
+    for times, precipitation in read_giovanni_files(paths['csv_files'], cache_folder):
+        pass
+    return cache_folder
+
+
+def etc_catalog_stage(paths, output_folder, workers, state):
+    start_year, end_year = paths['etc_years']
+    convert_etc_pickles(paths['etc_template'], start_year, end_year, os.path.join(output_folder, 'catalog.npz'))
+    return [paths['etc_template'].format(year=year) for year in range(start_year, end_year + 1)]
+
+
+def track_density_setup(paths, output_folder):
+    catalog_path = os.path.join(output_folder, 'catalog.npz')
+    convert_etc_pickles(paths['etc_template'], paths['etc_years'][0], paths['etc_years'][1], catalog_path)
+    return catalog_path
+
+
+def track_density_stage(paths, output_folder, workers, state):
+    track_density_cube(load_etc_catalog(state), np.arange(20, 71), np.arange(-120, -19),
+                       paths['etc_years'][0], paths['etc_years'][1])
+    return [state]
+
+
+# Every stage is (setup, run). setup(paths, output_folder) runs untimed before the stage and its return value
+# is passed to run(paths, output_folder, workers, state), which returns the paths of the files the stage read.
+benchmark_stages = {
+    'imerg_saver': (None, imerg_saver_stage),
+    'giss_saver': (None, giss_saver_stage),
+    'compare_viz': (compare_viz_setup, compare_viz_stage),
+    'event_ranking_cold': (None, event_ranking_stage),
+    'event_ranking_warm': (event_ranking_warm_setup, event_ranking_stage),
+    'etc_catalog': (None, etc_catalog_stage),
+    'track_density': (track_density_setup, track_density_stage),
+}
+
+
+def peak_rss_mb():
+    """
+    The peak resident memory of this process and its finished child processes, in MB.
+    """
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    scale = 1 if sys.platform == 'darwin' else 1024
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak * scale / 1e6
+
+
+def measure_stage(stage, paths, work_folder, workers):
+    """
+    Runs one repeat of a stage in an empty output folder and measures it. Runs in its own process (see run_stage).
+    :return: A dictionary with 'wall_s', 'cpu_s', 'files', 'bytes' and 'peak_rss_mb'.
+    """
+    setup, run = benchmark_stages[stage]
+    output_folder = os.path.join(work_folder, stage)
+    if os.path.exists(output_folder):
+        shutil.rmtree(output_folder)
+    os.makedirs(output_folder)
+    state = setup(paths, output_folder) if setup else None
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    inputs = run(paths, output_folder, workers, state)
+    wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+    return {
+        'wall_s': wall,
+        'cpu_s': cpu,
+        'files': len(inputs),
+        'bytes': sum(os.path.getsize(path) for path in inputs),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_stage(stage, paths, work_folder, repeats=3, workers=1):
+    """
+    Runs a stage repeats times, each time in a new process, and summarizes the runs.
+    :return: A dictionary with the median 'wall_s' and 'cpu_s', 'files', 'mb', 'files_per_s', 'mb_per_s' and the
+             largest 'peak_rss_mb'.
+    """
+    runs = []
+    for _ in range(repeats):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            runs.append(executor.submit(measure_stage, stage, paths, work_folder, workers).result())
+    wall = float(np.median([run['wall_s'] for run in runs]))
+    megabytes = runs[0]['bytes'] / 1e6
+    return {
+        'wall_s': wall,
+        'cpu_s': float(np.median([run['cpu_s'] for run in runs])),
+        'files': runs[0]['files'],
+        'mb': megabytes,
+        'files_per_s': runs[0]['files'] / wall if wall > 0 else float('nan'),
+        'mb_per_s': megabytes / wall if wall > 0 else float('nan'),
+        'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25):
+    """
+    Compares stage results with a baseline.
+    :param results: A dictionary of run_stage results keyed by stage.
+    :param baseline: A dictionary of results keyed by stage (stages that are not in it are not compared).
+    :param tolerance: The fraction above the baseline wall time or peak RSS at which a stage is a regression.
+    :return: A dictionary keyed by stage of dictionaries with the 'wall_ratio' and 'rss_ratio' to the baseline
+             and 'regression' (True or False).
+    """
+    comparison = {}
+    for stage, result in results.items():
+        if stage not in baseline:
+            continue
+        wall_ratio = result['wall_s'] / baseline[stage]['wall_s']
+        rss_ratio = result['peak_rss_mb'] / baseline[stage]['peak_rss_mb']
+        comparison[stage] = {
+            'wall_ratio': wall_ratio,
+            'rss_ratio': rss_ratio,
+            'regression': wall_ratio > 1 + tolerance or rss_ratio > 1 + tolerance,
+        }
+    return comparison
+
+
+def print_results(results, comparison):
+    """
+    Prints one row per stage, with the change from the baseline where there is one.
+    """
+    print(f"{'stage':<20}{'wall s':>9}{'cpu s':>9}{'files':>7}{'files/s':>10}{'MB/s':>9}{'peak MB':>9}  vs baseline")
+    for stage, result in results.items():
+        versus = ''
+        if stage in comparison:
+            versus = (f"wall {comparison[stage]['wall_ratio'] - 1:+.0%}, rss {comparison[stage]['rss_ratio'] - 1:+.0%}"
+                      + ('  REGRESSION' if comparison[stage]['regression'] else ''))
+        print(f"{stage:<20}{result['wall_s']:>9.2f}{result['cpu_s']:>9.2f}{result['files']:>7}"
+              f"{result['files_per_s']:>10.1f}{result['mb_per_s']:>9.1f}{result['peak_rss_mb']:>9.0f}  {versus}")
+
+#----------------------------------END OF FUNCTIONS--------------------------------#
+
+
+#-------------------------------MAIN CODE-----------------------------------#
+if __name__ == "__main__":
+    size = fixture_sizes[fixture_size]
+    baselines = {}
+    if os.path.exists(baseline_file):
+        with open(baseline_file) as f:
+            baselines = json.load(f)
+    baseline = baselines.get(fixture_size, {})
+    if baseline and baseline.get('fixture') != json.loads(json.dumps(size)):
+        print(f"the {fixture_size} fixtures have changed since the baseline in {baseline_file} was saved.")
+        baseline = {}
+    elif not baseline:
+        print(f"{baseline_file} has no {fixture_size} baseline.")
+    if not baseline and not save_baseline:
+        print("Set save_baseline = True to record one before comparing against it.")
+        sys.exit(1)
+
+    print(f"--- generating {fixture_size} fixtures (if needed).")
+    paths = generate_fixtures(os.path.join(work_folder, 'fixtures', fixture_size), size)
+    results = {}
+    for stage in stages:
+        print(f"--- running {stage} ({repeats} repeats).")
+        results[stage] = run_stage(stage, paths, os.path.join(work_folder, 'outputs', fixture_size), repeats, workers)
+
+    comparison = compare_to_baseline(results, baseline.get('stages', {}), tolerance)
+    print_results(results, comparison)
+
+    run_record = {
+        'fixture': size,
+        'stages': results,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'workers': workers,
+    }
+    with open(os.path.join(work_folder, f'results_{fixture_size}.json'), 'w') as f:
+        json.dump(run_record, f, indent=1)
+    if save_baseline:
+        baselines[fixture_size] = run_record
+        with open(baseline_file, 'w') as f:
+            json.dump(baselines, f, indent=1)
+        print(f"--- saved the {fixture_size} baseline to {baseline_file}.")
+    if any(stage['regression'] for stage in comparison.values()):
+        sys.exit(1)
+
+#---------------------------------END OF MAIN CODE---------------------------------#
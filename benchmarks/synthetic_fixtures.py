@@ -0,0 +1,282 @@
+'''
+Synthetic Fixtures
+--part of the benchmarks for the NASA-CCRI-Extreme-Precipitation code--
+Description: This script generates small, offline stand-ins for the data the processing code reads, so the
+benchmarks in run_benchmarks.py do not need the NASA archives. Values are random but shaped like the real
+data: precipitation is zero most of the time with gamma-distributed rain otherwise.
+    -- IMERG: half-hourly granules in year folders, named like the real files
+       ('3B-HHR.MS.MRG.3IMERG.20120101-S000000-E002959.0000.V07A.HDF5.nc4') with a 'precipitation'
+       (time, lon, lat) variable in mm/hour.
+    -- GISS: one file per month in year folders, named like 'JAN2012.aijh12iWISO_20th_MERRA2_ANL.nc' with a
+       'prec' (time, lat, lon) variable every 6 hours.
+    -- Region masks ('{region}_mask.nc' with 'latitude', 'longitude' and 'mask') and a regrid file on the GISS
+       grid. The mask grid contains the coordinates of both the IMERG and the GISS grid, so the same mask
+       applies to native, regridded and GISS data.
+    -- Giovanni CSVs: one area-averaged half-hourly series per year with the Giovanni metadata rows.
+    -- ETC pickles: one list of event dictionaries per year, with the keys the ETC notebooks use.
+Every fixture is set by grid size and time span (see fixture_sizes). generate_fixtures writes a
+'fixture.json' with its parameters and does nothing if the folder already has the same fixtures.
+
+Example:
+    paths = generate_fixtures("benchmark_data/small", fixture_sizes['small'])
+'''
+
+#---------------------------IMPORTS--------------------------------#
+import os
+import json
+import pickle
+import calendar
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+#------------------------------------------------------------------#
+
+# Grid sizes are (lat, lon) cells; spans are numbers of days, months and years starting in start_year
+fixture_sizes = {
+    'small': {
+        'start_year': 2012, 'imerg_grid': (90, 180), 'imerg_days': 3, 'giss_grid': (45, 72), 'giss_months': 3,
+        'regions': ['northeast', 'southeast'], 'csv_years': 2, 'etc_years': 3, 'etcs_per_year': 200, 'seed': 0,
+    },
+    'medium': {
+        'start_year': 2012, 'imerg_grid': (360, 720), 'imerg_days': 10, 'giss_grid': (90, 144), 'giss_months': 12,
+        'regions': ['northeast', 'southeast'], 'csv_years': 10, 'etc_years': 20, 'etcs_per_year': 500, 'seed': 0,
+    },
+    'large': {
+        'start_year': 2012, 'imerg_grid': (1800, 3600), 'imerg_days': 31, 'giss_grid': (90, 144), 'giss_months': 60,
+        'regions': ['northeast', 'southeast', 'midwest', 'contUSA'], 'csv_years': 22, 'etc_years': 74,
+        'etcs_per_year': 800, 'seed': 0,
+    },
+}
+
+# Lat/lon boxes of the synthetic region masks
+region_boxes = {
+    'northeast': (37, 48, -82, -66),
+    'southeast': (25, 37, -92, -75),
+    'midwest': (36, 49, -104, -82),
+    'contUSA': (24, 50, -125, -66),
+}
+
+giss_file_suffix = 'aijh12iWISO_20th_MERRA2_ANL.nc'
+month_names = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+
+#---------------------------FUNCTIONS--------------------------------#
+
+def cell_centers(n_cells, start, stop):
+    """
+    Centers of n_cells equal cells from start to stop (so a global grid never has a point on a pole).
+    """
+    step = (stop - start) / n_cells
+    return start + step * (np.arange(n_cells) + 0.5)
+
+
+def synthetic_precipitation(rng, shape, wet_fraction=0.2):
+    """
+    Random float32 precipitation: zero outside a wet_fraction of the values, gamma-distributed inside it.
+    """
+    values = rng.gamma(0.5, 2.0, size=shape).astype(np.float32)
+    values[rng.random(shape) >= wet_fraction] = 0
+    return values
+
+
+def imerg_file_name(start):
+    """
+    The IMERG filename of the half-hourly granule starting at start (a pandas Timestamp).
+    """
+    end = start + pd.Timedelta(minutes=29, seconds=59)
+    minute_of_day = start.hour * 60 + start.minute
+    return (f"3B-HHR.MS.MRG.3IMERG.{start:%Y%m%d}-S{start:%H%M%S}-E{end:%H%M%S}."
+            f"{minute_of_day:04d}.V07A.HDF5.nc4")
+
+
+def write_imerg_granules(folder, rng, start_year, days, grid):
+    """
+    Writes half-hourly IMERG-like granules for a number of days starting on January 1 of start_year.
+    :return: The paths of the granules.
+    """
+    lat = cell_centers(grid[0], -90, 90)
+    lon = cell_centers(grid[1], -180, 180)
+    paths = []
+    for start in pd.date_range(f'{start_year}-01-01', periods=days * 48, freq='30min'):
+        year_folder = os.path.join(folder, str(start.year))
+        os.makedirs(year_folder, exist_ok=True)
+        dataset = xr.Dataset(
+            data_vars={'precipitation': (['time', 'lon', 'lat'], synthetic_precipitation(rng, (1, len(lon), len(lat))),
+                                         {'units': 'mm/hr'})},
+            coords={'time': [start.to_datetime64()], 'lon': lon, 'lat': lat},
+        )
+        path = os.path.join(year_folder, imerg_file_name(start))
+        dataset.to_netcdf(path, encoding={'precipitation': {'zlib': True, 'complevel': 4}})
+        paths.append(path)
+    return paths
+
+
+def write_giss_months(folder, rng, start_year, months, grid):
+    """
+    Writes monthly GISS-like files with 6-hourly 'prec' values, starting in January of start_year.
+    :return: The paths of the files.
+    """
+    lat = cell_centers(grid[0], -90, 90)
+    lon = cell_centers(grid[1], -180, 180)
+    paths = []
+    for m in range(months):
+        year, month = start_year + m // 12, m % 12 + 1
+        year_folder = os.path.join(folder, str(year))
+        os.makedirs(year_folder, exist_ok=True)
+        times = pd.date_range(f'{year}-{month:02d}-01', periods=calendar.monthrange(year, month)[1] * 4, freq='6h')
+        dataset = xr.Dataset(
+            data_vars={'prec': (['time', 'lat', 'lon'], synthetic_precipitation(rng, (len(times), len(lat), len(lon))) * 24,
+                                {'units': 'mm/day'})},
+            coords={'time': times, 'lat': lat, 'lon': lon},
+        )
+        path = os.path.join(year_folder, f'{month_names[month - 1]}{year}.{giss_file_suffix}')
+        dataset.to_netcdf(path)
+        paths.append(path)
+    return paths
+
+
+def write_region_masks(folder, regions, grids):
+    """
+    Writes a box mask for every region on a grid that contains the coordinates of all of the given grids.
+    :param grids: A list of (lat, lon) coordinate arrays.
+    :return: The mask folder.
+    """
+    os.makedirs(folder, exist_ok=True)
+    lat = np.unique(np.concatenate([grid[0] for grid in grids]))
+    lon = np.unique(np.concatenate([grid[1] for grid in grids]))
+    for region in regions:
+        lat_min, lat_max, lon_min, lon_max = region_boxes[region]
+        inside = ((lat >= lat_min) & (lat <= lat_max))[:, np.newaxis] & ((lon >= lon_min) & (lon <= lon_max))
+        mask = xr.Dataset(
+            data_vars={'mask': (['latitude', 'longitude'], inside.astype(np.int8))},
+            coords={'latitude': lat, 'longitude': lon},
+        )
+        mask.to_netcdf(os.path.join(folder, f'{region}_mask.nc'))
+    return folder
+
+
+def write_regrid_file(path, grid):
+    """
+    Writes a regrid file with the 'lat' and 'lon' of a grid.
+    """
+    lat, lon = grid
+    xr.Dataset(coords={'lat': lat, 'lon': lon}).to_netcdf(path)
+    return path
+
+
+def write_giovanni_csvs(folder, rng, start_year, years):
+    """
+    Writes one half-hourly Giovanni area-averaged time series CSV per year, named like '2012.csv'.
+    :return: The paths of the CSVs.
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for year in range(start_year, start_year + years):
+        times = pd.date_range(f'{year}-01-01', f'{year}-12-31 23:30', freq='30min')
+        precipitation = synthetic_precipitation(rng, len(times), wet_fraction=0.1) * 4
+        path = os.path.join(folder, f'{year}.csv')
+        with open(path, 'w') as f:
+            f.write('Title:,"Time Series, Area-Averaged of Multi-satellite precipitation estimate (synthetic)"\n')
+            f.write(f'User Start Date:,{year}-01-01T00:00:00Z\n')
+            f.write(f'User End Date:,{year}-12-31T23:59:59Z\n')
+            f.write('User Bounding Box:,"-75.0146,40.0032,-71.6968,41.7391"\n')
+            f.write('Data Bounding Box:,"-74.95,40.05,-71.75,41.65"\n')
+            f.write('URL to Reproduce Results:,"synthetic"\n')
+            f.write('Fill Value (mean_GPM_3IMERGHH_07_precipitation):, -9999.9\n')
+            f.write('\n')
+            f.write('time, mean_GPM_3IMERGHH_07_precipitation\n')
+            pd.DataFrame({'time': times.strftime('%Y-%m-%d %H:%M:%S'), 'value': precipitation}).to_csv(
+                f, header=False, index=False, float_format='%.8f')
+        paths.append(path)
+    return paths
+
+
+def write_etc_pickles(folder, rng, start_year, years, etcs_per_year, regions):
+    """
+    Writes one pickle of ETC event dictionaries per year, named like 'east_ETCs_2012.pkl'.
+    :return: The path template with a '{year}' placeholder.
+    """
+    os.makedirs(folder, exist_ok=True)
+    storm_id = 0
+    for year in range(start_year, start_year + years):
+        starts = pd.Timestamp(f'{year}-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 365 * 4, etcs_per_year)) * 6, unit='h')
+        events = []
+        for start in starts:
+            length = int(rng.integers(4, 40))
+            lat = 30 + np.cumsum(rng.normal(0.3, 1.0, length))
+            lon = -100 + np.cumsum(rng.normal(1.5, 1.0, length))
+            storm_files = [f'{year}_{storm_id}_{step:03d}_{lat[step]:.2f}_{lon[step]:.2f}_slp.nc' for step in range(length)]
+            bomb = bool(rng.random() < 0.2)
+            bomb_start = int(rng.integers(0, length))
+            events.append({
+                'start_time': start.to_pydatetime(),
+                'end_time': (start + pd.Timedelta(hours=6 * (length - 1))).to_pydatetime(),
+                'region': str(rng.choice(regions)),
+                'bomb': bomb,
+                'bomb_in_mask': bomb and bool(rng.random() < 0.5),
+                'AR_bomb_concurrent': bomb and bool(rng.random() < 0.3),
+                'storm_id': storm_id,
+                'storm_files': storm_files,
+                'bomb_start_file': storm_files[bomb_start] if bomb else None,
+                'bomb_end_file': storm_files[min(bomb_start + 4, length - 1)] if bomb else None,
+            })
+            storm_id += 1
+        with open(os.path.join(folder, f'east_ETCs_{year}.pkl'), 'wb') as f:
+            pickle.dump(events, f)
+    return os.path.join(folder, 'east_ETCs_{year}.pkl')
+
+
+def fixture_paths(folder, size):
+    """
+    The paths of the fixtures of a size in a folder (see generate_fixtures).
+    """
+    start_year = size['start_year']
+    return {
+        'imerg_folder': os.path.join(folder, 'IMERG'),
+        'imerg_years': sorted({(pd.Timestamp(f'{start_year}-01-01') + pd.Timedelta(days=day)).year
+                               for day in range(size['imerg_days'])}),
+        'giss_folder': os.path.join(folder, 'GISS'),
+        'giss_years': sorted({start_year + m // 12 for m in range(size['giss_months'])}),
+        'mask_folder': os.path.join(folder, 'masks'),
+        'regrid_file': os.path.join(folder, 'regrid_giss_grid.nc'),
+        'regions': list(size['regions']),
+        'csv_files': [os.path.join(folder, 'giovanni', f'{year}.csv') for year in range(start_year, start_year + size['csv_years'])],
+        'etc_template': os.path.join(folder, 'ETCs', 'east_ETCs_{year}.pkl'),
+        'etc_years': (start_year, start_year + size['etc_years'] - 1),
+    }
+
+
+def generate_fixtures(folder, size):
+    """
+    Generates every fixture of a size in a folder, unless the folder already has the same fixtures.
+    :param folder: The fixture folder.
+    :param size: A dictionary of fixture parameters like fixture_sizes['small'].
+    :return: The fixture paths (see fixture_paths).
+    """
+    manifest_path = os.path.join(folder, 'fixture.json')
+    parameters = json.loads(json.dumps(size))
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            if json.load(f) == parameters:
+                return fixture_paths(folder, size)
+    os.makedirs(folder, exist_ok=True)
+    paths = fixture_paths(folder, size)
+    rng = np.random.default_rng(size['seed'])
+    start_year = size['start_year']
+    imerg_grid = (cell_centers(size['imerg_grid'][0], -90, 90), cell_centers(size['imerg_grid'][1], -180, 180))
+    giss_grid = (cell_centers(size['giss_grid'][0], -90, 90), cell_centers(size['giss_grid'][1], -180, 180))
+
+    write_imerg_granules(paths['imerg_folder'], rng, start_year, size['imerg_days'], size['imerg_grid'])
+    write_giss_months(paths['giss_folder'], rng, start_year, size['giss_months'], size['giss_grid'])
+    write_region_masks(paths['mask_folder'], size['regions'], [imerg_grid, giss_grid])
+    write_regrid_file(paths['regrid_file'], giss_grid)
+    write_giovanni_csvs(os.path.dirname(paths['csv_files'][0]), rng, start_year, size['csv_years'])
+    write_etc_pickles(os.path.dirname(paths['etc_template']), rng, start_year, size['etc_years'],
+                      size['etcs_per_year'], size['regions'])
+
+    # Written last, so an interrupted generation is redone on the next run
+    with open(manifest_path, 'w') as f:
+        json.dump(parameters, f, indent=1, sort_keys=True)
+    return paths
+
+#----------------------------------END OF FUNCTIONS--------------------------------#
@@ -2,7 +2,11 @@
 IMERG VS GISS COMPARISON
 --part of the IMERG-GISS-comparison script package--
 Description: This script takes intermediate files generated by saveIMERGfiles.py and saveGISSfiles.py 
-and generates visualizations and stats comparing IMERG and GISS data.
+and generates visualizations and stats comparing IMERG and GISS data. The files are read one month at
+a time into streaming accumulators (see streaming_stats.py), so memory use does not depend on the 
+number of years. The 95th and 99th percentiles are estimated to within 0.5%. The per-month summaries are
+saved in a summary store (see build_summary_store), so every mode, season and month after the first run 
+only merges small summaries instead of re-reading the intermediate files.
 
 Lily Donaldson [agency]<lily.k.donaldson@nasa.gov> [evergreen]<lilykdonaldson@gmail.com>
 January 2024, Developed with Python 3.9.13
@@ -42,6 +46,9 @@ This script takes the following user inputs which are set in the "USER INPUTS" s
 	   2020. If chosen_season is instead set to 'custom' and months_list is set to ['FEB','MAR','APR'], 
 	   visualizations will be created for February, March, and April collectively using data from 2019 and
 	   2020.
+	-- metrics_file: set this to a path like 'compare_metrics.jsonl' to record the time, I/O and memory of every 
+	   stage (summarizing a month, merging summaries, plotting; see stage_metrics.py) and print a summary table 
+	   at the end of the run. Set this to None to not record them.
 
 
 Example File Organization
@@ -65,6 +72,10 @@ import os
 import xarray as xr #developed with v.0.20.1
 import numpy as np #developed with v.1.24.3
 import matplotlib.pyplot as plt #developed with v.3.4.1
+from region_masks import load_region_values
+from streaming_stats import new_accumulator, add_values, merge_accumulators, accumulator_mean, accumulator_percentile, \
+	save_accumulators, load_accumulators
+from stage_metrics import stage, start_recording, print_metrics_summary
 
 #------------------------------------------------------------------#
 
@@ -84,13 +95,88 @@ mode = 'season'
 
 chosen_season = 'all' #this only needs to be changed if mode='season'
 months_list = ['ALL'] #this only needs to be changed if mode='month' or mode='season' and chosen_season = 'custom'
+metrics_file = None #set this to a path like 'compare_metrics.jsonl' to record the time of every stage
 
 #-------------------------END OF USER INPUTS----------------------------#
 
+# Histogram bins shared by GISS and IMERG (combined min and max of the data), 50 bins
+combined_min = -4.2454214e-17
+combined_max = 537.83997
+histogram_bins = np.linspace(combined_min, combined_max, 50)
+
 #---------------------------FUNCTIONS--------------------------------#
 
+def build_summary_store(years: list, regions: list, chosen_variable: str, GISS_data_folder: str, IMERG_data_folder: str, 
+	summary_folder: str):
+	"""
+	Summarizes every monthly intermediate file into a streaming accumulator (histogram counts, sum, count and 
+	quantile sketch, see streaming_stats.py) and saves the summaries to one file per dataset and region like
+	'{summary_folder}/IMERG_nyc_precipitation_summary.npz'. Months that are already summarized are only
+	re-read if their intermediate file has changed, so later runs for any mode do not re-read the data.
+	Missing intermediate files are skipped, and the saved summary of a month whose file was deleted or moved
+	is removed, so it is not merged any more.
+	:param years: List of years to summarize.
+	:param regions: a list of region names.
+	:param chosen_variable: The name of the variable the intermediate files contain. 
+	:param GISS_data_folder: Base path to the folder containing the GISS intermediate files.
+	:param IMERG_data_folder: Base path to the folder containing the IMERG intermediate files.
+	:param summary_folder: The folder where the summaries are saved.
+	:return: A dictionary keyed by (dataset, region) of dictionaries of accumulators keyed like '2012_01'.
+	"""
+	if not os.path.exists(summary_folder):
+		os.makedirs(summary_folder)
+	summaries = {}
+	for dataset, data_folder in [('GISS', GISS_data_folder), ('IMERG', IMERG_data_folder)]:
+		for region in regions:
+			summary_path = os.path.join(summary_folder, f'{dataset}_{region}_{chosen_variable}_summary.npz')
+			accumulators, source_mtimes = {}, {}
+			if os.path.exists(summary_path):
+				accumulators, source_mtimes = load_accumulators(summary_path)
+				if accumulators and not np.array_equal(next(iter(accumulators.values()))['bins'], histogram_bins):
+					# The histogram bins have changed, so every month has to be summarized again
+					accumulators, source_mtimes = {}, {}
+			updated = False
+			for year in years:
+				for month in range(1, 13):
+					key = f'{year}_{month:02d}'
+					file_name = f'{key}_{region}_{chosen_variable}.npz'
+					file_path = os.path.join(data_folder, f"{year}/{region}/", file_name)
+					if not os.path.exists(file_path):
+						if key in accumulators:
+							# The month's file was deleted or moved, so its saved summary is dropped as well
+							del accumulators[key]
+							source_mtimes.pop(f'{key}_mtime', None)
+							updated = True
+						continue
+					mtime = os.path.getmtime(file_path)
+					if key in accumulators and float(source_mtimes.get(f'{key}_mtime', -1)) == mtime:
+						continue
+					with stage('summarize_month', opened_paths=[file_path], read_paths=[file_path], dataset=dataset, region=region, year=year, month=month):
+						accumulators[key] = add_values(new_accumulator(histogram_bins), load_region_values(file_path))
+					source_mtimes[f'{key}_mtime'] = np.array(mtime)
+					updated = True
+			if updated:
+				with stage('save_summary', written_paths=[summary_path], dataset=dataset, region=region):
+					save_accumulators(summary_path, accumulators, source_mtimes)
+				print(f"--- updated monthly summaries for {dataset}, {region}.")
+			summaries[(dataset, region)] = accumulators
+	return summaries
+
+def merge_summary(summary: dict, keys: list):
+	"""
+	Merges the monthly accumulators of one dataset and region.
+	:param summary: A dictionary of accumulators keyed like '2012_01' from build_summary_store.
+	:param keys: The months to merge, like ['2012_01', '2013_01'].
+	"""
+	missing = [key for key in keys if key not in summary]
+	if missing:
+		raise FileNotFoundError(f"no intermediate files were found for {', '.join(missing)}.")
+	with stage('merge', months=len(keys)):
+		return merge_accumulators([summary[key] for key in keys])
+
 def createCompareViz(mode: str, years: list, regions: list, chosen_variable: str, GISS_data_folder: str, IMERG_data_folder: str, 
-	output_folder_path_base: str, chosen_season: str = '', months_list: list = [None]):
+	output_folder_path_base: str, chosen_season: str = '', months_list: list = [None], summary_folder: str = None, 
+	metrics_path: str = None):
 	"""
 	Creates histograms and statistical tables to compare GISS and IMERG data.
 	:param mode: The data visualization mode which can be month, year, single_year, or season.
@@ -102,6 +188,10 @@ def createCompareViz(mode: str, years: list, regions: list, chosen_variable: str
 	:param output_folder_path_base: Base path to the folder for saving output files.
 	:param chosen_season: The season to analyze when in season mode.
 	:param months_list: The list of months to analyze if in month mode or season mode with a custom season.
+	:param summary_folder: The folder for the monthly summary store (see build_summary_store). Defaults to a 
+	       'summary_store' folder inside output_folder_path_base.
+	:param metrics_path: A JSON lines file to record the time, I/O and memory of every stage in (see 
+	       stage_metrics.py). A summary table is printed at the end of the run. None records nothing.
 	"""
 	month_dict = {
 	    'JAN': '01',
@@ -131,122 +221,77 @@ def createCompareViz(mode: str, years: list, regions: list, chosen_variable: str
 	    'northeastcoast': 'Northeast USA Coast'
 	}
 	month_strings = [f'{i:02d}' for i in range(1, 13)]
+	if summary_folder is None:
+		summary_folder = os.path.join(output_folder_path_base, 'summary_store')
+	start_recording(metrics_path, reset=True)
+	# Every monthly .npz file is summarized once; each mode below only merges the monthly summaries it needs
+	summaries = build_summary_store(years, regions, chosen_variable, GISS_data_folder, IMERG_data_folder, summary_folder)
 	if mode=='single-year':
 		#histograms = []
 		for year in years:
 			for region in regions:
-				giss_values_list = []
-				imerg_values_list = []
-				base_folder = f"{year}/{region}/"
-				for month in month_strings:
-					file_name = f'{year}_{month}_{region}_{chosen_variable}.npz'
-					file_path = os.path.join(GISS_data_folder, base_folder, file_name)
-					data = np.load(file_path)
-					giss_values_list.append(data['all_values'].flatten())
-					file_path = os.path.join(IMERG_data_folder, base_folder, file_name)
-					data = np.load(file_path)
-					imerg_values_list.append(data['all_values'].flatten())
-				imerg_values_array = np.concatenate(imerg_values_list)
-				giss_values_array = np.concatenate(giss_values_list)
-				imerg_values_array = imerg_values_array[~np.isnan(imerg_values_array)]
-				giss_values_array = giss_values_array[~np.isnan(giss_values_array)]
+				keys = [f'{year}_{month}' for month in month_strings]
+				giss_stats = merge_summary(summaries[('GISS', region)], keys)
+				imerg_stats = merge_summary(summaries[('IMERG', region)], keys)
 				region_name = region_dict.get(region)
 				if region_name is None:
 				    region_name = region
 				title = f"{year} {region_name}"
-				print(f"--- finished data concatenation for {year}, {region}.")
+				print(f"--- finished merging monthly summaries for {year}, {region}.")
 				save_file = os.path.join(output_folder_path_base, f"{year}_{region}_singleyear_histogram.png")
-				histogramGISSIMERG(giss_values_array,imerg_values_array,title,save_file)
+				histogramGISSIMERG(giss_stats,imerg_stats,title,save_file)
 				save_file = os.path.join(output_folder_path_base, f"{year}_{region}_singleyear_table.png")
-				statsTableGISSIMERG(giss_values_array,imerg_values_array,title,save_file)
+				statsTableGISSIMERG(giss_stats,imerg_stats,title,save_file)
 				#histograms.append(save_file)
 	elif mode=='years':
 		for region in regions:
-			giss_values_list = []
-			imerg_values_list = []
-			for year in years:
-				base_folder = f"{year}/{region}/"
-				for month in month_strings:
-					file_name = f'{year}_{month}_{region}_{chosen_variable}.npz'
-					file_path = os.path.join(GISS_data_folder, base_folder, file_name)
-					data = np.load(file_path)
-					giss_values_list.append(data['all_values'].flatten())
-					file_path = os.path.join(IMERG_data_folder, base_folder, file_name)
-					data = np.load(file_path)
-					imerg_values_list.append(data['all_values'].flatten())
-			imerg_values_array = np.concatenate(imerg_values_list)
-			giss_values_array = np.concatenate(giss_values_list)
-			imerg_values_array = imerg_values_array[~np.isnan(imerg_values_array)]
-			giss_values_array = giss_values_array[~np.isnan(giss_values_array)]
+			keys = [f'{year}_{month}' for year in years for month in month_strings]
+			giss_stats = merge_summary(summaries[('GISS', region)], keys)
+			imerg_stats = merge_summary(summaries[('IMERG', region)], keys)
 			region_name = region_dict.get(region)
 			if region_name is None:
 				region_name = region
 			title = f"{years[0]}-{years[-1]} {region_name}"
-			print(f"--- finished data concatenation for {years}, {region}.")
-			print("GISS: ",len(giss_values_array))
-			print("IMERG: ",len(imerg_values_array))
+			print(f"--- finished merging monthly summaries for {years}, {region}.")
+			print("GISS: ",giss_stats['count'])
+			print("IMERG: ",imerg_stats['count'])
 			save_file = os.path.join(output_folder_path_base, f"{years[0]}-{years[-1]}_{region}_severalyears_histogram.png")
-			histogramGISSIMERG(giss_values_array,imerg_values_array,title,save_file)
+			histogramGISSIMERG(giss_stats,imerg_stats,title,save_file)
 			save_file = os.path.join(output_folder_path_base, f"{years[0]}-{years[-1]}_{region}_severalyears_table.png")
-			statsTableGISSIMERG(giss_values_array,imerg_values_array,title,save_file)
+			statsTableGISSIMERG(giss_stats,imerg_stats,title,save_file)
 	elif mode=='month':
 		for region in regions:
 			if "ALL" in months_list:
 				months_list = ['JAN','FEB','MAR','APR','MAY','JUN','JUL','AUG','SEP','OCT','NOV','DEC']
 			for month in months_list:
-				giss_values_list = []
-				imerg_values_list = []
-				for year in years:
-						base_folder = f"{year}/{region}/"
-						file_name = f'{year}_{month_dict.get(month)}_{region}_{chosen_variable}.npz'
-						file_path = os.path.join(GISS_data_folder, base_folder, file_name)
-						data = np.load(file_path)
-						giss_values_list.append(data['all_values'].flatten())
-						file_path = os.path.join(IMERG_data_folder, base_folder, file_name)
-						data = np.load(file_path)
-						imerg_values_list.append(data['all_values'].flatten())
-				imerg_values_array = np.concatenate(imerg_values_list)
-				giss_values_array = np.concatenate(giss_values_list)
-				imerg_values_array = imerg_values_array[~np.isnan(imerg_values_array)]
-				giss_values_array = giss_values_array[~np.isnan(giss_values_array)]
+				keys = [f'{year}_{month_dict.get(month)}' for year in years]
+				giss_stats = merge_summary(summaries[('GISS', region)], keys)
+				imerg_stats = merge_summary(summaries[('IMERG', region)], keys)
 				region_name = region_dict.get(region)
 				if region_name is None:
 					region_name = region
 				title = f"{month}, {years[0]}-{years[-1]} {region_name}"
-				print(f"--- finished data concatenation for {month}, {region}.")
+				print(f"--- finished merging monthly summaries for {month}, {region}.")
 				save_file = os.path.join(output_folder_path_base, f"{month}_{years[0]}-{years[-1]}_{region}_histogram.png")
-				histogramGISSIMERG(giss_values_array,imerg_values_array,title,save_file)
+				histogramGISSIMERG(giss_stats,imerg_stats,title,save_file)
 				save_file = os.path.join(output_folder_path_base, f"{month}_{years[0]}-{years[-1]}_{region}_table.png")
-				statsTableGISSIMERG(giss_values_array,imerg_values_array,title,save_file)
+				statsTableGISSIMERG(giss_stats,imerg_stats,title,save_file)
 			
 	elif mode =='season':
 		def season_mode():
 			for region in regions:
-				giss_values_list = []
-				imerg_values_list = []
-				for month in months_list:
-					for year in years:
-						base_folder = f"{year}/{region}/"
-						file_name = f'{year}_{month_dict.get(month)}_{region}_{chosen_variable}.npz'
-						file_path = os.path.join(GISS_data_folder, base_folder, file_name)
-						data = np.load(file_path)
-						giss_values_list.append(data['all_values'].flatten())
-						file_path = os.path.join(IMERG_data_folder, base_folder, file_name)
-						data = np.load(file_path)
-						imerg_values_list.append(data['all_values'].flatten())
-				imerg_values_array = np.concatenate(imerg_values_list)
-				giss_values_array = np.concatenate(giss_values_list)
-				imerg_values_array = imerg_values_array[~np.isnan(imerg_values_array)]
-				giss_values_array = giss_values_array[~np.isnan(giss_values_array)]
+				keys = [f'{year}_{month_dict.get(month)}' for month in months_list for year in years]
+				giss_stats = merge_summary(summaries[('GISS', region)], keys)
+				imerg_stats = merge_summary(summaries[('IMERG', region)], keys)
 				region_name = region_dict.get(region)
 				if region_name is None:
 					region_name = region
 				title = f"{chosen_season}, {years[0]}-{years[-1]} {region_name}"
-				print(f"--- finished data concatenation for {chosen_season}, {region}.")
+				print(f"--- finished merging monthly summaries for {chosen_season}, {region}.")
 				save_file = os.path.join(output_folder_path_base, f"{chosen_season}_{years[0]}-{years[-1]}_{region}_histogram.png")
-				histogramGISSIMERG(giss_values_array,imerg_values_array,title,save_file)
+				histogramGISSIMERG(giss_stats,imerg_stats,title,save_file)
 				save_file = os.path.join(output_folder_path_base, f"{chosen_season}_{years[0]}-{years[-1]}_{region}_table.png")
-				statsTableGISSIMERG(giss_values_array,imerg_values_array,title,save_file)
+				statsTableGISSIMERG(giss_stats,imerg_stats,title,save_file)
 		if chosen_season == "winter":
 			months_list = ['DEC','JAN','FEB']
 		elif chosen_season == "spring":
@@ -282,50 +327,52 @@ def createCompareViz(mode: str, years: list, regions: list, chosen_variable: str
 			season_mode()
 	else:
 		print("invalid mode")
+	if metrics_path:
+		print_metrics_summary(metrics_path)
+		start_recording(None)
 
 
-def histogramGISSIMERG(giss_data, imerg_data, title, output_path):
-    # Calculate statistics
-    giss_avg, giss_95th, giss_99th = np.mean(giss_data), np.percentile(giss_data, 95), np.percentile(giss_data, 99)
-    imerg_avg, imerg_95th, imerg_99th = np.mean(imerg_data), np.percentile(imerg_data, 95), np.percentile(imerg_data, 99)
+def histogramGISSIMERG(giss_stats, imerg_stats, title, output_path):
+    with stage('histogram', title=title):
+        # Calculate statistics from the streaming accumulators (see streaming_stats.py)
+        giss_avg, giss_95th, giss_99th = accumulator_mean(giss_stats), accumulator_percentile(giss_stats, 95), accumulator_percentile(giss_stats, 99)
+        imerg_avg, imerg_95th, imerg_99th = accumulator_mean(imerg_stats), accumulator_percentile(imerg_stats, 95), accumulator_percentile(imerg_stats, 99)
 
-    # Determine combined bins
-    combined_min =  -4.2454214e-17 #min(np.min(giss_data), np.min(imerg_data))
-    combined_max = 537.83997 #max(np.max(giss_data), np.max(imerg_data))
-    bins = np.linspace(combined_min, combined_max, 50)  # 50 bins
+        # Both accumulators use the combined histogram_bins
+        bins = histogram_bins
 
-    # Plot histograms with the same bins
-    plt.hist(imerg_data, bins=bins, log=True, density=True, alpha=0.5, color='blue', label='IMERG')
-    plt.hist(giss_data, bins=bins, log=True, density=True, alpha=0.5, color='red', label='GISS')
+        # Plot histograms with the same bins
+        plt.hist(bins[:-1], bins=bins, weights=imerg_stats['hist_counts'], log=True, density=True, alpha=0.5, color='blue', label='IMERG')
+        plt.hist(bins[:-1], bins=bins, weights=giss_stats['hist_counts'], log=True, density=True, alpha=0.5, color='red', label='GISS')
 
-    # Add percentile lines with labels for the legend
-    plt.axvline(x=giss_99th, color='red', linestyle='dotted', label='GISS 99th percentile')
-    plt.axvline(x=imerg_99th, color='blue', linestyle='dotted', label='IMERG 99th percentile')
+        # Add percentile lines with labels for the legend
+        plt.axvline(x=giss_99th, color='red', linestyle='dotted', label='GISS 99th percentile')
+        plt.axvline(x=imerg_99th, color='blue', linestyle='dotted', label='IMERG 99th percentile')
 
-    # Plot settings
-    title = "GISS vs IMERG Precipitation | " + title
-    plt.title(title)
-    plt.xlabel('Precipitation (mm/day)')
-    plt.ylabel('Density (log scale)')
-    plt.legend()
+        # Plot settings
+        title = "GISS vs IMERG Precipitation | " + title
+        plt.title(title)
+        plt.xlabel('Precipitation (mm/day)')
+        plt.ylabel('Density (log scale)')
+        plt.legend()
 
-    plt.xlim(0, 550)
-    plt.ylim(10**-5.5, 1e-1)
+        plt.xlim(0, 550)
+        plt.ylim(10**-5.5, 1e-1)
 
-    # Add average text on the right side of the plot
-    plt.text(0.66, 0.53, f'GISS Avg: {giss_avg:.2f}\nIMERG Avg: {imerg_avg:.2f}\n\nGISS 95th %: {giss_95th:.2f}\nIMERG 95th %: {imerg_95th:.2f}\n\nGISS 99th %: {giss_99th:.2f}\nIMERG 99th %: {imerg_99th:.2f}', 
-             horizontalalignment='left', verticalalignment='center', 
-             transform=plt.gca().transAxes, color='black', fontsize=7)
+        # Add average text on the right side of the plot
+        plt.text(0.66, 0.53, f'GISS Avg: {giss_avg:.2f}\nIMERG Avg: {imerg_avg:.2f}\n\nGISS 95th %: {giss_95th:.2f}\nIMERG 95th %: {imerg_95th:.2f}\n\nGISS 99th %: {giss_99th:.2f}\nIMERG 99th %: {imerg_99th:.2f}', 
+                 horizontalalignment='left', verticalalignment='center', 
+                 transform=plt.gca().transAxes, color='black', fontsize=7)
 
-    # Show plot for visualization in this context
-    plt.show()
+        # Show plot for visualization in this context
+        plt.show()
 
-    # # Uncomment the following lines if saving the plot is desired
-    # plt.savefig(output_path, dpi=300)
-    # print(f"Saved plot to {output_path}.")
-    plt.close()
+        # # Uncomment the following lines if saving the plot is desired
+        # plt.savefig(output_path, dpi=300)
+        # print(f"Saved plot to {output_path}.")
+        plt.close()
 
-def statsTableGISSIMERG(giss_data,imerg_data,title,output_path):
+def statsTableGISSIMERG(giss_stats,imerg_stats,title,output_path):
 	pass
 
 #----------------------------------END OF FUNCTIONS--------------------------------#
@@ -334,7 +381,8 @@ def statsTableGISSIMERG(giss_data,imerg_data,title,output_path):
 #-------------------------------MAIN CODE-----------------------------------#
 if __name__ == "__main__":
 	years = list(range(start_year, end_year+1))
-	createCompareViz(mode, years,regions, variable_name, GISS_data_folder, IMERG_data_folder, output_folder, chosen_season, months_list) 
+	createCompareViz(mode, years,regions, variable_name, GISS_data_folder, IMERG_data_folder, output_folder, chosen_season, months_list, 
+		metrics_path=metrics_file) 
 
 #---------------------------------END OF MAIN CODE---------------------------------#
 
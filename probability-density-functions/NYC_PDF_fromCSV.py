@@ -1,63 +1,130 @@
-import pandas as pd
-import matplotlib.pyplot as plt
 import os
+import sys
 import calendar
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+# The Giovanni CSV reader and its binary cache are shared with the top-precipitation-events scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'top-precipitation-events'))
+from precipitation_events import read_giovanni_files
 
 # Path to the folder containing the CSV files
 folder_path = '/Users/lilydonaldson/Downloads/examples/current_scripts/NYC_IMERG_Data'
 
-# Initialize an empty DataFrame to store all data
-all_data = pd.DataFrame()
-
-# Loop through each year from 2001 to 2023
-for year in range(2001, 2023):
-    file_path = os.path.join(folder_path, f'{year}.csv')
-    # Read the CSV file, skipping the first 9 rows (metadata)
-    yearly_data = pd.read_csv(file_path, skiprows=9)
-    # Assume the first column is the timestamp and the second is precipitation
-    yearly_data.columns = ['Timestamp', 'Precipitation']
-    # Convert Timestamp to datetime
-    yearly_data['Timestamp'] = pd.to_datetime(yearly_data['Timestamp'])
-    # Append to the main DataFrame
-    all_data = all_data.append(yearly_data)
+# Read the CSV files for each year from 2001 to 2022 (each CSV is parsed once, later runs memory-map the cache)
+file_paths = [os.path.join(folder_path, f'{year}.csv') for year in range(2001, 2023)]
+times, precipitation = zip(*read_giovanni_files(file_paths))
+all_data = pd.DataFrame({'Timestamp': np.concatenate(times), 'Precipitation': np.concatenate(precipitation)})
 
-# Function to annotate percentiles on the plot
-def annotate_percentiles(ax, data, color='red'):
-    for percentile in [95, 99]:
-        value = data.quantile(percentile / 100)
-        ax.axvline(value, color=color, linestyle='dashed', linewidth=1)
-        ax.text(value, 0.3, f'{percentile}th percentile: {value:.2f}', rotation=45, color=color)
+# Which histograms to plot: 'all' (2001-2022 combined), 'month', 'season' and/or 'year'
+groupings_to_plot = ['all', 'month']
 
 # Directory for saving plots
 plots_dir = '/Users/lilydonaldson/Downloads/examples/current_scripts/NYC_IMERG_Plots'
 os.makedirs(plots_dir, exist_ok=True)
 
-# Histogram for the combined data (2001-2022)
-plt.figure(figsize=(10, 6))
-plt.hist(all_data['Precipitation'], bins=50, log=True, density=True)
-plt.title('NYC Precipitation Histogram (2001-2022)')
-plt.xlabel('Precipitation (mm/hour)')
-plt.ylabel('Density')
-plt.xlim(0, 11)
-plt.ylim(10**-4, 10**1)
-ax = plt.gca()
-annotate_percentiles(ax, all_data['Precipitation'])
-plt.savefig(os.path.join(plots_dir, 'NYC_Precipitation_Histogram_2001_2022.png'))
-plt.close()
-
-# Histograms for each month across all years
-for month in range(1, 13):
-    monthly_data = all_data[all_data['Timestamp'].dt.month == month]
+# Histograms and percentiles of every group at once
+# values: 1D array, groups: integer group codes (0 to n_groups - 1) with the same length
+# Each group gets its own bins over its own range and density, the same as plt.hist(..., bins=bins, density=True),
+# and linearly interpolated percentiles, the same as pandas quantile. NaN values are ignored.
+# Values are sorted once (pass the result of np.argsort(values) as value_order to reuse it for other groupings);
+# grouping the sorted values is a stable sort of the small integer codes, and all histograms come from one bincount.
+def grouped_histograms(values, groups, n_groups, bins=50, percentiles=(95, 99), value_order=None):
+    values = np.asarray(values, dtype=np.float64)
+    groups = np.asarray(groups)
+    if value_order is None:
+        value_order = np.argsort(values, kind='stable')
+    value_order = value_order[~np.isnan(values[value_order])]
+    order = value_order[np.argsort(groups[value_order], kind='stable')]
+    sorted_values = values[order]
+    sorted_groups = groups[order]
+
+    counts = np.bincount(sorted_groups, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    present = counts > 0
+    lowest = np.where(present, sorted_values[np.minimum(starts, len(order) - 1)], 0.0)
+    highest = np.where(present, sorted_values[np.clip(starts + counts - 1, 0, len(order) - 1)], 1.0)
+    # Like np.histogram, a group with a single distinct value gets the range value - 0.5 to value + 0.5
+    single = lowest == highest
+    lowest = np.where(single, lowest - 0.5, lowest)
+    highest = np.where(single, highest + 0.5, highest)
+    edges = lowest[:, np.newaxis] + (highest - lowest)[:, np.newaxis] * np.linspace(0, 1, bins + 1)
+
+    # Bin index of every value from its group's range, corrected for rounding at the edges as np.histogram does
+    bin_index = ((sorted_values - lowest[sorted_groups]) / (highest - lowest)[sorted_groups] * bins).astype(np.int64)
+    np.clip(bin_index, 0, bins - 1, out=bin_index)
+    bin_index[sorted_values < edges[sorted_groups, bin_index]] -= 1
+    above = (sorted_values >= edges[sorted_groups, bin_index + 1]) & (bin_index != bins - 1)
+    bin_index[above] += 1
+    hist_counts = np.bincount(sorted_groups * bins + bin_index, minlength=n_groups * bins).reshape(n_groups, bins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        density = hist_counts / (counts[:, np.newaxis] * np.diff(edges, axis=1))
+
+    # Percentiles by linear interpolation between the sorted values of each group
+    position = starts[:, np.newaxis] + np.asarray(percentiles) / 100 * (counts[:, np.newaxis] - 1)
+    lower = np.clip(np.floor(position).astype(np.int64), 0, len(order) - 1)
+    upper = np.clip(np.minimum(lower + 1, (starts + counts - 1)[:, np.newaxis]), 0, len(order) - 1)
+    percentile_values = sorted_values[lower] + (position - lower) * (sorted_values[upper] - sorted_values[lower])
+    percentile_values[~present] = np.nan
+
+    return {'counts': counts, 'edges': edges, 'hist_counts': hist_counts, 'density': density,
+            'percentiles': percentile_values}
+
+# Group codes and names of each grouping
+def grouping_codes(timestamps, grouping):
+    timestamps = pd.DatetimeIndex(timestamps)
+    if grouping == 'all':
+        return np.zeros(len(timestamps), dtype=np.int64), ['2001-2022']
+    if grouping == 'month':
+        return timestamps.month.values - 1, list(calendar.month_name[1:])
+    if grouping == 'season':
+        return (timestamps.month.values % 12) // 3, ['DJF', 'MAM', 'JJA', 'SON']
+    if grouping == 'year':
+        years = timestamps.year.values
+        return years - years.min(), [str(year) for year in range(years.min(), years.max() + 1)]
+    raise ValueError(f"unknown grouping '{grouping}'.")
+
+# Function to annotate percentiles on the plot
+def annotate_percentiles(ax, percentile_values, percentiles=(95, 99), color='red'):
+    for percentile, value in zip(percentiles, percentile_values):
+        ax.axvline(value, color=color, linestyle='dashed', linewidth=1)
+        ax.text(value, 0.3, f'{percentile}th percentile: {value:.2f}', rotation=45, color=color)
+
+# Draws a histogram from precomputed densities (the same bars plt.hist draws)
+def plot_histogram(edges, density, percentile_values, title, output_path):
     plt.figure(figsize=(10, 6))
-    plt.hist(monthly_data['Precipitation'], bins=50, log=True, density=True)
-    # Use calendar module to get month name
-    month_name = calendar.month_name[month]
-    plt.title(f'NYC Precipitation Histogram for {month_name} (2001-2022)')
+    plt.hist(edges[:-1], bins=edges, weights=np.nan_to_num(density), log=True)
+    plt.title(title)
     plt.xlabel('Precipitation (mm/hour)')
     plt.ylabel('Density')
     plt.xlim(0, 11)
     plt.ylim(10**-4, 10**1)
     ax = plt.gca()
-    annotate_percentiles(ax, monthly_data['Precipitation'])
-    plt.savefig(os.path.join(plots_dir, f'NYC_Precipitation_Histogram_{month_name}_2001_2022.png'))
+    annotate_percentiles(ax, percentile_values)
+    plt.savefig(output_path)
     plt.close()
+
+# The values are sorted once and reused for every grouping
+precipitation_values = all_data['Precipitation'].to_numpy(dtype=np.float64)
+value_order = np.argsort(precipitation_values, kind='stable')
+
+for grouping in groupings_to_plot:
+    codes, names = grouping_codes(all_data['Timestamp'], grouping)
+    histograms = grouped_histograms(precipitation_values, codes, len(names), bins=50, value_order=value_order)
+    for code, name in enumerate(names):
+        if histograms['counts'][code] == 0:
+            continue
+        if grouping == 'all':
+            # Histogram for the combined data (2001-2022)
+            title = 'NYC Precipitation Histogram (2001-2022)'
+            file_name = 'NYC_Precipitation_Histogram_2001_2022.png'
+        elif grouping == 'year':
+            title = f'NYC Precipitation Histogram for {name}'
+            file_name = f'NYC_Precipitation_Histogram_{name}.png'
+        else:
+            # Histograms for each month (or season) across all years
+            title = f'NYC Precipitation Histogram for {name} (2001-2022)'
+            file_name = f'NYC_Precipitation_Histogram_{name}_2001_2022.png'
+        plot_histogram(histograms['edges'][code], histograms['density'][code], histograms['percentiles'][code],
+                       title, os.path.join(plots_dir, file_name))
@@ -0,0 +1,208 @@
+'''
+Monthly Aggregates
+--part of the IMERG-GISS-comparison script package--
+Description: This script builds season and year average fields from the monthly _average.nc files written by
+saveIMERGfiles.py and saveGISSfiles.py, so coarser averages do not need the raw subdaily data again. Each
+monthly average is weighted by its 'count' variable (the number of valid values of every cell in the month),
+so the result is the same as averaging every value of the season at once: a month with missing granules
+or NaN cells counts for less. For _average.nc files written before the savers stored counts, the counts
+are taken from the month's .npz file instead.
+	-- A season is a name ('winter', 'spring', 'summer', 'fall' as in IMERG_GISS_hist_stats.py, or 'annual'),
+	   a run of month initials like 'DJF', 'MAM' or 'NDJFM', or a list of months like ['FEB', 'MAR', 'APR']
+	   or [2, 3, 4].
+	-- Seasons that run over the end of the year belong to the year they end in: DJF 2013 is December 2012
+	   to February 2013.
+	-- Every aggregate is saved to an 'aggregates' folder inside the data folder the first time it is
+	   requested and reused until a monthly file it was made from changes, so a new season over the whole
+	   monthly archive costs one read of one small grid per month.
+
+Lily Donaldson [agency]<lily.k.donaldson@nasa.gov> [evergreen]<lilykdonaldson@gmail.com>
+January 2024, Developed with Python 3.9.13
+
+This script takes the following user inputs which are set in the "USER INPUTS" section:
+	-- start_year and end_year: the first and last year of the seasons to average.
+	-- data_folder: the output_folder of saveIMERGfiles.py or saveGISSfiles.py.
+	-- regions: a list of regions that have monthly files in data_folder.
+	-- variable_name: the name of the variable in the monthly files, likely 'precipitation'.
+	-- seasons: a list of seasons to average (see above).
+
+Example:
+	aggregate = open_aggregate(data_folder, 'northeast', 'precipitation', range(2012, 2023), 'DJF')
+	aggregate['precipitation'].sel(year=2015).plot()
+	aggregate['period_precipitation'].plot()
+'''
+
+#---------------------------IMPORTS--------------------------------#
+import os
+import xarray as xr #developed with v.0.20.1
+import numpy as np #developed with v.1.24.3
+from region_masks import region_value_counts
+
+#------------------------------------------------------------------#
+
+#---------------------------USER INPUTS--------------------------------#
+start_year = 2012
+end_year = 2022
+data_folder = "/Users/lilydonaldson/Downloads/examples/data/IMERG/IMERG_regrid/lastpass_regridded"
+regions = [
+	'northeast'
+]
+variable_name = "precipitation"
+seasons = ['DJF', 'MAM', 'JJA', 'SON', 'annual']
+#-------------------------END OF USER INPUTS----------------------------#
+
+month_names = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+named_seasons = {
+	'winter': [12, 1, 2],
+	'spring': [3, 4, 5],
+	'summer': [6, 7, 8],
+	'fall': [9, 10, 11],
+	'annual': list(range(1, 13)),
+}
+
+#---------------------------FUNCTIONS--------------------------------#
+
+def season_months(season):
+	"""
+	Returns the months (1-12) of a season in order (see the description at the top of this script).
+	:param season: A season name, a run of month initials like 'DJF', or a list of month names or numbers.
+	"""
+	if isinstance(season, str):
+		if season in named_seasons:
+			return named_seasons[season]
+		initials = ''.join(name[0] for name in month_names)
+		for start in range(12):
+			if season and season.upper() == (initials * 2)[start:start + len(season)] and len(season) <= 12:
+				return [(start + i) % 12 + 1 for i in range(len(season))]
+		raise ValueError(f'unknown season {season!r}')
+	months = [month_names.index(month) + 1 if isinstance(month, str) else int(month) for month in season]
+	if not months or any(month < 1 or month > 12 for month in months):
+		raise ValueError(f'invalid months {season!r}')
+	return months
+
+def season_label(season):
+	"""
+	Returns the name used for a season in filenames, like 'DJF' or 'FEB-MAR-APR'.
+	:param season: A season (see season_months).
+	"""
+	if isinstance(season, str):
+		return season
+	return '-'.join(month_names[month - 1] for month in season_months(season))
+
+def season_year_months(season, year: int):
+	"""
+	Returns the (year, month) pairs of a season. Months after the last month of a season that runs over the
+	end of the year are in the year before.
+	:param season: A season (see season_months).
+	:param year: The year of the season.
+	"""
+	months = season_months(season)
+	wraps = any(later < earlier for earlier, later in zip(months, months[1:]))
+	return [(year - 1 if wraps and month > months[-1] else year, month) for month in months]
+
+def monthly_file_paths(data_folder: str, year: int, month: int, region: str, variable: str):
+	"""
+	Returns the paths of the _average.nc and .npz files of a month, named as in the savers.
+	"""
+	base = os.path.join(data_folder, str(year), region, f"{year}_{month:02d}_{region}_{variable}")
+	return base + '_average.nc', base + '.npz'
+
+def read_monthly_average(data_folder: str, year: int, month: int, region: str, variable: str):
+	"""
+	Reads the average and the valid value counts of a month.
+	:return: A tuple (average, counts) where average is a (lat, lon) DataArray and counts a (lat, lon) array.
+	"""
+	nc_path, npz_path = monthly_file_paths(data_folder, year, month, region, variable)
+	with xr.open_dataset(nc_path) as dataset:
+		average = dataset[variable].transpose('lat', 'lon').load()
+		if 'count' in dataset:
+			counts = dataset['count'].transpose('lat', 'lon').values
+		else:
+			counts = region_value_counts(npz_path)
+	return average, counts
+
+def aggregate_months(data_folder: str, region: str, variable: str, years: list, season='annual'):
+	"""
+	Averages the monthly files of a season for every year and over all of the years, weighting every month by
+	its valid value counts. Missing months are left out (see 'num_of_months').
+	:param data_folder: The output folder of the saver.
+	:param region: The region name.
+	:param variable: The variable name in the monthly files.
+	:param years: The years of the seasons.
+	:param season: A season (see season_months).
+	:return: An xarray Dataset with the season average of every year (year, lat, lon) as the variable, 'count'
+	         (year, lat, lon), 'num_of_months' (year), and the average and counts over all years as
+	         'period_{variable}' and 'period_count' (lat, lon).
+	"""
+	years = list(years)
+	sums = None
+	for y, year in enumerate(years):
+		for month_year, month in season_year_months(season, year):
+			if not os.path.exists(monthly_file_paths(data_folder, month_year, month, region, variable)[0]):
+				continue
+			average, counts = read_monthly_average(data_folder, month_year, month, region, variable)
+			if sums is None:
+				lat, lon, attrs = average['lat'].values, average['lon'].values, average.attrs
+				sums = np.zeros((len(years),) + counts.shape)
+				totals = np.zeros((len(years),) + counts.shape, dtype=np.int64)
+				num_of_months = np.zeros(len(years), dtype=np.int64)
+			# A month's sum is its average times its count; cells without values add nothing
+			sums[y] += np.where(counts > 0, np.nan_to_num(average.values) * counts, 0)
+			totals[y] += counts
+			num_of_months[y] += 1
+	if sums is None:
+		raise FileNotFoundError(f'no monthly files for {region} {season_label(season)} {years[0]}-{years[-1]} in {data_folder}')
+
+	with np.errstate(invalid='ignore', divide='ignore'):
+		means = (sums / totals).astype(np.float32)
+		period_mean = (sums.sum(axis=0) / totals.sum(axis=0)).astype(np.float32)
+	return xr.Dataset(
+		data_vars={
+			variable: (['year', 'lat', 'lon'], means, attrs),
+			'count': (['year', 'lat', 'lon'], totals),
+			'num_of_months': (['year'], num_of_months),
+			f'period_{variable}': (['lat', 'lon'], period_mean, attrs),
+			'period_count': (['lat', 'lon'], totals.sum(axis=0)),
+		},
+		coords={'year': years, 'lat': lat, 'lon': lon},
+		attrs={'season': season_label(season), 'months': season_months(season)},
+	)
+
+def open_aggregate(data_folder: str, region: str, variable: str, years: list, season='annual', aggregate_folder: str = None):
+	"""
+	Loads a saved aggregate, building and saving it first if it does not exist or a monthly file it is made
+	from is newer. The parameters are the same as aggregate_months.
+	:param aggregate_folder: The folder of the saved aggregates. Defaults to an 'aggregates' folder inside data_folder.
+	"""
+	years = list(years)
+	if aggregate_folder is None:
+		aggregate_folder = os.path.join(data_folder, 'aggregates')
+	aggregate_path = os.path.join(aggregate_folder,
+		f"{years[0]}-{years[-1]}_{season_label(season)}_{region}_{variable}_aggregate.nc")
+	sources = [path for year in years for month_year, month in season_year_months(season, year)
+		for path in monthly_file_paths(data_folder, month_year, month, region, variable) if os.path.exists(path)]
+	if os.path.exists(aggregate_path) and sources and \
+		os.path.getmtime(aggregate_path) >= max(os.path.getmtime(path) for path in sources):
+		with xr.open_dataset(aggregate_path) as aggregate:
+			if aggregate.sizes['year'] == len(years) and aggregate['num_of_months'].sum() == \
+				sum(path.endswith('_average.nc') for path in sources):
+				return aggregate.load()
+	aggregate = aggregate_months(data_folder, region, variable, years, season)
+	if not os.path.exists(aggregate_folder):
+		os.makedirs(aggregate_folder)
+	aggregate.to_netcdf(aggregate_path)
+	return aggregate
+
+#----------------------------------END OF FUNCTIONS--------------------------------#
+
+
+#-------------------------------MAIN CODE-----------------------------------#
+if __name__ == "__main__":
+	years = list(range(start_year, end_year+1))
+	for region in regions:
+		for season in seasons:
+			aggregate = open_aggregate(data_folder, region, variable_name, years, season)
+			print(f"--- {season_label(season)} {years[0]}-{years[-1]} {region}: "
+				f"{int(aggregate['num_of_months'].sum())} months, mean {float(aggregate[f'period_{variable_name}'].mean()):.4f}")
+
+#---------------------------------END OF MAIN CODE---------------------------------#
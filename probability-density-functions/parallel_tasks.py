@@ -0,0 +1,87 @@
+'''
+Parallel Task Runner
+--part of the IMERG-GISS-comparison script package--
+Description: This script contains the helper used by saveIMERGfiles.py and saveGISSfiles.py to run
+independent (year, month) processing units either serially or on a pool of worker processes. Every
+unit writes its own deterministically named output files, so units can finish in any order. A unit that
+raises an error is reported and recorded instead of stopping the whole run.
+
+Lily Donaldson [agency]<lily.k.donaldson@nasa.gov> [evergreen]<lilykdonaldson@gmail.com>
+January 2024, Developed with Python 3.9.13
+'''
+
+#---------------------------IMPORTS--------------------------------#
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+#------------------------------------------------------------------#
+
+#---------------------------FUNCTIONS--------------------------------#
+
+def report_progress(completed: int, total: int, label: str, message: str, start_time: float):
+	"""
+	Prints one progress line for a finished (or failed) task.
+	:param completed: Number of tasks finished so far, including this one.
+	:param total: Total number of tasks in the run.
+	:param label: A short description of the task such as 'January 2012'.
+	:param message: The status message for the task.
+	:param start_time: time.time() at the start of the run, used for the elapsed time.
+	"""
+	elapsed = time.time() - start_time
+	print(f'[{completed}/{total}] {label}: {message} ({elapsed:.1f}s elapsed)')
+
+
+def _run_task(task_function, task):
+	# Runs one task and converts any error into a returned message so a worker never dies on bad input
+	try:
+		return task_function(*task), None
+	except Exception:
+		return None, traceback.format_exc()
+
+
+def run_tasks(task_function, tasks: list, labels: list, workers: int = 1):
+	"""
+	Runs task_function(*task) for every task, either serially (workers=1) or on a process pool.
+	task_function must be a module-level function so it can be sent to worker processes.
+	:param task_function: The function to call for each task.
+	:param tasks: A list of argument tuples, one per task.
+	:param labels: A list of task descriptions (same length as tasks) used in progress messages.
+	:param workers: Number of worker processes. 1 runs everything in the current process.
+	:return: A tuple (results, failures) where results maps task label to the task's return value
+	         and failures maps task label to the error traceback for tasks that raised an error.
+	"""
+	results = {}
+	failures = {}
+	total = len(tasks)
+	start_time = time.time()
+
+	def record(label, result, error, completed):
+		if error is None:
+			results[label] = result
+			report_progress(completed, total, label, 'completed', start_time)
+		else:
+			failures[label] = error
+			report_progress(completed, total, label, 'FAILED\n' + error, start_time)
+
+	if workers is None or workers <= 1:
+		for completed, (task, label) in enumerate(zip(tasks, labels), start=1):
+			result, error = _run_task(task_function, task)
+			record(label, result, error, completed)
+	else:
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			futures = {executor.submit(_run_task, task_function, task): label for task, label in zip(tasks, labels)}
+			for completed, future in enumerate(as_completed(futures), start=1):
+				label = futures[future]
+				try:
+					result, error = future.result()
+				except Exception:
+					# The worker process itself died (for example, killed for memory)
+					result, error = None, traceback.format_exc()
+				record(label, result, error, completed)
+
+	if failures:
+		print(f'{len(failures)} of {total} tasks failed: {", ".join(failures)}')
+	return results, failures
+
+#----------------------------------END OF FUNCTIONS--------------------------------#
@@ -0,0 +1,149 @@
+'''
+Region Masks
+--part of the IMERG-GISS-comparison script package--
+Description: This script contains the region mask registry shared by saveIMERGfiles.py and saveGISSfiles.py.
+Each region mask is opened once per process, aligned to the grid of the data it is applied to, and kept as
+a boolean (lat, lon) array together with the flat indices of the cells inside the region. Applying a mask is
+then a NumPy boolean/index gather instead of an xr.where over the full global grid. The region 'global' needs
+no mask file and covers every cell of the grid.
+
+The .npz files written by the savers store only the cells inside the region (see save_region_values):
+	-- cells: the flat indices (into the lat x lon grid) of the in-region cells
+	-- values: a (num_of_datapoints, num_of_cells) array with the values of those cells
+	-- shape: the (lat, lon) shape of the full grid
+	-- mask_hash: identifies the region mask and grid the cells were selected with
+load_region_values reads these files as well as the older files that contain a NaN-filled 'all_values' grid.
+
+The region masks should be netCDF files named like '{region}_mask.nc' with variables 'latitude', 'longitude',
+and 'mask' where the mask variable contains '1' within the region and '0' outside of it. As in the original
+savers, the mask latitudes are padded with -90 and 90 (outside the region) before being aligned to the grid.
+
+Lily Donaldson [agency]<lily.k.donaldson@nasa.gov> [evergreen]<lilykdonaldson@gmail.com>
+January 2024, Developed with Python 3.9.13
+'''
+
+#---------------------------IMPORTS--------------------------------#
+import hashlib
+import warnings
+import xarray as xr #developed with v.0.20.1
+import numpy as np #developed with v.1.24.3
+
+#------------------------------------------------------------------#
+
+# Masks already loaded in this process, keyed by (mask_folder, region, grid hash)
+_mask_registry = {}
+
+#---------------------------FUNCTIONS--------------------------------#
+
+def load_mask_dataset(mask_folder: str, region: str):
+	"""
+	Opens a region mask file and returns it with 'lat'/'lon' coordinates and pole padding.
+	:param mask_folder: a path name to a folder which contains .nc mask files corresponding to each of the regions.
+	:param region: The region name.
+	"""
+	mask_file = f'{mask_folder}/{region}_mask.nc'
+	with xr.open_dataset(mask_file) as mask:
+		mask = mask.rename({'latitude': 'lat', 'longitude': 'lon'})
+		mask = mask.reindex(lat=np.append(np.insert(mask.lat.values, 0, -90), 90), fill_value=0)
+		return mask.load()
+
+def get_region_mask(mask_folder: str, region: str, lat, lon):
+	"""
+	Returns the mask of a region aligned to a lat/lon grid, loading it only the first time it is requested.
+	:param mask_folder: a path name to a folder which contains .nc mask files corresponding to each of the regions.
+	:param region: The region name.
+	:param lat: 1D array of the grid's latitudes.
+	:param lon: 1D array of the grid's longitudes.
+	:return: A dictionary with 'mask' (a boolean (lat, lon) array), 'cells' (the flat indices of the cells
+	         inside the region), 'shape' (the grid shape) and 'hash' (identifies the mask and its grid).
+	"""
+	lat = np.asarray(lat)
+	lon = np.asarray(lon)
+	grid_key = hashlib.sha1(np.ascontiguousarray(lat, dtype=np.float64).tobytes()
+		+ np.ascontiguousarray(lon, dtype=np.float64).tobytes()).hexdigest()
+	key = (mask_folder, region, grid_key)
+	if key not in _mask_registry:
+		if region == 'global':
+			mask = np.ones((len(lat), len(lon)), dtype=bool)
+		else:
+			mask = load_mask_dataset(mask_folder, region)['mask']
+			# Align the mask to the data grid; grid cells the mask file does not cover are outside the region
+			mask = mask.reindex(lat=lat, lon=lon, method='nearest', tolerance=1e-3, fill_value=0)
+			mask = np.nan_to_num(mask.transpose('lat', 'lon').values) != 0
+		mask_hash = hashlib.sha1(grid_key.encode() + np.packbits(mask).tobytes()).hexdigest()[:16]
+		_mask_registry[key] = {
+			'mask': mask,
+			'cells': np.flatnonzero(mask),
+			'shape': mask.shape,
+			'hash': mask_hash,
+		}
+	return _mask_registry[key]
+
+def region_cell_values(values, region_mask: dict):
+	"""
+	Gathers the values of the cells inside a region.
+	:param values: A NumPy array whose last two axes are (lat, lon).
+	:param region_mask: A region mask from get_region_mask.
+	:return: An array with the lat and lon axes replaced by one axis of in-region cells.
+	"""
+	values = np.asarray(values)
+	return values.reshape(values.shape[:-2] + (-1,))[..., region_mask['cells']]
+
+def fill_region_grid(cell_values, region_mask: dict):
+	"""
+	Places in-region cell values back on the full (lat, lon) grid with NaN outside of the region.
+	:param cell_values: An array whose last axis is the in-region cells (see region_cell_values).
+	:param region_mask: A region mask from get_region_mask.
+	"""
+	cell_values = np.asarray(cell_values)
+	grid = np.full(cell_values.shape[:-1] + (int(np.prod(region_mask['shape'])),), np.nan,
+		dtype=np.result_type(cell_values.dtype, np.float32))
+	grid[..., region_mask['cells']] = cell_values
+	return grid.reshape(cell_values.shape[:-1] + tuple(region_mask['shape']))
+
+def region_time_mean(cell_values, region_mask: dict):
+	"""
+	Averages in-region cell values across the first axis, ignoring NaNs.
+	:param cell_values: A NumPy array with dimensions (time, num_of_cells) from region_cell_values.
+	:param region_mask: A region mask from get_region_mask.
+	:return: A (lat, lon) array with NaN outside of the region.
+	"""
+	with warnings.catch_warnings():
+		warnings.simplefilter("ignore", RuntimeWarning)  # cells that are NaN at every time
+		return fill_region_grid(np.nanmean(cell_values, axis=0), region_mask)
+
+def save_region_values(npz_output_path: str, cell_values, region_mask: dict):
+	"""
+	Saves in-region cell values to a compressed .npz file (see the description at the top of this script).
+	:param npz_output_path: Path of the .npz file.
+	:param cell_values: A NumPy array with dimensions (time, num_of_cells) from region_cell_values.
+	:param region_mask: The region mask the cells were selected with.
+	"""
+	np.savez_compressed(npz_output_path, cells=region_mask['cells'], values=cell_values,
+		shape=np.array(region_mask['shape']), mask_hash=np.array(region_mask['hash']))
+
+def load_region_values(npz_path: str):
+	"""
+	Loads the values stored in a saver .npz file as a flat array. Files with in-region cells and older files
+	with a NaN-filled 'all_values' grid are both supported.
+	:param npz_path: Path of the .npz file.
+	"""
+	with np.load(npz_path) as data:
+		if 'values' in data.files:
+			return data['values'].ravel()
+		return data['all_values'].ravel()
+
+def region_value_counts(npz_path: str):
+	"""
+	Counts the valid (non-NaN) values of every grid cell in a saver .npz file with in-region cells.
+	:param npz_path: Path of the .npz file.
+	:return: A (lat, lon) array of counts, 0 outside of the region.
+	"""
+	with np.load(npz_path) as data:
+		if 'values' not in data.files:
+			raise ValueError(f'{npz_path} has no in-region cells; rerun the saver to count its values')
+		counts = np.zeros(int(np.prod(data['shape'])), dtype=np.int64)
+		counts[data['cells']] = (~np.isnan(data['values'])).sum(axis=0)
+		return counts.reshape(tuple(data['shape']))
+
+#----------------------------------END OF FUNCTIONS--------------------------------#
@@ -0,0 +1,195 @@
+'''
+Regrid Index
+--part of the IMERG-GISS-comparison script package--
+Description: This script contains the regridding engine used by saveIMERGfiles.py. Instead of calling
+ds.interp for every granule, the source -> target lookup is computed once per (source grid, target grid)
+pair and saved to disk, keyed by a hash of both grids. Applying it to a timestep is then a single NumPy
+gather (method 'nearest') or a pair of np.add.reduceat sums (method 'block_average').
+	-- 'nearest' picks, for every target lat and lon, the nearest source lat and lon with the same rule as
+	   ds.interp(method='nearest', kwargs={'fill_value': None}) (scipy's interp1d): the boundaries between
+	   source cells are the midpoints of neighbouring source coordinates, computed in the source dtype, and
+	   a target on a boundary goes to the lower source coordinate. Targets outside the range of the source
+	   coordinates (like latitude +-90 or longitude -180 on a 2x2.5 grid from IMERG) are NaN.
+	-- 'block_average' averages all source cells whose nearest target cell is a given target cell,
+	   ignoring NaNs. Target cells that contain no source cells are NaN.
+
+Lily Donaldson [agency]<lily.k.donaldson@nasa.gov> [evergreen]<lilykdonaldson@gmail.com>
+January 2024, Developed with Python 3.9.13
+'''
+
+#---------------------------IMPORTS--------------------------------#
+import os
+import hashlib
+import xarray as xr #developed with v.0.20.1
+import numpy as np #developed with v.1.24.3
+
+#------------------------------------------------------------------#
+
+regrid_methods = ['nearest', 'block_average']
+
+# Indexes already loaded in this process, keyed by the cache filename
+_loaded_indexes = {}
+
+#---------------------------FUNCTIONS--------------------------------#
+
+def grid_hash(lat, lon):
+	"""
+	Returns a short hash that identifies a lat/lon grid.
+	:param lat: 1D array of latitudes.
+	:param lon: 1D array of longitudes.
+	"""
+	digest = hashlib.sha1()
+	for coordinate in (lat, lon):
+		coordinate = np.ascontiguousarray(coordinate, dtype=np.float64)
+		digest.update(str(coordinate.shape).encode())
+		digest.update(coordinate.tobytes())
+	return digest.hexdigest()[:16]
+
+def nearest_index(source, target):
+	"""
+	Returns the index of the nearest source coordinate for every target coordinate, using the midpoint rule
+	of scipy's interp1d(kind='nearest'). Targets outside the source range get the nearest edge (see outside_source).
+	:param source: 1D array of source coordinates (ascending or descending).
+	:param target: 1D array of target coordinates.
+	"""
+	source = np.asarray(source)
+	if not np.issubdtype(source.dtype, np.floating):
+		source = source.astype(np.float64)
+	target = np.asarray(target, dtype=np.float64)
+	if len(source) == 1:
+		return np.zeros(len(target), dtype=np.intp)
+	order = np.argsort(source, kind='stable')
+	sorted_source = source[order]
+	# Cell boundaries in the source dtype, as scipy computes them, so float32 coordinates round the same way
+	midpoints = (sorted_source[1:] + sorted_source[:-1]) / 2
+	return order[np.searchsorted(midpoints, target, side='left')].astype(np.intp)
+
+def outside_source(source, target):
+	"""
+	Returns True for every target coordinate outside the range of the source coordinates, where ds.interp is NaN.
+	:param source: 1D array of source coordinates.
+	:param target: 1D array of target coordinates.
+	"""
+	source = np.asarray(source)
+	target = np.asarray(target, dtype=np.float64)
+	return (target < source.min()) | (target > source.max())
+
+def block_index(source, target):
+	"""
+	Groups source coordinates by their nearest target coordinate for use with np.add.reduceat.
+	:param source: 1D array of source coordinates.
+	:param target: 1D array of target coordinates.
+	:return: A tuple (order, starts, targets) where order sorts the source coordinates by their target, starts
+	         are the positions in the sorted source where each group begins, and targets is the target index
+	         of each group.
+	"""
+	assignment = nearest_index(target, source)
+	order = np.argsort(assignment, kind='stable')
+	sorted_assignment = assignment[order]
+	starts = np.flatnonzero(np.diff(sorted_assignment, prepend=-1))
+	return order.astype(np.intp), starts.astype(np.intp), sorted_assignment[starts].astype(np.intp)
+
+def build_regrid_index(source_lat, source_lon, target_lat, target_lon, method: str = 'nearest'):
+	"""
+	Builds the index arrays that map a source grid to a target grid.
+	:param source_lat: 1D array of source latitudes.
+	:param source_lon: 1D array of source longitudes.
+	:param target_lat: 1D array of target latitudes.
+	:param target_lon: 1D array of target longitudes.
+	:param method: 'nearest' or 'block_average'.
+	:return: A dictionary of index arrays to be used with apply_regrid_index.
+	"""
+	if method not in regrid_methods:
+		raise ValueError(f"invalid regrid method '{method}'. choose one of {regrid_methods}.")
+	regrid_index = {
+		'method': np.array(method),
+		'target_shape': np.array([len(target_lat), len(target_lon)]),
+	}
+	if method == 'nearest':
+		regrid_index['lat_index'] = nearest_index(source_lat, target_lat)
+		regrid_index['lon_index'] = nearest_index(source_lon, target_lon)
+		regrid_index['lat_outside'] = outside_source(source_lat, target_lat)
+		regrid_index['lon_outside'] = outside_source(source_lon, target_lon)
+	else:
+		regrid_index['lat_order'], regrid_index['lat_starts'], regrid_index['lat_targets'] = block_index(source_lat, target_lat)
+		regrid_index['lon_order'], regrid_index['lon_starts'], regrid_index['lon_targets'] = block_index(source_lon, target_lon)
+	return regrid_index
+
+def load_regrid_index(source_lat, source_lon, target_lat, target_lon, method: str = 'nearest', cache_folder: str = None):
+	"""
+	Returns the regrid index for a pair of grids, building it only if it is not already loaded in this process
+	or saved in cache_folder.
+	:param source_lat: 1D array of source latitudes.
+	:param source_lon: 1D array of source longitudes.
+	:param target_lat: 1D array of target latitudes.
+	:param target_lon: 1D array of target longitudes.
+	:param method: 'nearest' or 'block_average'.
+	:param cache_folder: Folder where regrid indexes are saved as .npz files. If None, nothing is saved to disk.
+	"""
+	# 'v2' indexes mark the targets outside the source grid; older cached indexes are not reused
+	cache_name = f"regrid_v2_{method}_{grid_hash(source_lat, source_lon)}_{grid_hash(target_lat, target_lon)}.npz"
+	if cache_name in _loaded_indexes:
+		return _loaded_indexes[cache_name]
+	cache_path = os.path.join(cache_folder, cache_name) if cache_folder else None
+	if cache_path and os.path.exists(cache_path):
+		with np.load(cache_path) as data:
+			regrid_index = {key: data[key] for key in data.files}
+	else:
+		regrid_index = build_regrid_index(source_lat, source_lon, target_lat, target_lon, method)
+		if cache_path:
+			os.makedirs(cache_folder, exist_ok=True)
+			# Write to a temporary file first so parallel workers never read a partial index
+			temporary_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+			np.savez(temporary_path, **regrid_index)
+			os.replace(temporary_path, cache_path)
+	_loaded_indexes[cache_name] = regrid_index
+	return regrid_index
+
+def apply_regrid_index(values, regrid_index: dict, lat_axis: int = -2, lon_axis: int = -1):
+	"""
+	Regrids an array with a regrid index from build_regrid_index or load_regrid_index.
+	:param values: A NumPy array with a latitude and a longitude axis (and any other axes, such as time).
+	:param regrid_index: The regrid index.
+	:param lat_axis: The latitude axis of values.
+	:param lon_axis: The longitude axis of values.
+	:return: The regridded array, with the same axis order as values. With method 'nearest', targets outside
+	         the source grid are NaN.
+	"""
+	values = np.moveaxis(np.asarray(values), (lat_axis, lon_axis), (-2, -1))
+	if str(regrid_index['method']) == 'nearest':
+		regridded = values[..., regrid_index['lat_index'][:, None], regrid_index['lon_index'][None, :]]
+		outside = regrid_index['lat_outside'][:, None] | regrid_index['lon_outside'][None, :]
+		if outside.any():
+			regridded = regridded.astype(np.result_type(regridded.dtype, np.float32), copy=False)
+			regridded[..., outside] = np.nan
+	else:
+		values = values[..., regrid_index['lat_order'], :][..., regrid_index['lon_order']]
+		valid = ~np.isnan(values)
+		sums = np.add.reduceat(np.add.reduceat(np.where(valid, values, 0), regrid_index['lat_starts'], axis=-2),
+			regrid_index['lon_starts'], axis=-1)
+		counts = np.add.reduceat(np.add.reduceat(valid.astype(np.int32), regrid_index['lat_starts'], axis=-2),
+			regrid_index['lon_starts'], axis=-1)
+		n_lat, n_lon = regrid_index['target_shape']
+		regridded = np.full(values.shape[:-2] + (int(n_lat), int(n_lon)), np.nan, dtype=np.result_type(values.dtype, np.float32))
+		with np.errstate(invalid='ignore', divide='ignore'):
+			regridded[..., regrid_index['lat_targets'][:, None], regrid_index['lon_targets'][None, :]] = sums / counts
+	return np.moveaxis(regridded, (-2, -1), (lat_axis, lon_axis))
+
+def regrid_data_array(data_array, regrid_index: dict, target_lat, target_lon):
+	"""
+	Regrids an xarray DataArray with 'lat' and 'lon' dimensions, keeping its dimension order, other
+	coordinates and attributes.
+	:param data_array: The DataArray to regrid.
+	:param regrid_index: The regrid index.
+	:param target_lat: The target latitudes (a DataArray or 1D array).
+	:param target_lon: The target longitudes (a DataArray or 1D array).
+	"""
+	lat_axis = data_array.get_axis_num('lat')
+	lon_axis = data_array.get_axis_num('lon')
+	values = apply_regrid_index(data_array.values, regrid_index, lat_axis, lon_axis)
+	coords = {name: coord for name, coord in data_array.coords.items() if 'lat' not in coord.dims and 'lon' not in coord.dims}
+	coords['lat'] = np.asarray(target_lat)
+	coords['lon'] = np.asarray(target_lon)
+	return xr.DataArray(values, dims=data_array.dims, coords=coords, attrs=data_array.attrs, name=data_array.name)
+
+#----------------------------------END OF FUNCTIONS--------------------------------#
@@ -0,0 +1,112 @@
+'''
+Run Manifest
+--part of the IMERG-GISS-comparison script package--
+Description: This script contains the run manifest used by saveIMERGfiles.py and saveGISSfiles.py to resume
+a run. For every (year, month, region) output the savers write one small JSON entry in a 'manifest' folder
+inside the output folder, right after the output files of that region are saved:
+	-- inputs: the name, size and modification time (in ns) of every input file of the month
+	-- settings: everything else that changes the output, such as the variable, a hash of the regrid file,
+	   the resample rate, the unit conversion factor and a hash of the region mask file
+Before scheduling a month, the savers build the entry it would get and compare it with the saved one. An
+output whose entry matches and whose files exist is up to date and is not rebuilt, so rerunning a run that
+stopped part way only processes the outputs that are missing or stale, and adding a month or a region only
+processes that month or region. Each output has its own entry file, so worker processes never write the
+same file and the entries of the months that finished survive a crash.
+
+Lily Donaldson [agency]<lily.k.donaldson@nasa.gov> [evergreen]<lilykdonaldson@gmail.com>
+January 2024, Developed with Python 3.9.13
+'''
+
+#---------------------------IMPORTS--------------------------------#
+import os
+import json
+import hashlib
+
+#------------------------------------------------------------------#
+
+manifest_folder_name = 'manifest'
+
+#---------------------------FUNCTIONS--------------------------------#
+
+def file_signature(file_path: str):
+	"""
+	Returns the [size, modification time in ns] of a file, which changes whenever the file is rewritten.
+	:param file_path: Path to the file.
+	"""
+	status = os.stat(file_path)
+	return [status.st_size, status.st_mtime_ns]
+
+def file_hash(file_path: str):
+	"""
+	Returns a short hash of the contents of a file, or None if there is no file.
+	:param file_path: Path to the file, or None.
+	"""
+	if file_path is None:
+		return None
+	digest = hashlib.sha1()
+	with open(file_path, 'rb') as f:
+		for block in iter(lambda: f.read(1024 * 1024), b''):
+			digest.update(block)
+	return digest.hexdigest()[:16]
+
+def mask_file_hash(mask_folder: str, region: str):
+	"""
+	Returns a hash of the mask file of a region ('global' has no mask file).
+	:param mask_folder: a path name to a folder which contains .nc mask files corresponding to each of the regions.
+	:param region: The region name.
+	"""
+	if region == 'global':
+		return 'global'
+	return file_hash(f'{mask_folder}/{region}_mask.nc')
+
+def manifest_entry(input_paths: list, settings: dict):
+	"""
+	Builds the manifest entry of an output.
+	:param input_paths: Paths to the input files the output is made from.
+	:param settings: A dictionary of the settings that change the output (JSON types only).
+	"""
+	return {
+		'inputs': {os.path.basename(path): file_signature(path) for path in input_paths},
+		'settings': settings,
+	}
+
+def manifest_entry_path(output_folder_path_base: str, year: int, month: int, region: str, variable: str):
+	"""
+	Returns the path of the manifest entry of a (year, month, region) output.
+	:param output_folder_path_base: The base output folder of the run.
+	:param year: The year of the output.
+	:param month: The month (1-12) of the output.
+	:param region: The region name.
+	:param variable: The variable name used in the output filenames.
+	"""
+	return os.path.join(output_folder_path_base, manifest_folder_name, f"{year}_{month:02d}_{region}_{variable}.json")
+
+def is_up_to_date(entry_path: str, entry: dict, output_paths: list):
+	"""
+	Checks whether an output was made from the same inputs and settings and its files still exist.
+	:param entry_path: Path of the saved manifest entry.
+	:param entry: The entry the output would get now (see manifest_entry).
+	:param output_paths: The output files.
+	"""
+	if not all(os.path.exists(path) for path in output_paths) or not os.path.exists(entry_path):
+		return False
+	try:
+		with open(entry_path) as f:
+			return json.load(f) == entry
+	except (OSError, ValueError):
+		return False
+
+def write_manifest_entry(entry_path: str, entry: dict):
+	"""
+	Saves a manifest entry once its output files are written. The entry is written to a temporary file first,
+	so an interrupted write never leaves an entry that looks valid.
+	:param entry_path: Path of the manifest entry.
+	:param entry: The entry (see manifest_entry).
+	"""
+	os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+	temporary_path = f'{entry_path}.{os.getpid()}.tmp'
+	with open(temporary_path, 'w') as f:
+		json.dump(entry, f, indent=1, sort_keys=True)
+	os.replace(temporary_path, entry_path)
+
+#----------------------------------END OF FUNCTIONS--------------------------------#
@@ -3,10 +3,13 @@ Save Modified GISS Files
 --part of the IMERG-GISS-comparison script package--
 Description: This script takes raw subdaily GISS netCDF files and outputs averaged 
 monthly netCDF files and .npz saved arrays of the chosen variable, including by region. 
-The .npz saved arrays are 3D numpy arrays with dimensions like (num_of_datapoints, lat, lon) 
-such as (120, 90, 144) where 120 is the number of datapoints (30 days at a 6 hour sampling rate) 
-and 90, 144 which are the dimensions of the grid. The .npz saved arrays can be used with 
-IMERG_GISS_hist_stats.py included in this script package.
+The .npz saved arrays only contain the grid cells inside the region: a 2D 'values' array with 
+dimensions like (num_of_datapoints, num_of_cells) such as (120, 35) where 120 is the number of 
+datapoints (30 days at a 6 hour sampling rate) and 35 is the number of grid cells in the region,
+plus the 'cells' indices of those cells in the grid (see region_masks.py). The .npz saved arrays can be used with 
+IMERG_GISS_hist_stats.py included in this script package. Besides the average, the _average.nc files contain a 
+'count' variable with the number of valid (non-NaN) values of every cell in the month, which monthly_aggregates.py 
+uses to build season and year averages.
  
 
 Lily Donaldson [agency]<lily.k.donaldson@nasa.gov> [evergreen]<lilykdonaldson@gmail.com>
@@ -16,7 +19,7 @@ This script takes the following user inputs which are set in the "USER INPUTS" s
 	-- start_year and end_year: the first and last year in your chosen time period of data to process
 	-- original_data_folder: pathname to folder that contains the original subdaily GISS data which should be 
 	   organized in year folders. The netCDF files must be named like "DEC2019.aijh12iWISO_20th_MERRA2_ANL.nc" 
-	   or line 94 (file_name) must be updated.
+	   or file_name in process_nc_files must be updated.
 	-- mask_folder: the folder where the region masks are stored. The region masks should be netCDF 
 	   files with variables 'latitude', 'longitude', and 'mask' where the mask variable should contain 
 	   '1' within the region mask boundaries and '0' outside of the region mask boundaries. 
@@ -27,6 +30,16 @@ This script takes the following user inputs which are set in the "USER INPUTS" s
 	   "prec". The new netCDF datasets will only contain the variable of interest (averaged 
 	   across the month), latitude, and longitude.
 	-- output_folder: the folder where the generated files will be saved.
+	-- workers: the number of worker processes to use. Each (year, month) is processed independently, so 
+	   setting this to the number of available cores processes that many months at once. A month that fails
+	   is reported at the end of the run and does not stop the other months. Set this to 1 to process 
+	   the months one at a time.
+	-- rebuild: outputs are recorded in a run manifest (see run_manifest.py) with the input file and settings
+	   they were made from, and a rerun skips the outputs that are up to date. Set this to True to rebuild
+	   every output anyway.
+	-- metrics_file: set this to a path like 'GISS_metrics.jsonl' to record the time, I/O and memory of every 
+	   processing stage (see stage_metrics.py) and print a summary table at the end of the run. Set this to 
+	   None to not record them.
 
 
 Example File Organization
@@ -50,6 +63,10 @@ Example File Organization
 import os
 import xarray as xr #developed with v.0.20.1
 import numpy as np #developed with v.1.24.3
+from parallel_tasks import run_tasks
+from region_masks import get_region_mask, region_cell_values, region_time_mean, fill_region_grid, save_region_values
+from stage_metrics import stage, start_recording, print_metrics_summary
+from run_manifest import manifest_entry, manifest_entry_path, mask_file_hash, is_up_to_date, write_manifest_entry
 
 #------------------------------------------------------------------#
 
@@ -66,32 +83,101 @@ regions = [
 ]
 variable_name = "prec"
 output_folder = "/Users/lilydonaldson/Downloads/examples/data/GISS/GISS_automated/northeast_nearest_automated_GISS"
+workers = 1 #number of worker processes; each (year, month) is processed independently
+rebuild = False #set this to True to rebuild outputs that are up to date in the run manifest
+metrics_file = None #set this to a path like 'GISS_metrics.jsonl' to record the time of every processing stage
 #-------------------------END OF USER INPUTS----------------------------#
 
 #---------------------------FUNCTIONS--------------------------------#
 
+month_names = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+
+def process_month(year: int, month: str, file_path: str, output_directories: dict, chosen_variable: str, 
+	new_variable_name: str, regions: list, mask_folder: str, manifest_entries: dict = None, metrics_path: str = None):
+	"""
+	Processes the GISS .nc file of a single month and writes the .npz and _average.nc files for every region.
+	This is the unit of work that process_nc_files schedules, serially or on a process pool.
+	:param year: The year of the file.
+	:param month: The three letter month name of the file, such as 'JAN'.
+	:param file_path: Path to the GISS .nc file for this month.
+	:param output_directories: A dictionary with the output folder for each region.
+	:param chosen_variable: The variable to be extracted from the file.
+	:param new_variable_name: The name of the variable in the output files.
+	:param regions: a list of region names.
+	:param mask_folder: a path name to a folder which contains .nc mask files corresponding to each of the regions.
+	:param manifest_entries: A dictionary with the (entry path, entry) of each region to write to the run manifest 
+	       once its output files are saved.
+	:param metrics_path: The metrics file to record the stages of the month in (see stage_metrics.py), or None.
+	"""
+	if metrics_path:
+		# Worker processes do not share the recording state of the main process
+		start_recording(metrics_path)
+	month_number = month_names.index(month) + 1
+	# Load the dataset for the current month once and share it between all regions
+	with stage('open_dataset', opened_paths=[file_path], read_paths=[file_path], year=year, month=month_number):
+		with xr.open_dataset(file_path) as dataset:
+			lat = dataset['lat'].load()
+			lon = dataset['lon'].load()
+			variable = dataset[chosen_variable].transpose(..., 'lat', 'lon').values
+	for region in regions:
+		with stage('mask', year=year, month=month_number, region=region):
+			# Apply the mask to the dataset, keeping only the cells inside the region
+			region_mask = get_region_mask(mask_folder, region, lat.values, lon.values)
+			prec = region_cell_values(variable, region_mask)
+			prec_averaged = region_time_mean(prec, region_mask)
+			prec_counts = np.nan_to_num(fill_region_grid((~np.isnan(prec)).sum(axis=0), region_mask)).astype(np.int32)
+		averageddataset = xr.Dataset(
+		    data_vars={new_variable_name: (['lat', 'lon'], prec_averaged), 'count': (['lat', 'lon'], prec_counts)}, 
+		    coords={'lat': lat, 'lon': lon}  # Define 'lat' and 'lon' as coordinates
+		)
+		# Save the masked dataset to a new netCDF file in the region-specific folder
+		output_directory = output_directories[region]
+		output_file = f"{year}_{month_number:02d}_{region}_{new_variable_name}_average.nc"
+		nc_output_path = os.path.join(output_directory, output_file)
+		with stage('save_netcdf', written_paths=[nc_output_path], year=year, month=month_number, region=region):
+			averageddataset.to_netcdf(nc_output_path)
+
+		npz_output_filename = f"{year}_{month_number:02d}_{region}_{new_variable_name}.npz"
+		npz_output_path = os.path.join(output_directory, npz_output_filename)
+		with stage('save_npz', written_paths=[npz_output_path], year=year, month=month_number, region=region):
+			save_region_values(npz_output_path, prec, region_mask)
+		if manifest_entries:
+			write_manifest_entry(*manifest_entries[region])
+
 def process_nc_files(years: list, input_folder_path_base: str, output_folder_path_base: str, 
-	chosen_variable: str, regions: list, mask_folder: str):
+	chosen_variable: str, regions: list, mask_folder: str, workers: int = 1, rebuild: bool = False, metrics_path: str = None):
 	"""
 	Processes GISS .nc files by extracting a chosen variable to generate two intermediate files per month 
 	of each year and for every region. The files generated are a netCDF file which contains data for 1 
 	month with the chosen variable averaged) and an .npz compressed numpy file which contains a flattened 
-	array of all of the chosen variable's values for that month.
+	array of all of the chosen variable's values for that month. Every (year, month) is an independent 
+	task which can be run on a pool of worker processes. Outputs that are up to date in the run manifest
+	(see run_manifest.py) are skipped, and a month is only processed for the regions it has to rebuild.
 	:param years: List of years to process.
 	:param input_folder_path_base: Base path to the folder containing original .nc files.
 	:param output_folder_path_base: Base path to the folder for saving output files.
 	:param chosen_variable: The variable to be extracted from the files.
 	:param regions: a list of region names.
 	:param mask_folder: a path name to a folder which contains .nc mask files corresponding to each of the regions.
+	:param workers: Number of worker processes to run (year, month) tasks on. 1 processes them serially.
+	:param rebuild: If True, every output is rebuilt even if it is up to date.
+	:param metrics_path: A JSON lines file to record the time, I/O and memory of every stage in (see 
+	       stage_metrics.py). A summary table is printed at the end of the run. None records nothing.
+	:return: A dictionary of failed tasks, mapping the task description to the error traceback.
 	"""
 
-	month_names = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
 	if(chosen_variable=='prec'):
 		new_variable_name = 'precipitation'
 	else:
 		new_variable_name = chosen_variable
 	if not os.path.exists(output_folder_path_base):
 		os.makedirs(output_folder_path_base)
+	start_recording(metrics_path, reset=True)
+	mask_hashes = {region: mask_file_hash(mask_folder, region) for region in regions}
+
+	tasks = []
+	labels = []
+	up_to_date = 0
 	for year in years:
 		input_folder_path = os.path.join(input_folder_path_base, str(year))
 		output_folder_path = os.path.join(output_folder_path_base, str(year))
@@ -99,50 +185,45 @@ def process_nc_files(years: list, input_folder_path_base: str, output_folder_pat
 			os.makedirs(output_folder_path)
 		# if 'global' not in regions:
 		# 	regions.append('global')
+		output_directories = {}
 		for region in regions:
 			# Create a folder for each region inside the base output directory
 			output_directory = os.path.join(output_folder_path, region)
 			if not os.path.exists(output_directory):
 				os.makedirs(output_directory)
+			output_directories[region] = output_directory
 
-			if region!='global':
-				mask_file = f'{mask_folder}/{region}_mask.nc'
-				mask = xr.open_dataset(mask_file)
-				mask = mask.rename({'latitude': 'lat', 'longitude': 'lon'})
-				mask = mask.reindex(lat=np.append(np.insert(mask.lat.values, 0, -90), 90), fill_value=0)
-
-			all_values = []
-			monthly_datasets = []
-			for month in month_names:
+		for month in month_names:
+			file_name = f'{month}{year}.aijh12iWISO_20th_MERRA2_ANL.nc'
+			file_path = os.path.join(input_folder_path, file_name)
+			# Check if the file exists
+			if os.path.exists(file_path):
 				month_number = month_names.index(month) + 1
-				file_name = f'{month}{year}.aijh12iWISO_20th_MERRA2_ANL.nc'
-				file_path = os.path.join(input_folder_path, file_name)
-				# Check if the file exists
-				if os.path.exists(file_path):
-					# Load the dataset for the current month
-					dataset = xr.open_dataset(file_path)
-					if region!='global':
-						# Apply the mask to the dataset
-						dataset[chosen_variable] = dataset[chosen_variable].where(mask['mask'])
-
-					lat = dataset['lat']
-					lon = dataset['lon']
-					prec = dataset[chosen_variable]
-					prec_averaged = np.mean(prec, axis=0)
-					averageddataset = xr.Dataset(
-					    data_vars={new_variable_name: (['lat', 'lon'], prec_averaged.data)}, 
-					    coords={'lat': lat, 'lon': lon}  # Define 'lat' and 'lon' as coordinates
-					)
-					# Save the masked dataset to a new netCDF file in the region-specific folder
-					output_file = f"{year}_{month_number:02d}_{region}_{new_variable_name}_average.nc"
-					nc_output_path = os.path.join(output_directory, output_file)
-					averageddataset.to_netcdf(nc_output_path)
-
-					variable_data = dataset[chosen_variable].values
-					npz_output_filename = f"{year}_{month_number:02d}_{region}_{new_variable_name}.npz"
-					npz_output_path = os.path.join(output_directory, npz_output_filename)
-					np.savez_compressed(npz_output_path, all_values=variable_data)
-					print(f'Completed processing files from {month} {year} for {region} region.')
+				manifest_entries = {}
+				for region in regions:
+					entry = manifest_entry([file_path], {'variable': chosen_variable, 'new_variable_name': new_variable_name, 
+						'mask_hash': mask_hashes[region]})
+					entry_path = manifest_entry_path(output_folder_path_base, year, month_number, region, new_variable_name)
+					output_paths = [os.path.join(output_directories[region], f"{year}_{month_number:02d}_{region}_{new_variable_name}{suffix}")
+						for suffix in ['_average.nc', '.npz']]
+					with stage('manifest_check', year=year, month=month_number, region=region):
+						current = not rebuild and is_up_to_date(entry_path, entry, output_paths)
+					if current:
+						up_to_date += 1
+						continue
+					manifest_entries[region] = (entry_path, entry)
+				if manifest_entries:
+					tasks.append((year, month, file_path, output_directories, chosen_variable, new_variable_name, 
+						list(manifest_entries), mask_folder, manifest_entries, metrics_path))
+					labels.append(f'{month} {year}')
+
+	if up_to_date:
+		print(f'{up_to_date} outputs are up to date and were skipped')
+	results, failures = run_tasks(process_month, tasks, labels, workers)
+	if metrics_path:
+		print_metrics_summary(metrics_path)
+		start_recording(None)
+	return failures
 
 #----------------------------------END OF FUNCTIONS--------------------------------#
 
@@ -150,7 +231,7 @@ def process_nc_files(years: list, input_folder_path_base: str, output_folder_pat
 #-------------------------------MAIN CODE-----------------------------------#
 if __name__ == "__main__":
 	years = list(range(start_year, end_year+1))
-	process_nc_files(years, original_data_folder, output_folder, variable_name, regions, mask_folder) 
+	process_nc_files(years, original_data_folder, output_folder, variable_name, regions, mask_folder, workers, rebuild, metrics_file) 
 
 #---------------------------------END OF MAIN CODE---------------------------------#
 
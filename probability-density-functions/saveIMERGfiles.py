@@ -3,10 +3,13 @@ Save Modified IMERG Files
 --part of the IMERG-GISS-comparison script package--
 Description: This script takes raw subdaily IMERG netCDF files and outputs averaged 
 monthly netCDF files and .npz saved arrays of the chosen variable, including by region, 
-with an option to regrid and resample the data. The .npz saved arrays are 3D numpy arrays 
-with dimensions like (num_of_datapoints, lat, lon) such as (120, 90, 144) where 120 is the 
-number of datapoints (30 days at a 6 hour sampling rate) and 90, 144 which are the dimensions
-of the grid. The .npz saved arrays can be used with IMERG_GISS_hist_stats.py included in this script package.
+with an option to regrid and resample the data. The .npz saved arrays only contain the grid
+cells inside the region: a 2D 'values' array with dimensions like (num_of_datapoints, num_of_cells)
+such as (120, 35) where 120 is the number of datapoints (30 days at a 6 hour sampling rate) and 
+35 is the number of grid cells in the region, plus the 'cells' indices of those cells in the grid
+(see region_masks.py). The .npz saved arrays can be used with IMERG_GISS_hist_stats.py included in this script package.
+Besides the average, the _average.nc files contain a 'count' variable with the number of valid (non-NaN) values
+of every cell in the month, which monthly_aggregates.py uses to build season and year averages.
 
 Lily Donaldson [agency]<lily.k.donaldson@nasa.gov> [evergreen]<lilykdonaldson@gmail.com>
 January 2024, Developed with Python 3.9.13
@@ -31,6 +34,9 @@ This script takes the following user inputs which are set in the "USER INPUTS" s
 	   lon variables with the correct grid. The script 'createRegridFile.py' shows an example of how to
 	   create this file. If you do not wish to regrid the data, set regrid to False, and you will not
 	   need to change regrid_file from the example.
+	-- regrid_method: 'nearest' picks the nearest IMERG cell for every cell of the new grid and 'block_average'
+	   averages all IMERG cells that fall inside each cell of the new grid. The lookup between the two grids
+	   is computed once and saved in a 'regrid_cache' folder inside output_folder (see regrid_index.py).
 	-- resample and resample_rate: resample should be set to True if you would like the data to be re-
 	   sampled. If resample is set to True, resample_rate should be the desired sampling rate in hours.
 	   For example, if resample_rate is set to 6, the data will be resampled to one measurement every
@@ -40,6 +46,20 @@ This script takes the following user inputs which are set in the "USER INPUTS" s
 	   no unit conversion is needed. IMERG precipitation has units mm/hour; use 24 as a factor to convert 
 	   precipitation to mm/day.
 	-- output_folder: the folder where the generated files will be saved.
+	-- max_buffer_gb: the in-region values of a month are written into one preallocated float32 array per
+	   region. If that array would be larger than this many gigabytes, it is a memory-mapped file in the
+	   region's output folder instead (deleted once the month is saved), so a month of 0.1 degree data does
+	   not have to fit in memory.
+	-- workers: the number of worker processes to use. Each (year, month) is processed independently, so 
+	   setting this to the number of available cores processes that many months at once. A month that fails
+	   is reported at the end of the run and does not stop the other months. Set this to 1 to process 
+	   the months one at a time.
+	-- rebuild: outputs are recorded in a run manifest (see run_manifest.py) with the input files and settings
+	   they were made from, and a rerun skips the outputs that are up to date. Set this to True to rebuild
+	   every output anyway.
+	-- metrics_file: set this to a path like 'IMERG_metrics.jsonl' to record the time, I/O and memory of every 
+	   processing stage (see stage_metrics.py) and print a summary table at the end of the run. Set this to 
+	   None to not record them.
 
 Example File Organization
 	-current directory
@@ -59,8 +79,6 @@ Example File Organization
 	------2011_09_region2_precipitation_average.nc
 	------2011_09_region2_precipitation.npz
 '''
-#TO_DOs: script runs quite slowly. implement optimization (code review region looping and multiprocessing)
-#month/season/year in another script where arrays are simply added for those modes
 #---------------------------IMPORTS--------------------------------#
 import os
 import re
@@ -72,6 +90,11 @@ import xarray as xr #developed with v.0.20.1
 import pandas as pd #developed with v.1.4.4
 import numpy as np #developed with v.1.24.3
 import cftime #developed with v.1.6.3
+from parallel_tasks import run_tasks
+from regrid_index import load_regrid_index, regrid_data_array
+from region_masks import get_region_mask, region_cell_values, fill_region_grid, save_region_values
+from stage_metrics import stage, start_recording, print_metrics_summary
+from run_manifest import manifest_entry, manifest_entry_path, file_hash, mask_file_hash, is_up_to_date, write_manifest_entry
 
 warnings.filterwarnings("ignore", message="invalid value encountered in cast")
 
@@ -91,22 +114,231 @@ regions = [
 variable_name = "precipitation"
 regrid = True
 regrid_file = "/Users/lilydonaldson/Downloads/examples/regrid_files/regrid_2x2-5.nc" #regridding is only performed if regrid is set to True
+regrid_method = 'nearest' #'nearest' or 'block_average'
 resample = True
 resample_rate = 6 #resampling is only performed if resample is set to True.
 unit_conversion_factor = 24 #set this to 1 if no conversion is needed. 
 output_folder = "/Users/lilydonaldson/Downloads/examples/data/IMERG/IMERG_regrid/lastpass_regridded"
+workers = 1 #number of worker processes; each (year, month) is processed independently
+max_buffer_gb = 2 #months with more in-region values than this are buffered in a memory-mapped file
+rebuild = False #set this to True to rebuild outputs that are up to date in the run manifest
+metrics_file = None #set this to a path like 'IMERG_metrics.jsonl' to record the time of every processing stage
 #-------------------------END OF USER INPUTS----------------------------#
 
 
 #---------------------------FUNCTIONS--------------------------------#
+def extract_start_time(filename):
+	"""
+	Returns the start time of an IMERG granule from its filename, or None if the filename does not follow
+	the IMERG pattern like '3B-HHR.MS.MRG.3IMERG.20100101-S000000-E002959.0000.V07A.HDF5.nc4'.
+	:param filename: The name of the .nc4 file.
+	"""
+	match = re.search(r"\.(\d{8})-S(\d{6})", filename)
+	if match:
+		return datetime.strptime(match.group(1) + match.group(2), '%Y%m%d%H%M%S')
+	return None
+
+def matches_resample_rate(timestamp, resample_rate: int):
+	"""
+	Checks whether a timestamp falls on the resampling interval (for example 00, 06, 12 and 18 UTC when
+	resample_rate is 6).
+	:param timestamp: A datetime-like object with hour and minute attributes.
+	:param resample_rate: Rate at which to resample the data (in hours).
+	"""
+	return timestamp.hour % resample_rate == 0 and timestamp.minute == 0
+
+def new_month_buffer(shape: tuple, max_buffer_bytes: int, spill_path: str):
+	"""
+	Returns an empty float32 array for the values of a month, memory-mapped to spill_path if it is larger
+	than max_buffer_bytes.
+	:param shape: The shape (num_of_datapoints, num_of_cells) of the array.
+	:param max_buffer_bytes: The largest array to keep in memory.
+	:param spill_path: Path of the .npy file to memory-map larger arrays to.
+	"""
+	if np.prod(shape, dtype=np.int64) * 4 > max_buffer_bytes:
+		return np.lib.format.open_memmap(spill_path, mode='w+', dtype=np.float32, shape=shape)
+	return np.empty(shape, dtype=np.float32)
+
+def grow_month_buffer(buffer: np.ndarray, rows: int, shape: tuple, max_buffer_bytes: int, spill_path: str):
+	"""
+	Returns a larger month buffer (see new_month_buffer) with the first rows of buffer copied into it. A buffer 
+	that spills to disk is grown into a new memory-mapped file that then replaces spill_path, so the values 
+	are never copied into memory.
+	:param buffer: The current buffer.
+	:param rows: The number of rows of buffer that are filled.
+	:param shape: The shape of the new buffer.
+	:param max_buffer_bytes: The largest array to keep in memory.
+	:param spill_path: Path of the .npy file the buffer is (or will be) memory-mapped to.
+	"""
+	grown = new_month_buffer(shape, max_buffer_bytes, spill_path + '.tmp')
+	grown[:rows] = buffer[:rows]
+	if isinstance(grown, np.memmap):
+		grown.flush()
+		# The grown buffer stays mapped to its file under the new name
+		os.replace(spill_path + '.tmp', spill_path)
+	return grown
+
+def process_month(year: int, month: int, files: list, input_folder_path: str, output_directories: dict, 
+	chosen_variable: str, regrid: bool, resample: bool, regions: list, mask_folder: str, regrid_file: str = None, 
+	resample_rate: int = None, unit_conversion_factor: float = 1.0, regrid_method: str = 'nearest', 
+	regrid_cache_folder: str = None, max_buffer_bytes: int = 2 * 1024 ** 3, manifest_entries: dict = None, 
+	metrics_path: str = None):
+	"""
+	Processes the .nc4 files of a single month and writes the .npz and _average.nc files for every region.
+	This is the unit of work that process_nc_files schedules, serially or on a process pool. A file that
+	cannot be read is skipped (and reported in the return value) instead of stopping the month.
+	The in-region values are written in place into one float32 array per region (see new_month_buffer) and
+	the monthly average comes from a running NaN-aware sum and count, so a month is held in memory only once.
+	:param year: The year of the files.
+	:param month: The month of the files.
+	:param files: List of .nc4 filenames in input_folder_path that belong to this month.
+	:param input_folder_path: Path to the folder containing the files.
+	:param output_directories: A dictionary with the output folder for each region.
+	:param chosen_variable: The variable to be extracted from the files.
+	:param regrid: Boolean indicating whether to regrid the data.
+	:param resample: Boolean indicating whether to resample the data.
+	:param regions: a list of region names.
+	:param mask_folder: a path name to a folder which contains .nc mask files corresponding to each of the regions.
+	:param regrid_file: Path to the file containing the new grid for regridding.
+	:param resample_rate: Rate at which to resample the data (in hours).
+	:param unit_conversion_factor: Factor to multiply the variable by for unit conversion.
+	:param regrid_method: 'nearest' or 'block_average' (see regrid_index.py).
+	:param regrid_cache_folder: Folder where regrid indexes are saved so they are only built once.
+	:param max_buffer_bytes: Months with more in-region values than this are buffered in a memory-mapped file.
+	:param manifest_entries: A dictionary with the (entry path, entry) of each region to write to the run manifest 
+	       once its output files are saved. Nothing is written when a file was skipped, so the month is redone 
+	       by the next run.
+	:param metrics_path: The metrics file to record the stages of the month in (see stage_metrics.py), or None.
+	:return: A dictionary with the number of files used and the list of skipped (unreadable) files.
+	"""
+	if metrics_path:
+		# Worker processes do not share the recording state of the main process
+		start_recording(metrics_path)
+	if regrid and regrid_file:
+		# Load the regrid file to get the new grid
+		with xr.open_dataset(regrid_file) as regrid_dataset:
+			regrid_dataset = regrid_dataset[['lat', 'lon']].load()
+	# Each granule is opened, resampled, regridded and converted once, then the resulting
+	# field is fanned out to every region mask in memory.
+	buffers = {}
+	spill_paths = {}
+	sums = {}
+	counts = {}
+	rows = 0
+	files_used = 0
+	skipped_files = []
+	try:
+		for file in files:
+			file_path = os.path.join(input_folder_path, file)
+			try:
+				with stage('open_dataset', opened_paths=[file_path], year=year, month=month, file=file):
+					ds = xr.open_dataset(file_path)
+				with ds:
+					if resample and resample_rate and extract_start_time(file) is None:
+						with stage('time_decode', year=year, month=month, file=file):
+							# Non-standard filename, so extract the time variable from the dataset
+							time_var = ds['time'].values[0]
+							# Use cftime to convert the time variable
+							if isinstance(time_var, cftime.datetime):
+								timestamp = cftime.datetime(time_var.year, time_var.month, time_var.day, time_var.hour, time_var.minute)
+							else:
+								timestamp = pd.to_datetime(time_var)
+						# Check if the timestamp is at the desired resampling interval
+						if not matches_resample_rate(timestamp, resample_rate):
+							continue  # Skip this file
+					if regrid and regrid_file:
+						with stage('regrid', read_paths=[file_path], year=year, month=month, file=file):
+							# The source -> target lookup is built once per pair of grids and reused for every granule
+							regrid_index = load_regrid_index(ds['lat'].values, ds['lon'].values, regrid_dataset['lat'].values, 
+								regrid_dataset['lon'].values, regrid_method, regrid_cache_folder)
+							variable_data = regrid_data_array(ds[chosen_variable], regrid_index, regrid_dataset['lat'], regrid_dataset['lon'])
+					else:
+						with stage('load', read_paths=[file_path], year=year, month=month, file=file):
+							variable_data = ds[chosen_variable].load()
+			except (OSError, ValueError, KeyError, RuntimeError) as error:
+				# A corrupt or incomplete granule should not stop the rest of the month
+				warnings.warn(f'Skipping unreadable file {file_path}: {error}')
+				skipped_files.append(file)
+				continue
+			with stage('convert', year=year, month=month, file=file):
+				if unit_conversion_factor != 1.0:
+					# Apply unit conversion if unit_conversion_factor is not 1.0
+					variable_data = variable_data * unit_conversion_factor
+				variable_data = variable_data.transpose(..., 'lat', 'lon')
+				values = variable_data.values.reshape((-1,) + variable_data.shape[-2:])
+			for region in regions:
+				with stage('mask', year=year, month=month, region=region, file=file):
+					region_mask = get_region_mask(mask_folder, region, variable_data['lat'].values, variable_data['lon'].values)
+					cell_values = region_cell_values(values, region_mask)
+					if region not in buffers:
+						# Room for every remaining file of the month with as many time steps as this one
+						spill_paths[region] = os.path.join(output_directories[region], f"{year}_{month:02d}_{region}_{chosen_variable}.buffer.npy")
+						buffers[region] = new_month_buffer((len(files) * len(values), len(region_mask['cells'])), max_buffer_bytes,
+							spill_paths[region])
+						sums[region] = np.zeros(len(region_mask['cells']))
+						counts[region] = np.zeros(len(region_mask['cells']), dtype=np.int64)
+					if rows + len(values) > len(buffers[region]):
+						# A file with more time steps than the first one; only happens with unusual granules
+						buffers[region] = grow_month_buffer(buffers[region], rows, (rows + len(values) * (len(files) - files_used),
+							len(region_mask['cells'])), max_buffer_bytes, spill_paths[region])
+					buffers[region][rows:rows + len(values)] = cell_values
+					valid = ~np.isnan(cell_values)
+					sums[region] += np.where(valid, cell_values, 0).sum(axis=0)
+					counts[region] += valid.sum(axis=0)
+			rows += len(values)
+			files_used += 1
+
+		if files_used:
+			for region in regions:
+				output_directory = output_directories[region]
+				region_mask = get_region_mask(mask_folder, region, variable_data['lat'].values, variable_data['lon'].values)
+				# Save the in-region values for the month as .npz
+				npz_output_filename = f"{year}_{month:02d}_{region}_{chosen_variable}.npz"
+				npz_output_path = os.path.join(output_directory, npz_output_filename)
+				with stage('save_npz', written_paths=[npz_output_path], year=year, month=month, region=region):
+					save_region_values(npz_output_path, buffers[region][:rows], region_mask)
+				# The average across the month from the running sum and count (NaN where a cell never had a value)
+				with np.errstate(invalid='ignore', divide='ignore'):
+					mean = (sums[region] / counts[region]).astype(np.float32)
+				average_data = xr.DataArray(fill_region_grid(mean, region_mask), dims=('lat', 'lon'),
+					coords={'lat': variable_data['lat'].values, 'lon': variable_data['lon'].values},
+					attrs=variable_data.attrs, name=chosen_variable).to_dataset()
+				# The number of values behind each average, so months can be combined into seasons and years
+				average_data['count'] = (('lat', 'lon'), np.nan_to_num(fill_region_grid(counts[region], region_mask)).astype(np.int32))
+				nc_output_filename = f"{year}_{month:02d}_{region}_{chosen_variable}_average.nc"
+				nc_output_path = os.path.join(output_directory, nc_output_filename)
+				with stage('save_netcdf', written_paths=[nc_output_path], year=year, month=month, region=region):
+					average_data.to_netcdf(nc_output_path)
+				buffers[region] = None
+				if os.path.exists(spill_paths[region]):
+					os.remove(spill_paths[region])
+				# A month with skipped files is incomplete, so it is left out of the manifest and redone by the next run
+				if manifest_entries and not skipped_files:
+					write_manifest_entry(*manifest_entries[region])
+	finally:
+		# The spill files are only needed while the month is processed, also when a stage fails
+		for region, spill_path in spill_paths.items():
+			buffers[region] = None
+			for path in [spill_path, spill_path + '.tmp']:
+				if os.path.exists(path):
+					os.remove(path)
+	return {'files_used': files_used, 'skipped_files': skipped_files}
+
 def process_nc_files(years: list, input_folder_path_base: str, output_folder_path_base: str, 
 	chosen_variable: str, regrid: bool, resample: bool, regions: list, mask_folder: str, regrid_file: str = None, 
-	resample_rate: int = None, unit_conversion_factor: float = 1.0):
+	resample_rate: int = None, unit_conversion_factor: float = 1.0, workers: int = 1, regrid_method: str = 'nearest', 
+	regrid_cache_folder: str = None, max_buffer_gb: float = 2, rebuild: bool = False, metrics_path: str = None):
 	"""
 	Processes .nc4 files by regridding, resampling, extracting a chosen variable, and combining them by month
 	to generate two intermediate files per region. The files generated are a netCDF file which contains data 
 	for 1 month with the chosen variable averaged and an .npz compressed numpy file which contains a flattened 
-	array of all of the chosen variable's values.
+	array of all of the chosen variable's values. Each .nc4 file is read and regridded once and the result is 
+	shared by all regions, so runtime scales with the number of files rather than files x regions. When 
+	resampling, files are selected by the start time in their filename (like '-S060000-') before they are 
+	opened; the time variable is only read for files whose names do not follow the IMERG pattern. Every 
+	(year, month) is an independent task which can be run on a pool of worker processes. Outputs that are up
+	to date in the run manifest (see run_manifest.py) are skipped, and a month is only processed for the 
+	regions it has to rebuild.
 	:param years: List of years to process.
 	:param input_folder_path_base: Base path to the folder containing .nc4 files.
 	:param output_folder_path_base: Base path to the folder for saving output files.
@@ -118,6 +350,16 @@ def process_nc_files(years: list, input_folder_path_base: str, output_folder_pat
 	:param regrid_file: Path to the file containing the new grid for regridding.
 	:param resample_rate: Rate at which to resample the data (in hours).
 	:param unit_conversion_factor: Factor to multiply the variable by for unit conversion.
+	:param workers: Number of worker processes to run (year, month) tasks on. 1 processes them serially.
+	:param regrid_method: 'nearest' or 'block_average' (see regrid_index.py).
+	:param regrid_cache_folder: Folder where regrid indexes are saved so they are only built once. Defaults to
+	       a 'regrid_cache' folder inside output_folder_path_base.
+	:param max_buffer_gb: Months with more in-region values than this many gigabytes are buffered in a 
+	       memory-mapped file instead of memory (see new_month_buffer).
+	:param rebuild: If True, every output is rebuilt even if it is up to date.
+	:param metrics_path: A JSON lines file to record the time, I/O and memory of every stage in (see 
+	       stage_metrics.py). A summary table is printed at the end of the run. None records nothing.
+	:return: A dictionary of failed tasks, mapping the task description to the error traceback.
 	"""
 
 	def extract_year_month(filename):
@@ -128,7 +370,22 @@ def process_nc_files(years: list, input_folder_path_base: str, output_folder_pat
 		return None
 	if not os.path.exists(output_folder_path_base):
 		os.makedirs(output_folder_path_base)
+	start_recording(metrics_path, reset=True)
+	if regrid and regrid_file and regrid_cache_folder is None:
+		regrid_cache_folder = os.path.join(output_folder_path_base, 'regrid_cache')
+	# The settings that change the outputs, recorded in the run manifest with the input files
+	settings = {
+		'variable': chosen_variable,
+		'regrid_file_hash': file_hash(regrid_file) if regrid and regrid_file else None,
+		'regrid_method': regrid_method if regrid and regrid_file else None,
+		'resample_rate': resample_rate if resample and resample_rate else None,
+		'unit_conversion_factor': unit_conversion_factor,
+	}
+	mask_hashes = {region: mask_file_hash(mask_folder, region) for region in regions}
 
+	tasks = []
+	labels = []
+	up_to_date = 0
 	for year in years:
 		input_folder_path = os.path.join(input_folder_path_base, str(year))
 		output_folder_path = os.path.join(output_folder_path_base, str(year))
@@ -136,77 +393,60 @@ def process_nc_files(years: list, input_folder_path_base: str, output_folder_pat
 			os.makedirs(output_folder_path)
 		# if 'global' not in regions:
 		# 	regions.append('global')
-		if regrid and regrid_file:
-			# Load the regrid file to get the new grid
-			regrid_dataset = xr.open_dataset(regrid_file)
 		files_by_month = {}
-		for filename in os.listdir(input_folder_path):
+		for filename in sorted(os.listdir(input_folder_path)):
 			if filename.endswith('.nc4'):
 				year_month = extract_year_month(filename)
 				if year_month:
+					if resample and resample_rate:
+						# Skip granules off the resampling interval without opening them
+						file_timestamp = extract_start_time(filename)
+						if file_timestamp is not None and not matches_resample_rate(file_timestamp, resample_rate):
+							continue
 					files_by_month.setdefault(year_month, []).append(filename)
+		output_directories = {}
 		for region in regions:
 			# Create a folder for each region inside the base output directory
 			output_directory = os.path.join(output_folder_path, region)
 			if not os.path.exists(output_directory):
 				os.makedirs(output_directory)
-			for (year, month), files in files_by_month.items():
-				all_values = []
-				monthly_datasets = []
-				for file in files:
-					file_path = os.path.join(input_folder_path, file)
-					with xr.open_dataset(file_path) as ds:
-						if resample and resample_rate:
-							# Extract the time variable from the dataset
-							time_var = ds['time'].values[0]
-							# Use cftime to convert the time variable
-							if isinstance(time_var, cftime.datetime):
-								timestamp = cftime.datetime(time_var.year, time_var.month, time_var.day, time_var.hour, time_var.minute)
-							else:
-								timestamp = pd.to_datetime(time_var)
-							# Check if the timestamp is at the desired resampling interval
-							if timestamp.hour % resample_rate != 0 or timestamp.minute != 0:
-								continue  # Skip this file
-						if regrid_file:
-							with warnings.catch_warnings():
-								warnings.simplefilter("ignore", FutureWarning)
-								ds = ds.interp(
-									lat=regrid_dataset['lat'],
-									lon=regrid_dataset['lon'],
-									method='nearest',
-									kwargs={'fill_value': None}
-								)
-
-						if region != 'global':
-							mask_file = f'{mask_folder}/{region}_mask.nc'
-							mask = xr.open_dataset(mask_file)
-							mask = mask.rename({'latitude': 'lat', 'longitude': 'lon'})
-							mask = mask.reindex(lat=np.append(np.insert(mask.lat.values, 0, -90), 90), fill_value=0)
-							ds[chosen_variable] = ds[chosen_variable].where(mask['mask'])
-
-						variable_data = ds[chosen_variable]
-						if unit_conversion_factor != 1.0:
-							# Apply unit conversion if unit_conversion_factor is not 1.0
-							variable_data *= unit_conversion_factor
-						all_values.append(variable_data.values.flatten())
-						monthly_datasets.append(variable_data)
-
-				# Combine all values for the month into a single array and save as .npz
-				all_values_combined = np.concatenate(all_values)
-				npz_output_filename = f"{year}_{month:02d}_{region}_{chosen_variable}.npz"
-				npz_output_path = os.path.join(output_directory, npz_output_filename)
-				np.savez_compressed(npz_output_path, all_values=all_values_combined)
-				# Calculate the average across the month and save as .nc
-				average_data = xr.concat(monthly_datasets, dim='time').mean(dim='time')
-				nc_output_filename = f"{year}_{month:02d}_{region}_{chosen_variable}_average.nc"
-				nc_output_path = os.path.join(output_directory, nc_output_filename)
-				average_data.to_netcdf(nc_output_path)
-				print(f'Completed processing files from {calendar.month_name[month]} {year} for {region} region.')
+			output_directories[region] = output_directory
+		for (file_year, month), files in sorted(files_by_month.items()):
+			input_paths = [os.path.join(input_folder_path, file) for file in files]
+			manifest_entries = {}
+			for region in regions:
+				entry = manifest_entry(input_paths, dict(settings, mask_hash=mask_hashes[region]))
+				entry_path = manifest_entry_path(output_folder_path_base, file_year, month, region, chosen_variable)
+				output_paths = [os.path.join(output_directories[region], f"{file_year}_{month:02d}_{region}_{chosen_variable}{suffix}")
+					for suffix in ['_average.nc', '.npz']]
+				with stage('manifest_check', year=file_year, month=month, region=region):
+					current = not rebuild and is_up_to_date(entry_path, entry, output_paths)
+				if current:
+					up_to_date += 1
+					continue
+				manifest_entries[region] = (entry_path, entry)
+			if manifest_entries:
+				tasks.append((file_year, month, files, input_folder_path, output_directories, chosen_variable, regrid, 
+					resample, list(manifest_entries), mask_folder, regrid_file, resample_rate, unit_conversion_factor, 
+					regrid_method, regrid_cache_folder, int(max_buffer_gb * 1024 ** 3), manifest_entries, metrics_path))
+				labels.append(f'{calendar.month_name[month]} {file_year}')
+
+	if up_to_date:
+		print(f'{up_to_date} outputs are up to date and were skipped')
+	results, failures = run_tasks(process_month, tasks, labels, workers)
+	for label, result in results.items():
+		if result['skipped_files']:
+			print(f"{label}: skipped {len(result['skipped_files'])} unreadable files: {', '.join(result['skipped_files'])} "
+				"(not recorded in the run manifest, so it is redone by the next run)")
+	if metrics_path:
+		print_metrics_summary(metrics_path)
+		start_recording(None)
+	return failures
 #----------------------------------END OF FUNCTIONS--------------------------------#
 
 #-------------------------------MAIN CODE-----------------------------------#
 if __name__ == "__main__":
 	years = list(range(start_year, end_year+1))
-	process_nc_files(years, original_data_folder, output_folder, variable_name, regrid, resample, regions, mask_folder, regrid_file, resample_rate, unit_conversion_factor) 
+	process_nc_files(years, original_data_folder, output_folder, variable_name, regrid, resample, regions, mask_folder, regrid_file, resample_rate, unit_conversion_factor, workers, regrid_method, max_buffer_gb=max_buffer_gb, rebuild=rebuild, metrics_path=metrics_file) 
 #---------------------------------END OF MAIN CODE---------------------------------#
 
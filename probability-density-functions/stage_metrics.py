@@ -0,0 +1,189 @@
+'''
+Stage Metrics
+--part of the IMERG-GISS-comparison script package--
+Description: This script contains the optional instrumentation of saveIMERGfiles.py, saveGISSfiles.py and
+IMERG_GISS_hist_stats.py. When a metrics file is given to those scripts, every stage of the processing (such
+as opening a file, regridding, applying a region mask or saving an output) is measured and written as one
+JSON line to the metrics file:
+	-- stage: the stage name, and labels such as year, month, region and file
+	-- wall_s and cpu_s: the wall and CPU time of the stage
+	-- bytes_read: the sizes of the files whose data the stage read. A file that is opened lazily (like
+	   xr.open_dataset) is charged to the stage that loads its data, not to the stage that opens it.
+	-- bytes_written: the sizes of the files the stage wrote
+	-- files_opened: the number of files the stage opened or wrote
+	-- rss_mb: the resident memory of the process when the stage started
+	-- rss_increase_mb: how far the resident memory rose above rss_mb during the stage. On Linux the peak
+	   of the process is reset at the start of every stage, so this is the stage's own peak even in a worker
+	   process that already ran other months. Elsewhere it is how much the stage raised the peak of the
+	   process, which is 0 for a stage that stays below an earlier peak. Stages are not nested.
+	-- pid: the process, since worker processes append to the same file
+At the end of a run, print_metrics_summary prints (and saves next to the metrics file) one row per stage
+with its count, total times, share of the wall time, MB read and written, files opened and largest memory
+increase. When no metrics file is given, the stages are not measured.
+
+Lily Donaldson [agency]<lily.k.donaldson@nasa.gov> [evergreen]<lilykdonaldson@gmail.com>
+January 2024, Developed with Python 3.9.13
+'''
+
+#---------------------------IMPORTS--------------------------------#
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+try:
+	import resource
+except ImportError:  # not available on Windows
+	resource = None
+
+#------------------------------------------------------------------#
+
+# The metrics file of this process, or None when the stages are not measured
+_metrics_path = None
+
+#---------------------------FUNCTIONS--------------------------------#
+
+def start_recording(metrics_path: str, reset: bool = False):
+	"""
+	Starts writing stage metrics to a JSON lines file in this process.
+	:param metrics_path: Path of the metrics file, or None to not measure the stages.
+	:param reset: If True, the file is emptied first (done once by the main process at the start of a run).
+	"""
+	global _metrics_path
+	_metrics_path = metrics_path
+	if metrics_path and reset:
+		folder = os.path.dirname(os.path.abspath(metrics_path))
+		if not os.path.exists(folder):
+			os.makedirs(folder)
+		open(metrics_path, 'w').close()
+
+def peak_rss_mb():
+	"""
+	The peak resident memory of this process in MB (None where it is not available).
+	"""
+	if resource is None:
+		return None
+	# ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+	scale = 1 if sys.platform == 'darwin' else 1024
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+def current_rss_mb():
+	"""
+	The current and peak resident memory of this process in MB as a tuple, read from /proc/self/status
+	(None where it is not available). The peak is the one since the last reset_peak_rss.
+	"""
+	try:
+		with open('/proc/self/status') as f:
+			fields = dict(line.split(':', 1) for line in f if ':' in line)
+		# The sizes are in kB (1024 bytes)
+		return int(fields['VmRSS'].split()[0]) * 1024 / 1e6, int(fields['VmHWM'].split()[0]) * 1024 / 1e6
+	except (OSError, KeyError, ValueError):
+		return None
+
+def reset_peak_rss():
+	"""
+	Resets the peak resident memory of this process to its current resident memory (Linux only).
+	:return: True if the peak was reset.
+	"""
+	try:
+		with open('/proc/self/clear_refs', 'w') as f:
+			f.write('5')
+		return True
+	except OSError:
+		return False
+
+def _file_size(path: str):
+	return os.path.getsize(path) if os.path.exists(path) else 0
+
+@contextmanager
+def stage(name: str, opened_paths: list = (), read_paths: list = (), written_paths: list = (), **labels):
+	"""
+	Measures the code inside a with block as one stage and writes it to the metrics file (if recording).
+	:param name: The stage name, like 'open_dataset' or 'save_netcdf'.
+	:param opened_paths: The files the stage opens (counted in files_opened).
+	:param read_paths: The files whose data the stage reads (counted in bytes_read). A file that is opened and
+	       read in the same stage is passed as both.
+	:param written_paths: The files the stage writes (their sizes are taken when the stage ends).
+	:param labels: Labels of the record, like year=2012, month=1, region='northeast'.
+	"""
+	if _metrics_path is None:
+		yield
+		return
+	start_rss = current_rss_mb()
+	peak_was_reset = start_rss is not None and reset_peak_rss()
+	start_peak = peak_rss_mb()
+	start_wall, start_cpu = time.perf_counter(), time.process_time()
+	yield
+	wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+	if peak_was_reset:
+		rss_increase = max(current_rss_mb()[1] - start_rss[0], 0.0)
+	elif start_peak is not None:
+		rss_increase = peak_rss_mb() - start_peak
+	else:
+		rss_increase = None
+	record = {
+		'stage': name,
+		**labels,
+		'wall_s': wall,
+		'cpu_s': cpu,
+		'bytes_read': sum(_file_size(path) for path in read_paths),
+		'bytes_written': sum(_file_size(path) for path in written_paths),
+		'files_opened': len(opened_paths) + len(written_paths),
+		'rss_mb': start_rss[0] if start_rss is not None else start_peak,
+		'rss_increase_mb': rss_increase,
+		'pid': os.getpid(),
+	}
+	# One short write per line, so lines from worker processes appending to the same file do not mix
+	with open(_metrics_path, 'a') as f:
+		f.write(json.dumps(record, default=str) + '\n')
+
+def read_metrics(metrics_path: str):
+	"""
+	Reads the records of a metrics file.
+	:param metrics_path: Path of the metrics file.
+	"""
+	with open(metrics_path) as f:
+		return [json.loads(line) for line in f if line.strip()]
+
+def summarize_metrics(records: list):
+	"""
+	Totals the records of every stage.
+	:param records: Records from read_metrics.
+	:return: A list of dictionaries (one per stage, longest total wall time first) with 'stage', 'count', 'wall_s',
+	         'cpu_s', 'wall_share', 'mb_read', 'mb_written', 'files_opened' and 'rss_increase_mb' (the
+	         largest of the stage's records).
+	"""
+	stages = {}
+	for record in records:
+		total = stages.setdefault(record['stage'], {'stage': record['stage'], 'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+			'mb_read': 0.0, 'mb_written': 0.0, 'files_opened': 0, 'rss_increase_mb': 0.0})
+		total['count'] += 1
+		total['wall_s'] += record['wall_s']
+		total['cpu_s'] += record['cpu_s']
+		total['mb_read'] += record['bytes_read'] / 1e6
+		total['mb_written'] += record['bytes_written'] / 1e6
+		total['files_opened'] += record['files_opened']
+		total['rss_increase_mb'] = max(total['rss_increase_mb'], record['rss_increase_mb'] or 0)
+	wall = sum(total['wall_s'] for total in stages.values())
+	for total in stages.values():
+		total['wall_share'] = total['wall_s'] / wall if wall > 0 else 0.0
+	return sorted(stages.values(), key=lambda total: total['wall_s'], reverse=True)
+
+def print_metrics_summary(metrics_path: str):
+	"""
+	Prints the summary table of a metrics file and saves it next to it, like 'metrics.jsonl.summary.txt'.
+	:param metrics_path: Path of the metrics file.
+	"""
+	lines = [f"{'stage':<16}{'count':>7}{'wall s':>10}{'cpu s':>10}{'share':>8}{'MB read':>10}{'MB written':>12}"
+		f"{'files':>8}{'+RSS MB':>9}"]
+	for total in summarize_metrics(read_metrics(metrics_path)):
+		lines.append(f"{total['stage']:<16}{total['count']:>7}{total['wall_s']:>10.2f}{total['cpu_s']:>10.2f}"
+			f"{total['wall_share']:>8.1%}{total['mb_read']:>10.1f}{total['mb_written']:>12.1f}{total['files_opened']:>8}"
+			f"{total['rss_increase_mb']:>9.0f}")
+	summary = '\n'.join(lines)
+	print(summary)
+	with open(metrics_path + '.summary.txt', 'w') as f:
+		f.write(summary + '\n')
+	return summary
+
+#----------------------------------END OF FUNCTIONS--------------------------------#
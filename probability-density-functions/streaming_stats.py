@@ -0,0 +1,161 @@
+'''
+Streaming Stats
+--part of the IMERG-GISS-comparison script package--
+Description: This script contains the streaming statistics used by IMERG_GISS_hist_stats.py. Values are
+added one month at a time to an accumulator (a dictionary of fixed-size arrays), so memory does not
+grow with the number of months. Accumulators with the same bins can be merged, so per-month results can
+be combined into seasons and multi-year spans without re-reading the data.
+
+An accumulator keeps:
+	-- the count, sum, min and max of the values (exact)
+	-- counts for fixed histogram bins, used to draw density histograms
+	-- a quantile sketch: counts in logarithmically spaced buckets whose width grows with the value, so any
+	   percentile can be estimated with a relative error of at most sketch_relative_accuracy (0.5%).
+	   Values at or below sketch_min_value (including zero and small negative rounding errors) share one
+	   bucket and are reported as 0.
+
+Lily Donaldson [agency]<lily.k.donaldson@nasa.gov> [evergreen]<lilykdonaldson@gmail.com>
+January 2024, Developed with Python 3.9.13
+'''
+
+#---------------------------IMPORTS--------------------------------#
+import numpy as np #developed with v.1.24.3
+
+#------------------------------------------------------------------#
+
+sketch_relative_accuracy = 0.005
+sketch_min_value = 1e-6
+sketch_max_value = 1e5
+_sketch_gamma = (1 + sketch_relative_accuracy) / (1 - sketch_relative_accuracy)
+_sketch_offset = int(np.floor(np.log(sketch_min_value) / np.log(_sketch_gamma))) - 1
+_sketch_buckets = int(np.ceil(np.log(sketch_max_value) / np.log(_sketch_gamma))) - _sketch_offset + 1
+
+#---------------------------FUNCTIONS--------------------------------#
+
+def new_accumulator(bins):
+	"""
+	Returns an empty accumulator.
+	:param bins: The histogram bin edges (like np.linspace(0, 550, 50)).
+	"""
+	return {
+		'count': 0,
+		'sum': 0.0,
+		'min': np.inf,
+		'max': -np.inf,
+		'bins': np.asarray(bins, dtype=np.float64),
+		'hist_counts': np.zeros(len(bins) - 1, dtype=np.int64),
+		'sketch_counts': np.zeros(_sketch_buckets + 1, dtype=np.int64),
+	}
+
+def add_values(accumulator: dict, values):
+	"""
+	Adds values to an accumulator in place. NaN values are ignored.
+	:param accumulator: An accumulator from new_accumulator.
+	:param values: An array of values of any shape.
+	"""
+	values = np.asarray(values, dtype=np.float64).ravel()
+	values = values[~np.isnan(values)]
+	if values.size == 0:
+		return accumulator
+	accumulator['count'] += values.size
+	accumulator['sum'] += float(values.sum())
+	accumulator['min'] = min(accumulator['min'], float(values.min()))
+	accumulator['max'] = max(accumulator['max'], float(values.max()))
+	accumulator['hist_counts'] += np.histogram(values, bins=accumulator['bins'])[0]
+	# Bucket 0 holds the values at or below sketch_min_value, bucket i > 0 holds (gamma^(i-1+offset), gamma^(i+offset)]
+	positive = values > sketch_min_value
+	buckets = np.zeros(values.size, dtype=np.int64)
+	buckets[positive] = np.ceil(np.log(values[positive]) / np.log(_sketch_gamma)).astype(np.int64) - _sketch_offset
+	np.clip(buckets, 0, _sketch_buckets, out=buckets)
+	accumulator['sketch_counts'] += np.bincount(buckets, minlength=_sketch_buckets + 1)
+	return accumulator
+
+def merge_accumulators(accumulators: list):
+	"""
+	Merges accumulators that were created with the same bins into a new accumulator.
+	:param accumulators: A list of accumulators.
+	"""
+	merged = new_accumulator(accumulators[0]['bins'])
+	for accumulator in accumulators:
+		if not np.array_equal(accumulator['bins'], merged['bins']):
+			raise ValueError("accumulators with different histogram bins cannot be merged.")
+		merged['count'] += accumulator['count']
+		merged['sum'] += accumulator['sum']
+		merged['min'] = min(merged['min'], accumulator['min'])
+		merged['max'] = max(merged['max'], accumulator['max'])
+		merged['hist_counts'] += accumulator['hist_counts']
+		merged['sketch_counts'] += accumulator['sketch_counts']
+	return merged
+
+def accumulator_mean(accumulator: dict):
+	"""
+	Returns the mean of the values added to an accumulator.
+	:param accumulator: An accumulator.
+	"""
+	if accumulator['count'] == 0:
+		return np.nan
+	return accumulator['sum'] / accumulator['count']
+
+def accumulator_percentile(accumulator: dict, percentile: float):
+	"""
+	Estimates a percentile (0-100) of the values added to an accumulator from its quantile sketch.
+	:param accumulator: An accumulator.
+	:param percentile: The percentile, such as 95.
+	"""
+	if accumulator['count'] == 0:
+		return np.nan
+	# Same rank as np.percentile's default (linear) method, rounded to the nearest value
+	rank = int(round(percentile / 100 * (accumulator['count'] - 1)))
+	bucket = int(np.searchsorted(np.cumsum(accumulator['sketch_counts']), rank + 1))
+	if bucket == 0:
+		return 0.0
+	# The midpoint (in relative terms) of the bucket (gamma^(k-1), gamma^k]
+	value = 2 * _sketch_gamma ** (bucket + _sketch_offset) / (_sketch_gamma + 1)
+	return float(np.clip(value, accumulator['min'], accumulator['max']))
+
+def accumulator_density(accumulator: dict):
+	"""
+	Returns the histogram densities of an accumulator, like np.histogram(..., density=True).
+	:param accumulator: An accumulator.
+	"""
+	total = accumulator['hist_counts'].sum()
+	if total == 0:
+		return np.zeros(len(accumulator['hist_counts']))
+	return accumulator['hist_counts'] / (total * np.diff(accumulator['bins']))
+
+def save_accumulators(output_path: str, accumulators: dict, extra_arrays: dict = None):
+	"""
+	Saves accumulators that share the same bins to one compressed .npz file.
+	:param output_path: Path of the .npz file.
+	:param accumulators: A dictionary of accumulators keyed by a name such as '2012_01'.
+	:param extra_arrays: Optional additional arrays to save in the file (keys must not contain '/').
+	"""
+	arrays = dict(extra_arrays or {})
+	for name, accumulator in accumulators.items():
+		arrays['bins'] = accumulator['bins']
+		for field in ['count', 'sum', 'min', 'max', 'hist_counts', 'sketch_counts']:
+			arrays[f'{name}/{field}'] = np.asarray(accumulator[field])
+	np.savez_compressed(output_path, **arrays)
+
+def load_accumulators(npz_path: str):
+	"""
+	Loads accumulators saved with save_accumulators.
+	:param npz_path: Path of the .npz file.
+	:return: A tuple (accumulators, extra_arrays) of dictionaries.
+	"""
+	accumulators = {}
+	extra_arrays = {}
+	with np.load(npz_path) as data:
+		for key in data.files:
+			if '/' not in key:
+				if key != 'bins':
+					extra_arrays[key] = data[key]
+				continue
+			name, field = key.split('/')
+			if name not in accumulators:
+				accumulators[name] = new_accumulator(data['bins'])
+			value = data[key]
+			accumulators[name][field] = value if value.ndim else value.item()
+	return accumulators, extra_arrays
+
+#----------------------------------END OF FUNCTIONS--------------------------------#
@@ -0,0 +1,31 @@
+'''
+Checks regrid_index.py against ds.interp(method='nearest', kwargs={'fill_value': None}) on the IMERG 0.1 degree
+grid (float32 coordinates, like the V07 files) regridded to the 2x2.5 degree grid of regrid_2x2-5.nc.
+Run with: python -m pytest test_regrid_index.py
+'''
+
+#---------------------------IMPORTS--------------------------------#
+import numpy as np
+import xarray as xr
+import pytest
+from regrid_index import build_regrid_index, regrid_data_array
+
+pytest.importorskip('scipy')
+
+#------------------------------------------------------------------#
+
+imerg_lat = np.linspace(-89.95, 89.95, 1800).astype(np.float32)
+imerg_lon = np.linspace(-179.95, 179.95, 3600).astype(np.float32)
+target_lat = np.arange(-90, 90.1, 2.0)
+target_lon = np.arange(-180, 180, 2.5)
+
+def test_nearest_matches_interp():
+	rng = np.random.default_rng(0)
+	data = xr.DataArray(rng.random((1, 1800, 3600), dtype=np.float32), dims=('time', 'lat', 'lon'),
+		coords={'time': [0], 'lat': imerg_lat, 'lon': imerg_lon}, name='precipitation')
+	expected = data.interp(lat=target_lat, lon=target_lon, method='nearest', kwargs={'fill_value': None})
+	regridded = regrid_data_array(data, build_regrid_index(imerg_lat, imerg_lon, target_lat, target_lon, 'nearest'),
+		target_lat, target_lon)
+	np.testing.assert_array_equal(regridded.values, expected.values)
+	# Latitude +-90 and longitude -180 are outside the IMERG grid
+	assert np.isnan(regridded.values).sum() == 2 * len(target_lon) + len(target_lat) - 2
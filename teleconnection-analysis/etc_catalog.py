@@ -0,0 +1,256 @@
+'''
+ETC Catalog
+--part of the teleconnection analysis code--
+Description: This script converts the yearly extratropical cyclone (ETC) pickles (like
+'{fileheader}east_ETCs_{year}.pkl', lists of event dictionaries) into one columnar catalog saved as an
+uncompressed .npz file, so the notebooks load every year at once instead of unpickling one file per year
+and looping over Python dictionaries.
+    -- Event columns: event_id, year (of the pickle), start_time, end_time (NaT if not in the pickle),
+       region, bomb, bomb_in_mask, AR_bomb_concurrent, storm_id (-1 if not in the pickle).
+    -- An event without a start_time in the pickle starts at the time of its first track point, or at the
+       start of the pickle's year when its track has no times; start_time_estimated marks these events and
+       a warning gives their number.
+    -- Tracks are ragged arrays: the points of event i are point_lat/point_lon/point_time
+       [track_offsets[i]:track_offsets[i + 1]]. The points come from the sorted 'storm_files' names
+       (latitude and longitude are the 4th and 5th '_'-separated parts, point_time is NaT) or, when an ERA5
+       track file is given, from its rows for the event's storm_id.
+    -- bomb_start/bomb_end are the positions of 'bomb_start_file'/'bomb_end_file' in the event's track
+       (-1 if not in the pickle).
+select_etcs queries the catalog by date range, region and bomb status, and track_points gathers the track
+points of the selected events without a Python loop.
+
+Example:
+    catalog = open_etc_catalog(fileheader + "east_ETCs_{year}.pkl", 1950, 2023, fileheader + "east_ETCs.npz")
+    winter_bombs = select_etcs(catalog, start="2000-12-01", end="2001-03-01", bomb=True)
+    points = track_points(catalog, winter_bombs)
+'''
+
+#---------------------------IMPORTS--------------------------------#
+import os
+import pickle
+import warnings
+import numpy as np
+import pandas as pd
+
+#------------------------------------------------------------------#
+
+era5_track_columns = [
+    'Year', 'Month', 'Day', 'Hour', 'Unused1', 'lat_proxy', 'lon_proxy', 'Unused2',
+    'Sea_level_pressure', 'Unused3', 'Unused4', 'Unused5', 'Unused6',
+    'Unused7', 'CSI', 'USI'
+]
+
+#---------------------------FUNCTIONS--------------------------------#
+
+def _to_datetime64(value):
+    if value is None:
+        return np.datetime64('NaT', 'ns')
+    return pd.Timestamp(value).to_datetime64()
+
+
+def read_era5_tracks(track_file):
+    """
+    Reads an ERA5 cyclone track text file (like out_era5_output_1950_2019.txt) sorted by storm and time.
+    :param track_file: Path to the whitespace-delimited track file.
+    :return: A dictionary with 'storm_id', 'lat', 'lon' and 'time' arrays.
+    """
+    data = pd.read_csv(track_file, sep=r'\s+', names=era5_track_columns)
+    # Convert proxies to actual values, the same as the storm-track notebook
+    lat = 90 - data['lat_proxy'].to_numpy() / 100
+    lon = data['lon_proxy'].to_numpy() / 100
+    lon = np.where(lon > 90, lon - 360, lon)
+    time = pd.to_datetime(pd.DataFrame({'year': data['Year'], 'month': data['Month'],
+                                        'day': data['Day'], 'hour': data['Hour']})).values
+    storm_id = data['USI'].to_numpy()
+    order = np.lexsort((time, storm_id))
+    return {'storm_id': storm_id[order], 'lat': lat[order], 'lon': lon[order], 'time': time[order]}
+
+
+def convert_etc_pickles(path_template, start_year, end_year, catalog_path, era5_track_file=None):
+    """
+    Converts yearly ETC pickles into one catalog file (see the description at the top of this script).
+    :param path_template: Path of the pickles with a '{year}' placeholder, like "ECERA5/ERA5_ERA5ar_east_ETCs_{year}.pkl".
+    :param start_year: The first year.
+    :param end_year: The last year (inclusive).
+    :param catalog_path: Path of the .npz catalog to write.
+    :param era5_track_file: Optional ERA5 track text file to take the track points from (by storm_id).
+    :return: The catalog dictionary.
+    """
+    era5_tracks = None
+    if era5_track_file is not None:
+        era5_tracks = read_era5_tracks(era5_track_file)
+        track_ids, track_starts, track_counts = np.unique(era5_tracks['storm_id'], return_index=True, return_counts=True)
+
+    columns = {key: [] for key in ['year', 'start_time', 'end_time', 'region', 'bomb', 'bomb_in_mask',
+                                   'AR_bomb_concurrent', 'storm_id', 'bomb_start', 'bomb_end']}
+    track_lengths = []
+    point_lat, point_lon, point_time = [], [], []
+    for year in range(start_year, end_year + 1):
+        with open(path_template.format(year=year), 'rb') as f:
+            events = pickle.load(f)
+
+        for event in events:
+            storm_files = sorted(event.get('storm_files', []))
+            if era5_tracks is not None:
+                position = np.searchsorted(track_ids, event.get('storm_id', -1))
+                if position < len(track_ids) and track_ids[position] == event.get('storm_id', -1):
+                    points = slice(track_starts[position], track_starts[position] + track_counts[position])
+                else:
+                    points = slice(0, 0)
+                lat, lon, time = era5_tracks['lat'][points], era5_tracks['lon'][points], era5_tracks['time'][points]
+            else:
+                parts = [filename.split('_') for filename in storm_files]
+                lat = np.array([float(part[3]) for part in parts])
+                lon = np.array([float(part[4]) for part in parts])
+                time = np.full(len(parts), np.datetime64('NaT', 'ns'))
+            point_lat.append(lat)
+            point_lon.append(lon)
+            point_time.append(time)
+            track_lengths.append(len(lat))
+
+            columns['year'].append(year)
+            columns['start_time'].append(_to_datetime64(event.get('start_time')))
+            columns['end_time'].append(_to_datetime64(event.get('end_time')))
+            columns['region'].append(event.get('region') or '')
+            columns['bomb'].append(bool(event.get('bomb', False)))
+            columns['bomb_in_mask'].append(bool(event.get('bomb_in_mask', False)))
+            columns['AR_bomb_concurrent'].append(bool(event.get('AR_bomb_concurrent', False)))
+            columns['storm_id'].append(event.get('storm_id', -1))
+            for key, file_key in [('bomb_start', 'bomb_start_file'), ('bomb_end', 'bomb_end_file')]:
+                bomb_file = event.get(file_key)
+                columns[key].append(storm_files.index(bomb_file) if bomb_file in storm_files else -1)
+
+    catalog = {
+        'event_id': np.arange(len(track_lengths)),
+        'year': np.array(columns['year'], dtype=np.int64),
+        'start_time': np.array(columns['start_time'], dtype='datetime64[ns]'),
+        'end_time': np.array(columns['end_time'], dtype='datetime64[ns]'),
+        'region': np.array(columns['region'], dtype=str),
+        'bomb': np.array(columns['bomb'], dtype=bool),
+        'bomb_in_mask': np.array(columns['bomb_in_mask'], dtype=bool),
+        'AR_bomb_concurrent': np.array(columns['AR_bomb_concurrent'], dtype=bool),
+        'storm_id': np.array(columns['storm_id'], dtype=np.int64),
+        'bomb_start': np.array(columns['bomb_start'], dtype=np.int64),
+        'bomb_end': np.array(columns['bomb_end'], dtype=np.int64),
+        'track_offsets': np.concatenate([[0], np.cumsum(track_lengths, dtype=np.int64)]),
+        'point_lat': np.concatenate(point_lat + [np.empty(0)]).astype(np.float64),
+        'point_lon': np.concatenate(point_lon + [np.empty(0)]).astype(np.float64),
+        'point_time': np.concatenate(point_time + [np.empty(0, dtype='datetime64[ns]')]).astype('datetime64[ns]'),
+    }
+    # Events without a start time start at their first track point, or else at the start of their pickle's year
+    estimated = np.isnat(catalog['start_time'])
+    if estimated.any():
+        has_points = np.diff(catalog['track_offsets']) > 0
+        first_time = np.full(len(estimated), np.datetime64('NaT', 'ns'))
+        first_time[has_points] = catalog['point_time'][catalog['track_offsets'][:-1][has_points]]
+        year_start = (catalog['year'] - 1970).astype('datetime64[Y]').astype('datetime64[ns]')
+        from_track = estimated & ~np.isnat(first_time)
+        catalog['start_time'] = np.where(from_track, first_time, np.where(estimated, year_start, catalog['start_time']))
+        warnings.warn(f"{estimated.sum()} ETCs have no start_time: {from_track.sum()} start at their first track "
+                      f"point and {(estimated & ~from_track).sum()} at the start of their pickle's year "
+                      f"(see 'start_time_estimated').")
+    catalog['start_time_estimated'] = estimated
+    # Uncompressed, so loading the catalog is only a read of the arrays
+    np.savez(catalog_path, **catalog)
+    return catalog
+
+
+def load_etc_catalog(catalog_path):
+    """
+    Loads a catalog written by convert_etc_pickles.
+    :param catalog_path: Path of the .npz catalog.
+    """
+    with np.load(catalog_path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def open_etc_catalog(path_template, start_year, end_year, catalog_path, era5_track_file=None):
+    """
+    Loads a catalog, converting the pickles first if the catalog does not exist or a pickle is newer than it.
+    The parameters are the same as convert_etc_pickles.
+    """
+    sources = [path_template.format(year=year) for year in range(start_year, end_year + 1)]
+    if era5_track_file is not None:
+        sources.append(era5_track_file)
+    if os.path.exists(catalog_path) and os.path.getmtime(catalog_path) >= max(os.path.getmtime(s) for s in sources):
+        catalog = load_etc_catalog(catalog_path)
+        # Catalogs written before missing start times were filled are converted again
+        if 'start_time_estimated' in catalog:
+            return catalog
+    return convert_etc_pickles(path_template, start_year, end_year, catalog_path, era5_track_file)
+
+
+def select_etcs(catalog, start=None, end=None, regions=None, bomb=None, bomb_in_mask=None):
+    """
+    Finds the events of a catalog that match all of the given conditions.
+    :param catalog: A catalog from load_etc_catalog.
+    :param start: Keep events that start at or after this time.
+    :param end: Keep events that start before this time.
+    :param regions: Keep events in these regions (like ['northeast', 'southeast']).
+    :param bomb: If True (False), keep only events that did (did not) become bomb cyclones.
+    :param bomb_in_mask: If True (False), keep only events whose bombogenesis was (was not) inside the mask.
+    :return: The indices of the selected events.
+    """
+    selected = np.ones(len(catalog['event_id']), dtype=bool)
+    if start is not None:
+        selected &= catalog['start_time'] >= pd.Timestamp(start).to_datetime64()
+    if end is not None:
+        selected &= catalog['start_time'] < pd.Timestamp(end).to_datetime64()
+    if regions is not None:
+        selected &= np.isin(catalog['region'], list(regions))
+    if bomb is not None:
+        selected &= catalog['bomb'] == bomb
+    if bomb_in_mask is not None:
+        selected &= catalog['bomb_in_mask'] == bomb_in_mask
+    return np.flatnonzero(selected)
+
+
+def track_points(catalog, events=None, bomb_segment=False):
+    """
+    Gathers the track points of some events.
+    :param catalog: A catalog from load_etc_catalog.
+    :param events: Indices of the events (such as from select_etcs). None uses every event.
+    :param bomb_segment: If True, only the points from bomb_start to bomb_end of every event are used
+                         (events without them have no points).
+    :return: A dictionary with 'lat', 'lon', 'time' and 'event' (the index of the event of each point) arrays,
+             with the points of every event in track order.
+    """
+    offsets = catalog['track_offsets']
+    events = np.arange(len(offsets) - 1) if events is None else np.asarray(events, dtype=np.int64)
+    starts = offsets[events]
+    lengths = offsets[events + 1] - starts
+    if bomb_segment:
+        has_segment = (catalog['bomb_start'][events] >= 0) & (catalog['bomb_end'][events] >= catalog['bomb_start'][events])
+        starts = starts + np.where(has_segment, catalog['bomb_start'][events], 0)
+        lengths = np.where(has_segment, catalog['bomb_end'][events] - catalog['bomb_start'][events] + 1, 0)
+    # Index of every point: the start of its event plus its position within the event
+    point_event = np.repeat(np.arange(len(events)), lengths)
+    first_point = np.cumsum(lengths) - lengths
+    points = starts[point_event] + np.arange(len(point_event)) - first_point[point_event]
+    return {
+        'lat': catalog['point_lat'][points],
+        'lon': catalog['point_lon'][points],
+        'time': catalog['point_time'][points],
+        'event': events[point_event],
+    }
+
+
+def etc_records(catalog, events=None):
+    """
+    Yields the events of a catalog as dictionaries with the same keys as the pickles ('start_time' is a datetime).
+    :param catalog: A catalog from load_etc_catalog.
+    :param events: Indices of the events (such as from select_etcs). None uses every event.
+    """
+    events = range(len(catalog['event_id'])) if events is None else events
+    for i in events:
+        yield {
+            'start_time': pd.Timestamp(catalog['start_time'][i]).to_pydatetime(),
+            'end_time': pd.Timestamp(catalog['end_time'][i]).to_pydatetime(),
+            'region': str(catalog['region'][i]),
+            'bomb': bool(catalog['bomb'][i]),
+            'bomb_in_mask': bool(catalog['bomb_in_mask'][i]),
+            'AR_bomb_concurrent': bool(catalog['AR_bomb_concurrent'][i]),
+            'storm_id': int(catalog['storm_id'][i]),
+        }
+
+#----------------------------------END OF FUNCTIONS--------------------------------#
@@ -0,0 +1,126 @@
+'''
+Grid Correlation
+--part of the teleconnection analysis code--
+Description: This script contains a vectorized replacement for the per-gridpoint pearsonr loops in
+merra2regAnalysis.ipynb. The Pearson correlation coefficient and its two-sided p-value (the same values
+scipy.stats.pearsonr returns) are computed between one or more oscillation index time series and every
+gridpoint of a (time, lat, lon) field in one batched NumPy pass: both series are standardized and the
+correlations are a single tensordot over time. Optionally the gridpoints are processed in chunks to bound
+memory use.
+
+correlate_with_indices runs the whole sweep used in merra2regAnalysis.ipynb at once: every oscillation
+(ENSO, NAO, AO, PDO, PNA, ...) for every month, with the index tables read like the notebook reads them
+(a 'Year' column followed by one column per month).
+
+Example:
+    f = open_merra2_store(directory + "full_merra2_monthly.zarr")  # see merra2_combiner.py
+    tables = {o: read_index_table(f"{o}.csv") for o in ["ENSO", "NAO", "AO", "PDO", "PNA"]}
+    correlations = correlate_with_indices(f['T2MMEAN'], tables)
+    correlations['r'].sel(oscillation="PDO", month=1).plot()
+'''
+
+#---------------------------IMPORTS--------------------------------#
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy import stats
+
+#------------------------------------------------------------------#
+
+#---------------------------FUNCTIONS--------------------------------#
+
+def _standardize(values, axis=0):
+    # Removes the mean and scales to unit sum of squares along axis so that a dot product is a correlation
+    anomalies = values - values.mean(axis=axis, keepdims=True)
+    norm = np.sqrt((anomalies ** 2).sum(axis=axis, keepdims=True))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return anomalies / norm
+
+
+def correlation_p_values(r, n):
+    """
+    Two-sided p-values for Pearson correlation coefficients, as returned by scipy.stats.pearsonr.
+    :param r: Array of correlation coefficients.
+    :param n: Number of samples each coefficient was computed from.
+    """
+    r = np.clip(np.asarray(r, dtype=np.float64), -1, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = r * np.sqrt((n - 2) / (1 - r ** 2))
+    return 2 * stats.t.sf(np.abs(t), n - 2)
+
+
+def pearson_correlation(index, field, chunk_size=None):
+    """
+    Pearson correlation of index time series with every gridpoint of a field.
+    :param index: Array with dimensions (time,) or (num_of_indices, time).
+    :param field: Array with dimensions (time, ...) such as (time, lat, lon).
+    :param chunk_size: Number of gridpoints to process at once. None processes all of them together.
+    :return: A tuple (r, p) of arrays with dimensions field.shape[1:], or (num_of_indices,) + field.shape[1:]
+             if index is 2D. Gridpoints (or indices) that are constant over time are NaN.
+    """
+    index = np.asarray(index, dtype=np.float64)
+    field = np.asarray(field)
+    single_index = index.ndim == 1
+    index = np.atleast_2d(index)
+    n = field.shape[0]
+    if index.shape[1] != n:
+        raise ValueError(f"the index has {index.shape[1]} times but the field has {n}.")
+    grid_shape = field.shape[1:]
+    cells = field.reshape(n, -1)
+    index_standardized = _standardize(index, axis=1)
+
+    r = np.empty((index.shape[0], cells.shape[1]))
+    step = cells.shape[1] if chunk_size is None else chunk_size
+    for start in range(0, cells.shape[1], step):
+        chunk = _standardize(cells[:, start:start + step].astype(np.float64), axis=0)
+        r[:, start:start + step] = np.tensordot(index_standardized, chunk, axes=(1, 0))
+    p = correlation_p_values(r, n)
+
+    r = r.reshape((index.shape[0],) + grid_shape)
+    p = p.reshape((index.shape[0],) + grid_shape)
+    if single_index:
+        return r[0], p[0]
+    return r, p
+
+
+def read_index_table(file_name):
+    """
+    Reads an oscillation index CSV with a 'Year' column and one column per month (like ENSO.csv).
+    :param file_name: Path to the CSV file.
+    :return: A DataFrame indexed by year with 12 month columns.
+    """
+    table = pd.read_csv(file_name)
+    table = table.set_index(table['Year'])
+    return table.drop('Year', axis=1)
+
+
+def correlate_with_indices(data_array, index_tables, months=range(1, 13), chunk_size=None):
+    """
+    Correlates every gridpoint of a monthly field with several oscillation indices for several months at once.
+    The field's years for each month are matched to the rows of each index table by year.
+    :param data_array: An xarray DataArray with a 'time' dimension, such as f['T2MMEAN'].
+    :param index_tables: A dictionary of index tables keyed by oscillation name (see read_index_table).
+    :param months: The months (1-12) to compute correlations for.
+    :param chunk_size: Number of gridpoints to process at once. None processes all of them together.
+    :return: An xarray Dataset with variables 'r' and 'p' and dimensions (oscillation, month, ...).
+    """
+    oscillations = list(index_tables)
+    other_dims = [dim for dim in data_array.dims if dim != 'time']
+    month_of_time = data_array['time'].dt.month.values
+    year_of_time = data_array['time'].dt.year.values
+    r = np.full((len(oscillations), len(months)) + tuple(data_array.sizes[dim] for dim in other_dims), np.nan)
+    p = np.full_like(r, np.nan)
+    for m, month in enumerate(months):
+        selected = np.flatnonzero(month_of_time == month)
+        field = data_array.isel(time=selected).transpose('time', *other_dims).values
+        years = year_of_time[selected]
+        # Table columns are in month order after the 'Year' column
+        index = np.stack([np.asarray(index_tables[o].loc[years].iloc[:, month - 1], dtype=np.float64)
+                          for o in oscillations])
+        r[:, m], p[:, m] = pearson_correlation(index, field, chunk_size)
+    coords = {'oscillation': oscillations, 'month': list(months)}
+    coords.update({dim: data_array[dim].values for dim in other_dims if dim in data_array.coords})
+    dims = ['oscillation', 'month'] + other_dims
+    return xr.Dataset({'r': (dims, r), 'p': (dims, p)}, coords=coords)
+
+#----------------------------------END OF FUNCTIONS--------------------------------#
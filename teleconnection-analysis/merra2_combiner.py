@@ -0,0 +1,109 @@
+'''
+MERRA-2 Combiner
+--part of the teleconnection analysis code--
+Description: This script combines the monthly MERRA-2 'statM_2d_slv_Nx' files into one chunked, compressed
+Zarr store for merra2regAnalysis.ipynb (it replaces the loop in merra2regCombiner.ipynb that opened 528 files
+one by one and concatenated them in memory).
+    -- Files are found by pattern and sorted by the date in their name, so the MERRA2_100/200/300/400 (and
+       401) stream numbers do not need to be worked out by hand.
+    -- The files are opened lazily as one multi-file dataset and written chunk by chunk, so the full record
+       is never held in memory.
+    -- The store is chunked with many months per chunk and a small lat/lon tile, so reading the time series
+       of one gridpoint (as the correlation analysis does) only touches a few chunks.
+    -- Running combine_merra2_files again with new monthly files appends only the months after the last one
+       in the store, without rewriting the earlier years.
+
+Example:
+    combine_merra2_files(directory + "files", directory + "full_merra2_monthly.zarr")
+    f = open_merra2_store(directory + "full_merra2_monthly.zarr")
+'''
+
+#---------------------------IMPORTS--------------------------------#
+import os
+import re
+import glob
+import pandas as pd
+import xarray as xr
+
+#------------------------------------------------------------------#
+
+merra2_file_pattern = "MERRA2_*.statM_2d_slv_Nx.*.nc4"
+
+#---------------------------FUNCTIONS--------------------------------#
+
+def merra2_file_date(file_name):
+    """
+    Returns the month of a MERRA-2 monthly file from its name, like 'MERRA2_400.statM_2d_slv_Nx.202101.nc4'.
+    :param file_name: The file name or path.
+    """
+    match = re.search(r"\.(\d{6})\.nc4$", file_name)
+    if match is None:
+        raise ValueError(f"Filename {file_name} does not match the expected pattern.")
+    return pd.Timestamp(f"{match.group(1)}01")
+
+
+def find_merra2_files(folder, pattern=merra2_file_pattern):
+    """
+    Finds the MERRA-2 monthly files in a folder, sorted by month.
+    :param folder: The folder containing the files.
+    :param pattern: The glob pattern of the file names.
+    """
+    files = glob.glob(os.path.join(os.path.expanduser(folder), pattern))
+    return sorted(files, key=merra2_file_date)
+
+
+def open_merra2_store(store_path):
+    """
+    Opens the combined MERRA-2 store lazily.
+    :param store_path: Path to the Zarr store written by combine_merra2_files.
+    """
+    return xr.open_zarr(os.path.expanduser(store_path))
+
+
+def combine_merra2_files(folder, store_path, variables=None, time_chunk=120, lat_chunk=40, lon_chunk=48,
+                         pattern=merra2_file_pattern):
+    """
+    Combines MERRA-2 monthly files into a Zarr store, or appends the months that are not in the store yet.
+    :param folder: The folder containing the monthly files.
+    :param store_path: Path to the Zarr store.
+    :param variables: The variables to keep (such as ['T2MMEAN', 'TPRECMAX']). None keeps all of them.
+    :param time_chunk: Number of months per chunk.
+    :param lat_chunk: Number of latitudes per chunk.
+    :param lon_chunk: Number of longitudes per chunk.
+    :param pattern: The glob pattern of the file names.
+    :return: The list of files that were added to the store.
+    """
+    store_path = os.path.expanduser(store_path)
+    files = find_merra2_files(folder, pattern)
+    appending = os.path.exists(store_path)
+    if appending:
+        with xr.open_zarr(store_path) as existing:
+            last_month = pd.Timestamp(existing['time'].values[-1]).to_period('M').to_timestamp()
+        files = [file for file in files if merra2_file_date(file) > last_month]
+    if not files:
+        return []
+
+    combined = xr.open_mfdataset(files, combine='nested', concat_dim='time', data_vars='minimal',
+                                 coords='minimal', compat='override', parallel=False)
+    if variables is not None:
+        combined = combined[variables]
+    for name in combined.variables:
+        # Chunk layouts of the source netCDF files do not apply to the store
+        for key in ['chunks', 'chunksizes', 'zlib', 'complevel', 'shuffle', 'contiguous', 'preferred_chunks']:
+            combined.variables[name].encoding.pop(key, None)
+
+    if appending:
+        # A few new months are small, so write them from memory (only the last chunks of the store change)
+        combined.load().to_zarr(store_path, mode='a', append_dim='time')
+    else:
+        chunks = {'time': time_chunk, 'lat': lat_chunk, 'lon': lon_chunk}
+        combined = combined.chunk({dim: size for dim, size in chunks.items() if dim in combined.dims})
+        encoding = {}
+        for name, variable in combined.data_vars.items():
+            encoding[name] = {'chunks': tuple(chunks.get(dim, size) for dim, size in variable.sizes.items())}
+        # Zarr compresses every chunk by default
+        combined.to_zarr(store_path, mode='w', encoding=encoding)
+    combined.close()
+    return files
+
+#----------------------------------END OF FUNCTIONS--------------------------------#
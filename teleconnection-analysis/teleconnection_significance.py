@@ -0,0 +1,168 @@
+'''
+Teleconnection Significance
+--part of the teleconnection analysis code--
+Description: This script runs the chi-square tests of the ETC notebooks (are ETCs or bomb cyclones more
+common in one phase of an oscillation than the time spent in that phase predicts?) for every month window,
+oscillation, lag, region and ETC/BC count at once, from the counts and exposure of
+teleconnection_states.classify_etcs.
+    -- A month window is a start month and a length of 1-12 months, wrapping around the end of the year
+       (start 10 with length 6 is October-March, start 12 with length 3 is DJF). Window sums come from
+       one cumulative sum over the months.
+    -- Expected counts are the observed total split in proportion to the exposure of each phase (the
+       notebooks also rounded them; that is not needed for the statistic). The statistic and p-value are
+       the same as scipy.stats.chisquare with phases - 1 degrees of freedom.
+    -- Optionally, p-values are also estimated by a parametric bootstrap: the observed total is redrawn
+       from a multinomial with the expected proportions, which does not rely on the chi-square
+       approximation when counts are small. The draws are split across processes.
+
+Example:
+    states = classify_etcs(catalog, indices, 1950, 2023, lags=range(0, 31))
+    sweep = chi_square_sweep(states, phases={'NAO': (0, 2)}, iterations=1000, workers=4)
+    sweep['p'].sel(oscillation='NAO', kind='BC', region='all', start_month=12, length=3).plot()
+'''
+
+#---------------------------IMPORTS--------------------------------#
+import numpy as np
+import xarray as xr
+from scipy import stats
+from concurrent.futures import ProcessPoolExecutor
+
+#------------------------------------------------------------------#
+
+#---------------------------FUNCTIONS--------------------------------#
+
+def month_windows(values, month_axis):
+    """
+    Sums values over every month window.
+    :param values: An array with a month axis of length 12 (January to December).
+    :param month_axis: The month axis.
+    :return: An array with the month axis replaced by (start_month, length) axes of 12 each.
+    """
+    values = np.moveaxis(np.asarray(values, dtype=np.float64), month_axis, -1)
+    doubled = np.concatenate([values, values], axis=-1)
+    cumulative = np.concatenate([np.zeros(values.shape[:-1] + (1,)), np.cumsum(doubled, axis=-1)], axis=-1)
+    start = np.arange(12)[:, np.newaxis]
+    length = np.arange(1, 13)[np.newaxis, :]
+    windows = cumulative[..., start + length] - cumulative[..., start]
+    return np.moveaxis(np.moveaxis(windows, -1, month_axis), -1, month_axis)
+
+
+def chi_square_statistic(observed, expected, used):
+    """
+    The chi-square statistic over the last (phase) axis, using only the phases where used is True.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        terms = np.where(used, (observed - expected) ** 2 / expected, 0)
+    return terms.sum(axis=-1)
+
+
+def _bootstrap_chunk(arguments):
+    # Counts how often a multinomial draw of the expected proportions is at least as extreme as observed
+    totals, proportions, statistics, used, iterations, seed = arguments
+    rng = np.random.default_rng(seed)
+    exceed = np.zeros(len(totals), dtype=np.int64)
+    for _ in range(iterations):
+        draws = rng.multinomial(totals, proportions)
+        exceed += chi_square_statistic(draws, totals[:, np.newaxis] * proportions, used) >= statistics
+    return exceed
+
+
+def bootstrap_p_values(observed, expected, used, iterations=1000, workers=1, seed=0, chunk_size=10000):
+    """
+    Parametric bootstrap p-values of chi-square tests.
+    :param observed: Observed counts with the phases on the last axis.
+    :param expected: Expected counts with the same shape.
+    :param used: Boolean array (broadcastable to observed) of the phases that are tested.
+    :param iterations: Number of draws per test.
+    :param workers: Number of processes.
+    :param seed: Seed of the random draws (the result does not depend on workers).
+    :param chunk_size: Number of tests per task.
+    """
+    shape = observed.shape[:-1]
+    n_phases = observed.shape[-1]
+    used = np.broadcast_to(used, observed.shape).reshape(-1, n_phases)
+    observed = observed.reshape(-1, n_phases)
+    expected = np.where(used, expected.reshape(-1, n_phases), 0)
+    totals = np.rint(observed.sum(axis=-1)).astype(np.int64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        proportions = expected / expected.sum(axis=-1, keepdims=True)
+    testable = (totals > 0) & np.all(np.isfinite(proportions), axis=-1)
+    # Tests without counts or exposure draw nothing and get a NaN p-value
+    proportions[~testable] = 0
+    totals[~testable] = 0
+    statistics = chi_square_statistic(observed, totals[:, np.newaxis] * proportions, used)
+
+    starts = range(0, len(totals), chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    tasks = [(totals[s:s + chunk_size], proportions[s:s + chunk_size], statistics[s:s + chunk_size],
+              used[s:s + chunk_size], iterations, seeds[i]) for i, s in enumerate(starts)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            exceed = list(executor.map(_bootstrap_chunk, tasks))
+    else:
+        exceed = [_bootstrap_chunk(task) for task in tasks]
+    exceed = np.concatenate(exceed) if exceed else np.zeros(0, dtype=np.int64)
+    # The observed sample counts as one of the draws, so a p-value is never 0
+    p = (exceed + 1) / (iterations + 1)
+    return np.where(testable, p, np.nan).reshape(shape)
+
+
+def chi_square_sweep(states, phases=None, iterations=0, workers=1, seed=0):
+    """
+    Chi-square tests of ETC and BC counts against the phase exposure for every month window, oscillation, lag
+    and region.
+    :param states: The result of teleconnection_states.classify_etcs.
+    :param phases: A dictionary of the phases to test for each oscillation, like {'NAO': (0, 2)}. Oscillations
+                   that are not in it use every phase with exposure (so PDO and AMO with amp = 0 use 0 and 2).
+    :param iterations: Number of bootstrap draws per test. 0 skips the bootstrap.
+    :param workers: Number of processes for the bootstrap.
+    :param seed: Seed of the bootstrap draws.
+    :return: An xarray Dataset with dimensions (oscillation, lag, region, kind, start_month, length) and
+             variables 'chi2', 'p' (and 'p_bootstrap' if iterations > 0), plus 'observed' and 'expected'
+             with an additional phase dimension and 'df' by oscillation.
+    """
+    phases = phases or {}
+    oscillations = states['oscillations']
+    # (oscillation, lag, region, kind, month, phase) and (oscillation, lag, month, phase) without the unused month 0
+    counts = np.moveaxis(states['counts'][:, :, :, 1:13], -1, 3)
+    exposure = states['exposure'][:, :, 1:13]
+
+    used = np.zeros((len(oscillations), 3), dtype=bool)
+    for o, name in enumerate(oscillations):
+        if name in phases:
+            used[o, list(phases[name])] = True
+        else:
+            used[o] = exposure[o].sum(axis=(0, 1)) > 0
+    used_cube = used[:, np.newaxis, np.newaxis, np.newaxis, np.newaxis, np.newaxis, :]
+
+    observed = np.where(used_cube, month_windows(counts, month_axis=4), 0)
+    exposure_windows = month_windows(exposure, month_axis=2)[:, :, np.newaxis, np.newaxis]
+    exposure_windows = np.where(used_cube, exposure_windows, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        expected = exposure_windows / exposure_windows.sum(axis=-1, keepdims=True) * observed.sum(axis=-1, keepdims=True)
+    statistic = chi_square_statistic(observed, expected, used_cube)
+    df = used.sum(axis=1) - 1
+    p = stats.chi2.sf(statistic, df[:, np.newaxis, np.newaxis, np.newaxis, np.newaxis, np.newaxis])
+
+    dims = ['oscillation', 'lag', 'region', 'kind', 'start_month', 'length']
+    coords = {
+        'oscillation': oscillations,
+        'lag': states['lags'],
+        'region': states['regions'],
+        'kind': ['ETC', 'BC'],
+        'start_month': np.arange(1, 13),
+        'length': np.arange(1, 13),
+        'phase': ['positive', 'neutral', 'negative'],
+    }
+    sweep = xr.Dataset({
+        'chi2': (dims, statistic),
+        'p': (dims, p),
+        'observed': (dims + ['phase'], observed),
+        'expected': (dims + ['phase'], expected),
+        'df': (['oscillation'], df),
+    }, coords=coords)
+    if iterations > 0:
+        sweep['p_bootstrap'] = (dims, bootstrap_p_values(observed, expected, used_cube, iterations, workers, seed))
+    return sweep
+
+#----------------------------------END OF FUNCTIONS--------------------------------#
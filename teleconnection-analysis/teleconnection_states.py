@@ -0,0 +1,185 @@
+'''
+Teleconnection States
+--part of the teleconnection analysis code--
+Description: This script classifies the ETCs of a catalog (see etc_catalog.py) by the phase of several
+oscillations at once and counts ETC and bomb cyclone (BC) formation per month and phase, replacing the
+per-storm lookups and if/elif chains of the ETC notebooks.
+    -- Index tables are read into one sorted daily or monthly series (read_monthly_index for tables like
+       enso.csv with one column per month, read_daily_index for tables like nao.csv with year/month/day
+       columns), and the start days of all ETCs are joined to them with one np.searchsorted.
+    -- Phases: 0 (positive) if index >= amp, 2 (negative) if index <= -amp, otherwise 1 (neutral). With
+       amp = 0.5 this is El Nino/Neutral/La Nina for ENSO and the NAO/AO/PNA amplitude rule; with amp = 0
+       the neutral phase is empty (PDO+/PDO-, AMO+/AMO-). ETCs with no index value are not counted.
+    -- Lags: the phase of an ETC at lag L is the phase of the index L days before the day it started.
+       All oscillations and lags are counted in one call with np.add.at.
+    -- Exposure: the time spent in each phase by calendar month, so that counts / exposure is a rate. For
+       monthly indices it is counted in months (the notebooks' "per 30 days" for ENSO, PDO and AMO) and for
+       daily indices in 30-day periods (days / 30).
+
+Example:
+    indices = {'ENSO': (read_monthly_index("enso.csv", 'year'), 0.5),
+               'NAO': (read_daily_index("nao.csv", 'nao_index_cdas'), 0.5)}
+    states = classify_etcs(catalog, indices, 1950, 2023, lags=range(0, 31))
+    enso_bomb, enso_bomb_raw, enso_states_bymonth = bomb_table(states, 'ENSO')
+'''
+
+#---------------------------IMPORTS--------------------------------#
+import numpy as np
+import pandas as pd
+
+#------------------------------------------------------------------#
+
+phase_names = ['positive', 'neutral', 'negative']
+
+#---------------------------FUNCTIONS--------------------------------#
+
+def read_monthly_index(file_name, year_column='Year'):
+    """
+    Reads a monthly index table with a year column and one column per month named '1' to '12' (like enso.csv).
+    :param file_name: Path to the CSV file.
+    :param year_column: The name of the year column ('year' in enso.csv, 'Year' in pdo.csv and amo.csv).
+    :return: A dictionary with 'time' (the first day of every month, sorted), 'value' and 'step' ('month').
+    """
+    table = pd.read_csv(file_name).set_index(year_column)
+    values = table[[str(month) for month in range(1, 13)]].to_numpy(dtype=np.float64)
+    months = (table.index.to_numpy(dtype=np.int64)[:, np.newaxis] - 1970) * 12 + np.arange(12)
+    time = months.ravel().astype('datetime64[M]').astype('datetime64[D]')
+    order = np.argsort(time)
+    return {'time': time[order], 'value': values.ravel()[order], 'step': 'month'}
+
+
+def read_daily_index(file_name, value_column):
+    """
+    Reads a daily index table with 'year', 'month' and 'day' columns (like nao.csv).
+    :param file_name: Path to the CSV file.
+    :param value_column: The name of the index column, like 'nao_index_cdas'.
+    :return: A dictionary with 'time' (sorted days), 'value' and 'step' ('day').
+    """
+    table = pd.read_csv(file_name)
+    time = pd.to_datetime(table[['year', 'month', 'day']]).values.astype('datetime64[D]')
+    values = table[value_column].to_numpy(dtype=np.float64)
+    order = np.argsort(time)
+    return {'time': time[order], 'value': values[order], 'step': 'day'}
+
+
+def index_values(series, days):
+    """
+    Looks up the index value on each day (for a monthly index, the value of the day's month).
+    :param series: A series from read_monthly_index or read_daily_index.
+    :param days: An array of datetime64[D] days of any shape.
+    :return: An array of values with the same shape as days, NaN where the index has no value.
+    """
+    keys = np.asarray(days, dtype='datetime64[D]')
+    if series['step'] == 'month':
+        keys = keys.astype('datetime64[M]').astype('datetime64[D]')
+    position = np.clip(np.searchsorted(series['time'], keys), 0, len(series['time']) - 1)
+    found = series['time'][position] == keys
+    return np.where(found, series['value'][position], np.nan)
+
+
+def classify_phase(values, amp):
+    """
+    Phase of every index value (see the description at the top of this script), -1 for NaN.
+    :param values: An array of index values.
+    :param amp: The amplitude an index must reach to be positive or negative.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    phase = np.where(values >= amp, 0, np.where(values <= -amp, 2, 1))
+    phase[np.isnan(values)] = -1
+    return phase
+
+
+def classify_etcs(catalog, indices, start_year, end_year, lags=(0,), regions=()):
+    """
+    Counts ETCs and BCs by oscillation, lag, region, month and phase, and the exposure of every phase.
+    :param catalog: A catalog from etc_catalog.open_etc_catalog or load_etc_catalog.
+    :param indices: A dictionary keyed by oscillation name of (series, amp) tuples.
+    :param start_year: The first year (of the catalog and of the exposure).
+    :param end_year: The last year (inclusive).
+    :param lags: The lags in days.
+    :param regions: Region names to count separately, like ['southeast', 'northeast'].
+    :return: A dictionary with
+        'oscillations', 'lags', 'regions': the labels of the axes below (regions starts with 'all'),
+        'counts': (oscillation, lag, region, 13, 3 phases, 2) counts of ETCs ([..., 0]) and BCs ([..., 1])
+                  by the month they started (index 1-12, 0 is unused like the notebook arrays),
+        'exposure': (oscillation, lag, 13, 3 phases) time in each phase (see the description above).
+    """
+    oscillations = list(indices)
+    lags = np.asarray(list(lags), dtype=np.int64)
+    regions = ['all'] + list(regions)
+
+    events = np.flatnonzero((catalog['year'] >= start_year) & (catalog['year'] <= end_year)
+                            & ~np.isnat(catalog['start_time']))
+    start_day = catalog['start_time'][events].astype('datetime64[D]')
+    month = start_day.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    bomb = catalog['bomb'][events].astype(np.int64)
+    region = np.zeros(len(events), dtype=np.int64)
+    for r, name in enumerate(regions[1:], start=1):
+        region[catalog['region'][events] == name] = r
+
+    # Every day of the years for the exposure
+    days = np.arange(np.datetime64(f'{start_year}-01-01'), np.datetime64(f'{end_year + 1}-01-01'))
+    day_month = days.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    days_in_month = ((days.astype('datetime64[M]') + 1).astype('datetime64[D]')
+                     - days.astype('datetime64[M]').astype('datetime64[D]')).astype(np.int64)
+
+    counts = np.zeros((len(oscillations), len(lags), len(regions), 13, 3, 2))
+    exposure = np.zeros((len(oscillations), len(lags), 13, 3))
+    lag_days = lags[:, np.newaxis].astype('timedelta64[D]')
+    for o, name in enumerate(oscillations):
+        series, amp = indices[name]
+        # (lag, event) and (lag, day) phases
+        event_phase = classify_phase(index_values(series, start_day - lag_days), amp)
+        day_phase = classify_phase(index_values(series, days - lag_days), amp)
+
+        lag_index = np.broadcast_to(np.arange(len(lags))[:, np.newaxis], event_phase.shape)
+        event_month = np.broadcast_to(month, event_phase.shape)
+        event_bomb = np.broadcast_to(bomb, event_phase.shape)
+        event_region = np.broadcast_to(region, event_phase.shape)
+        # Every ETC is counted in region 'all' and, if it is in one of the given regions, in that region too
+        valid = event_phase >= 0
+        for selected, region_index in [(valid, np.zeros_like(event_region)), (valid & (event_region > 0), event_region)]:
+            for kind, kind_selected in [(0, selected), (1, selected & (event_bomb == 1))]:
+                np.add.at(counts[o], (lag_index[kind_selected], region_index[kind_selected],
+                                      event_month[kind_selected], event_phase[kind_selected], kind), 1)
+
+        weight = 1 / days_in_month if series['step'] == 'month' else np.full(len(days), 1 / 30)
+        lag_index = np.broadcast_to(np.arange(len(lags))[:, np.newaxis], day_phase.shape)
+        valid = day_phase >= 0
+        np.add.at(exposure[o], (lag_index[valid], np.broadcast_to(day_month, day_phase.shape)[valid],
+                                day_phase[valid]), np.broadcast_to(weight, day_phase.shape)[valid])
+
+    return {'oscillations': oscillations, 'lags': lags, 'regions': regions, 'counts': counts, 'exposure': exposure}
+
+
+def bomb_table(states, oscillation, lag=0, phases=(0, 1, 2), region='all', by_month=True):
+    """
+    Returns the counts of classify_etcs in the layout of the notebook arrays (like enso_bomb[13,3,3]).
+    :param states: The result of classify_etcs.
+    :param oscillation: The oscillation name.
+    :param lag: The lag in days.
+    :param phases: The phases to keep, like (0, 2) for NAO+ and NAO-.
+    :param region: A region name, or a list of region names to add together.
+    :param by_month: If False, the months are added together and the month axis is dropped.
+    :return: A tuple (rates, raw, exposure). rates and raw have dimensions (13, phase, 3) where [..., 0] is
+             ETCs and [..., 1] BCs (per unit of exposure in rates, counts in raw) and [..., 2] the fraction
+             of ETCs which become BCs. exposure has dimensions (13, phase).
+    """
+    o = states['oscillations'].index(oscillation)
+    l = int(np.flatnonzero(states['lags'] == lag)[0])
+    region_names = [region] if isinstance(region, str) else list(region)
+    counts = sum(states['counts'][o, l, states['regions'].index(name)] for name in region_names)
+    counts = counts[:, list(phases)]
+    exposure = states['exposure'][o, l][:, list(phases)]
+    if not by_month:
+        counts = counts[1:].sum(axis=0)
+        exposure = exposure[1:].sum(axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = counts[..., 1] / counts[..., 0]
+        rates = counts / exposure[..., np.newaxis]
+    raw = np.concatenate([counts, fraction[..., np.newaxis]], axis=-1)
+    rates = np.concatenate([rates, fraction[..., np.newaxis]], axis=-1)
+    return rates, raw, exposure
+
+#----------------------------------END OF FUNCTIONS--------------------------------#
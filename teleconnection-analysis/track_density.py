@@ -0,0 +1,136 @@
+'''
+Track Density
+--part of the teleconnection analysis code--
+Description: This script grids ETC track points for the density plots in the storm-track notebook
+(densityPlotETCtracks). Instead of collecting every track point in Python lists and calling np.histogram2d
+for one plot at a time, the points of an ETC catalog (see etc_catalog.py) are binned one year at a time
+into a counts cube with dimensions (layer, year, month, lat, lon), where layer 0 counts all ETCs and
+layer 1 only bomb cyclones. Each year is one np.bincount per layer on the flattened cell indices of its
+points. The month of a point is the month its ETC started.
+
+The cube is saved to an .npz file, so every plot variant of a dataset and region (all ETCs or bomb
+cyclones, any span of years or months) is a sum over the saved cube. Cells follow np.histogram2d: the
+last lat and lon bins include their upper edge, and points outside the edges are not counted.
+
+Example:
+    catalog = open_etc_catalog(folder + "east_ETCs_{year}.pkl", 2007, 2021, folder + "east_ETCs_2007-2021.npz")
+    cube = open_track_density_cube(folder + "east_density_2007-2021.npz", catalog,
+                                   np.arange(20, 71), np.arange(-120, -19), 2007, 2021)
+    heatmap = density_map(cube, bomb=True)
+'''
+
+#---------------------------IMPORTS--------------------------------#
+import os
+import warnings
+import numpy as np
+from etc_catalog import track_points
+
+#------------------------------------------------------------------#
+
+#---------------------------FUNCTIONS--------------------------------#
+
+def _bin_index(values, edges):
+    # Bin of every value like np.histogram (the last bin includes its upper edge), -1 outside of the edges
+    index = np.searchsorted(edges, values, side='right') - 1
+    index[values == edges[-1]] = len(edges) - 2
+    index[(index < 0) | (index >= len(edges) - 1) | np.isnan(values)] = -1
+    return index
+
+
+def track_density_cube(catalog, lat_edges, lon_edges, start_year, end_year):
+    """
+    Counts the track points of a catalog in every lat/lon cell by year, month and bomb status.
+    :param catalog: A catalog from etc_catalog.open_etc_catalog or load_etc_catalog.
+    :param lat_edges: The latitude bin edges (like np.arange(20, 71, 1)).
+    :param lon_edges: The longitude bin edges (like np.arange(-120, -19, 1)).
+    :param start_year: The first year.
+    :param end_year: The last year (inclusive).
+    :return: A dictionary with 'counts' (layer, year, month, lat, lon), 'lat_edges', 'lon_edges', 'years',
+             'num_of_events' and 'num_of_points' (the catalog size, used to check a saved cube is current).
+    """
+    lat_edges = np.asarray(lat_edges, dtype=np.float64)
+    lon_edges = np.asarray(lon_edges, dtype=np.float64)
+    years = np.arange(start_year, end_year + 1)
+    n_lat = len(lat_edges) - 1
+    n_lon = len(lon_edges) - 1
+    layer_size = 12 * n_lat * n_lon
+    counts = np.zeros((2, len(years), 12, n_lat, n_lon), dtype=np.int32)
+    start_month = (catalog['start_time'].astype('datetime64[M]').astype(np.int64) % 12)
+    # convert_etc_pickles fills missing start times, so only catalogs from elsewhere can still have NaT here
+    no_start = np.isnat(catalog['start_time']) & (catalog['year'] >= start_year) & (catalog['year'] <= end_year)
+    if no_start.any():
+        warnings.warn(f"{no_start.sum()} ETCs without a start_time (so without a month) are not counted.")
+
+    for y, year in enumerate(years):
+        events = np.flatnonzero((catalog['year'] == year) & ~np.isnat(catalog['start_time']))
+        points = track_points(catalog, events)
+        lat_index = _bin_index(points['lat'], lat_edges)
+        lon_index = _bin_index(points['lon'], lon_edges)
+        inside = (lat_index >= 0) & (lon_index >= 0)
+        cells = (start_month[points['event']] * n_lat + lat_index) * n_lon + lon_index
+        bomb = catalog['bomb'][points['event']]
+        counts[0, y] = np.bincount(cells[inside], minlength=layer_size).reshape(12, n_lat, n_lon)
+        counts[1, y] = np.bincount(cells[inside & bomb], minlength=layer_size).reshape(12, n_lat, n_lon)
+
+    return {
+        'counts': counts,
+        'lat_edges': lat_edges,
+        'lon_edges': lon_edges,
+        'years': years,
+        'num_of_events': np.array(len(catalog['event_id'])),
+        'num_of_points': np.array(len(catalog['point_lat'])),
+    }
+
+
+def save_track_density_cube(cube_path, cube):
+    """
+    Saves a cube from track_density_cube to a compressed .npz file.
+    :param cube_path: Path of the .npz file.
+    :param cube: The cube.
+    """
+    np.savez_compressed(cube_path, **cube)
+
+
+def load_track_density_cube(cube_path):
+    """
+    Loads a cube saved with save_track_density_cube.
+    :param cube_path: Path of the .npz file.
+    """
+    with np.load(cube_path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def open_track_density_cube(cube_path, catalog, lat_edges, lon_edges, start_year, end_year):
+    """
+    Loads a saved cube if it has the same bins and years and was made from a catalog of the same size,
+    otherwise grids the catalog and saves the cube. The parameters are the same as track_density_cube.
+    """
+    if os.path.exists(cube_path):
+        cube = load_track_density_cube(cube_path)
+        if (np.array_equal(cube['lat_edges'], lat_edges) and np.array_equal(cube['lon_edges'], lon_edges)
+                and np.array_equal(cube['years'], np.arange(start_year, end_year + 1))
+                and cube['num_of_events'] == len(catalog['event_id'])
+                and cube['num_of_points'] == len(catalog['point_lat'])):
+            return cube
+    cube = track_density_cube(catalog, lat_edges, lon_edges, start_year, end_year)
+    save_track_density_cube(cube_path, cube)
+    return cube
+
+
+def density_map(cube, start_year=None, end_year=None, months=None, bomb=False):
+    """
+    Sums a cube into a (lat, lon) map of track point counts (as floats, like np.histogram2d).
+    :param cube: A cube from track_density_cube or open_track_density_cube.
+    :param start_year: The first year to include. None starts at the first year of the cube.
+    :param end_year: The last year to include. None ends at the last year of the cube.
+    :param months: The months (1-12) to include. None includes all of them.
+    :param bomb: If True, only bomb cyclone tracks are counted.
+    """
+    years = cube['years']
+    selected_years = (years >= (years[0] if start_year is None else start_year)) & \
+                     (years <= (years[-1] if end_year is None else end_year))
+    selected_months = np.arange(12) if months is None else np.asarray(months) - 1
+    layer = cube['counts'][1 if bomb else 0]
+    return layer[selected_years][:, selected_months].sum(axis=(0, 1), dtype=np.float64)
+
+#----------------------------------END OF FUNCTIONS--------------------------------#
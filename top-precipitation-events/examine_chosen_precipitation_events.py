@@ -1,59 +1,31 @@
 #This code finds and segments precipitation events in a CSV dataset 
 #and filters the found precipitation events by the given dates (defined in the dates array)
 #You may want to use find_top_precipitation_events.py to find highest ranked precipitation events in your dataset first.
-import pandas as pd
+from precipitation_events import (read_giovanni_files, stream_events, concatenate_events, rank_events, events_to_dataframe,
+                                   build_event_index, save_event_index, load_event_index, events_on_dates,
+                                   event_index_sources, event_index_is_current)
 
-def analyze_precipitation_data(file_paths, dates):
-    all_events = pd.DataFrame()
-    
-    for file_path in file_paths:
-        # Read data
-        data = pd.read_csv(file_path, skiprows=10, names=['Timestamp', 'Precipitation'])
-        data['Timestamp'] = pd.to_datetime(data['Timestamp'])
+def load_or_build_event_index(file_paths, index_path, break_threshold=0.89, weights=(0.45, 0.45, 0.10)):
+    # The ranked event catalog is segmented once and saved as an index. It is rebuilt when the CSVs (which files,
+    # their sizes and modification times), the break threshold or the weights differ from the ones it was built from
+    sources = event_index_sources(file_paths, break_threshold=break_threshold, weights=list(weights))
+    if event_index_is_current(index_path, sources):
+        return load_event_index(index_path)
 
-        # Define events
-        data['IsBreak'] = data['Precipitation'] <= 0.89
-        data['EventID'] = data['IsBreak'].cumsum()
+    # Define events, total precipitation and duration for each event across all years (see precipitation_events.py)
+    # The files are read one year at a time and events running over New Year's are kept whole
+    events = concatenate_events(stream_events(read_giovanni_files(file_paths), break_threshold=break_threshold))
 
-        # Total precipitation and duration for each event
-        event_totals = data.groupby('EventID').agg(
-            Start=pd.NamedAgg(column='Timestamp', aggfunc='first'),
-            End=pd.NamedAgg(column='Timestamp', aggfunc='last'),
-            TotalPrecipitation=pd.NamedAgg(column='Precipitation', aggfunc='sum')
-        )
+    # Exclude events with zero duration or no precipitation, then rank and calculate weighted score
+    index = build_event_index(rank_events(events, weights=weights))
+    save_event_index(index_path, index, sources)
+    return index
 
-        # Average precipitation rate (mm/hour)
-        event_totals['DurationHours'] = (event_totals['End'] - event_totals['Start']).dt.total_seconds() / 3600
-        event_totals['AverageRate'] = event_totals['TotalPrecipitation'] / event_totals['DurationHours']
-        
-        # Exclude events with zero duration
-        event_totals = event_totals[event_totals['DurationHours'] > 0] 
-
-        # Filter events with precipitation
-        ranked_events = event_totals[event_totals['TotalPrecipitation'] > 0]
-
-        # Ranking
-        ranked_events['TotalPrecipRank'] = ranked_events['TotalPrecipitation'].rank(ascending=False)
-        ranked_events['AverageRateRank'] = ranked_events['AverageRate'].rank(ascending=False)
-
-        # Calculate weighted score
-        ranked_events['WeightedScore'] = (
-            0.45 * ranked_events['TotalPrecipRank'] +
-            0.45 * ranked_events['AverageRateRank'] +
-            0.10 * ranked_events['TotalPrecipitation'].rank(ascending=False) # Using total precipitation for the 10% weight
-        )
-
-        # Add events to the all_events DataFrame
-        all_events = pd.concat([all_events, ranked_events], ignore_index=True)
-    
-    # Merging the event data with the original measurements
-    merged_data = data.merge(all_events, on='EventID', how='left')
+def analyze_precipitation_data(file_paths, dates, index_path='precipitation_event_index.npz'):
+    index = load_or_build_event_index(file_paths, index_path)
 
     # Filter events based on whether they contain a measurement on the specified dates
-    filtered_events = merged_data[merged_data['Timestamp'].dt.date.isin(dates)]
-
-    # Group by EventID to get unique events
-    unique_filtered_events = filtered_events.groupby('EventID').first()
+    unique_filtered_events = events_to_dataframe(events_on_dates(index, dates)).reset_index()
 
     # Save the filtered events to CSV
     unique_filtered_events.to_csv('/mnt/data/Filtered_Events_Containing_Dates.csv', index=False)
@@ -0,0 +1,425 @@
+#This code segments and ranks precipitation events with NumPy instead of pandas groupby.
+#It is used by find_top_precipitation_events.py and examine_chosen_precipitation_events.py.
+#
+#An event starts at a "break" measurement (precipitation <= break_threshold) and includes every following
+#measurement up to the next break, the same as IsBreak.cumsum() in the original pandas code. Measurements before
+#the first break form their own event. A missing (NaN) reading is not a break and, as with groupby().sum() and
+#count() in pandas, it is left out of the event total and the measurement count. Events are found with run-length
+#encoding (np.flatnonzero on the event starts) and totals with np.add.reduceat, so a (time, cells) array of many
+#grid cells is segmented in one pass.
+#
+#read_giovanni_files reads the yearly CSVs through a binary cache: each CSV is parsed once and saved as int64
+#timestamps (nanoseconds since 1970) and float64 precipitation in .npy files, which later runs memory-map. The values
+#are kept in float64, the same as read_giovanni_csv, so a value equal to the break threshold is a break either way and
+#cached and uncached runs find the same events. A cache is rebuilt when its CSV changes (a different size or
+#modification time and a different SHA-1 of the contents) or when it was written with float32 values.
+#
+#build_event_index sorts an event catalog by start time so the events overlapping a day or a date range are found
+#with np.searchsorted instead of scanning every measurement (see events_on_dates). The index can be saved to an .npz
+#together with the CSVs (paths, sizes and modification times) and settings it was built from, so a saved index is
+#only reused while they are the same (see event_index_is_current).
+#
+#top_events keeps only the best K events per cell by total, rate and weighted score while events are streamed, so
+#the full event catalog never has to be held in memory or ranked.
+import os
+import json
+import hashlib
+import warnings
+import numpy as np
+import pandas as pd
+
+EVENT_FIELDS = ['event_id', 'cell', 'start_index', 'start', 'end', 'total', 'measurements', 'duration_hours', 'average_rate']
+
+
+def read_giovanni_csv(file_path):
+    # Giovanni area-averaged time series CSVs have metadata rows, then a 'time, ...' header row, then data
+    with open(file_path) as f:
+        for header_row, line in enumerate(f):
+            if line.lower().startswith('time'):
+                break
+        else:
+            raise ValueError(f"{file_path} does not have a 'time' header row.")
+    data = pd.read_csv(file_path, skiprows=header_row + 1, names=['Timestamp', 'Precipitation'])
+    times = pd.to_datetime(data['Timestamp'], format='%Y-%m-%d %H:%M:%S').values
+    return times, data['Precipitation'].to_numpy(dtype=np.float64)
+
+
+def _file_sha1(file_path):
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _save_npy(path, array):
+    # Writes to a temporary file first so an interrupted run never leaves a truncated cache
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(path + '.tmp', path)
+
+
+def cached_giovanni_csv(file_path, cache_folder=None):
+    # Same as read_giovanni_csv, but from the binary cache (see the top of this file). The arrays are read-only
+    # memory maps. cache_folder defaults to a '.giovanni_cache' folder next to the CSV.
+    if cache_folder is None:
+        cache_folder = os.path.join(os.path.dirname(os.path.abspath(file_path)), '.giovanni_cache')
+    os.makedirs(cache_folder, exist_ok=True)
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    times_path = os.path.join(cache_folder, f'{name}.times.npy')
+    precipitation_path = os.path.join(cache_folder, f'{name}.precipitation.npy')
+    meta_path = os.path.join(cache_folder, f'{name}.json')
+
+    source = os.stat(file_path)
+    meta = {'source': os.path.abspath(file_path), 'size': source.st_size, 'mtime_ns': source.st_mtime_ns, 'dtype': 'float64'}
+    cached = None
+    if os.path.exists(meta_path) and os.path.exists(times_path) and os.path.exists(precipitation_path):
+        with open(meta_path) as f:
+            cached = json.load(f)
+    if cached is not None and cached.get('dtype') != meta['dtype']:
+        # Caches from before the values were kept in float64
+        cached = None
+    if cached is None or (cached['size'], cached['mtime_ns']) != (meta['size'], meta['mtime_ns']):
+        meta['sha1'] = _file_sha1(file_path)
+        if cached is None or cached.get('sha1') != meta['sha1']:
+            times, precipitation = read_giovanni_csv(file_path)
+            _save_npy(times_path, times.astype('datetime64[ns]').view(np.int64))
+            _save_npy(precipitation_path, precipitation.astype(np.float64))
+        # Touched but unchanged files only need their size and modification time updated
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+
+    times = np.load(times_path, mmap_mode='r').view('datetime64[ns]')
+    return times, np.load(precipitation_path, mmap_mode='r')
+
+
+def read_giovanni_files(file_paths, cache_folder=None):
+    # Yields (times, precipitation) for each yearly CSV in turn, so only one year is in memory at a time
+    for file_path in file_paths:
+        yield cached_giovanni_csv(file_path, cache_folder)
+
+
+def _finish_events(events):
+    events['duration_hours'] = (events['end'] - events['start']) / np.timedelta64(1, 'h')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        events['average_rate'] = events['total'] / events['duration_hours']
+    return events
+
+
+def segment_events(times, precipitation, break_threshold=0.89, return_row_events=False):
+    # times: (time,) datetime64 array
+    # precipitation: (time,) array for one series or (time, cells) array for many grid cells
+    # Returns a dict of 1D arrays, one entry per event (see EVENT_FIELDS). With return_row_events=True the event
+    # index of every measurement is also returned as 'row_event' with the same shape as precipitation.
+    times = np.asarray(times, dtype='datetime64[ns]')
+    precipitation = np.asarray(precipitation, dtype=np.float64)
+    single_series = precipitation.ndim == 1
+    series = precipitation.reshape(len(times), -1).T  # (cells, time)
+    n_cells, n_times = series.shape
+    values = series.ravel()
+    is_missing = np.isnan(values)
+
+    # An event starts at every break and at the first measurement of every cell
+    is_start = (values <= break_threshold).reshape(n_cells, n_times)
+    is_start[:, 0] = True
+    starts = np.flatnonzero(is_start)
+    ends = np.append(starts[1:], values.size)
+
+    events = {
+        'event_id': np.arange(len(starts)),
+        'cell': starts // n_times,
+        'start_index': starts % n_times,
+        'start': times[starts % n_times],
+        'end': times[(ends - 1) % n_times],
+        # Missing (NaN) readings are skipped like in pandas groupby().sum() and count(), so they neither make
+        # the total NaN nor count as measurements
+        'total': np.add.reduceat(np.where(is_missing, 0.0, values), starts),
+        'measurements': np.add.reduceat((~is_missing).astype(np.int64), starts),
+    }
+    _finish_events(events)
+    if return_row_events:
+        row_event = np.cumsum(is_start.ravel()) - 1
+        events['row_event'] = row_event.reshape(n_times) if single_series else row_event.reshape(n_cells, n_times).T
+    return events
+
+
+def stream_events(chunks, break_threshold=0.89):
+    # Segments a series that arrives in consecutive chunks, such as one CSV per year (see read_giovanni_files).
+    # chunks: an iterable of (times, precipitation) in time order, with precipitation shaped (time,) or (time, cells)
+    # Yields a dict of completed events (like segment_events, without 'start_index') for every chunk. The last
+    # event of every cell is kept open and continued into the next chunk unless the next chunk starts with a
+    # break, so events spanning Dec 31 -> Jan 1 are not split. Event IDs are unique across all chunks.
+    # Only the open events (one per cell) are kept between chunks.
+    fields = ['event_id', 'cell', 'start', 'end', 'total', 'measurements']
+    open_events = None
+    next_id = 0
+    for times, precipitation in chunks:
+        events = segment_events(times, precipitation, break_threshold)
+        del events['start_index']
+        n_events = len(events['cell'])
+        n_cells = events['cell'][-1] + 1
+        first = np.flatnonzero(np.r_[True, events['cell'][1:] != events['cell'][:-1]])
+        last = np.append(first[1:] - 1, n_events - 1)
+        events['event_id'] = next_id + np.arange(n_events)
+        next_id += n_events
+
+        completed = []
+        if open_events is not None:
+            if len(open_events['cell']) != n_cells:
+                raise ValueError("every chunk must have the same number of cells.")
+            # A cell's first event continues its open event unless the chunk starts with a break
+            first_values = np.asarray(precipitation, dtype=np.float64).reshape(len(times), -1)[0]
+            continues = ~(first_values <= break_threshold)  # a NaN reading is not a break
+            completed.append({key: open_events[key][~continues] for key in fields})
+            continued = first[continues]
+            events['event_id'][continued] = open_events['event_id'][continues]
+            events['start'][continued] = open_events['start'][continues]
+            events['total'][continued] += open_events['total'][continues]
+            events['measurements'][continued] += open_events['measurements'][continues]
+
+        is_last = np.zeros(n_events, dtype=bool)
+        is_last[last] = True
+        completed.append({key: events[key][~is_last] for key in fields})
+        open_events = {key: events[key][last] for key in fields}
+        yield _finish_events({key: np.concatenate([part[key] for part in completed]) for key in fields})
+
+    if open_events is not None:
+        yield _finish_events(open_events)
+
+
+def concatenate_events(event_chunks):
+    # Combines the event dicts yielded by stream_events into one dict
+    event_chunks = list(event_chunks)
+    return {key: np.concatenate([chunk[key] for chunk in event_chunks]) for key in event_chunks[0]}
+
+
+def select_events(events, mask):
+    # Returns the events where mask is True
+    return {key: (value[mask] if key != 'row_event' else value) for key, value in events.items()}
+
+
+def _position_in_group(sorted_groups):
+    # Position (0, 1, 2, ...) of every element within its run of equal groups
+    positions = np.arange(len(sorted_groups))
+    new_group = np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]
+    return positions - np.maximum.accumulate(np.where(new_group, positions, 0)), new_group
+
+
+def descending_rank(values, groups=None):
+    # Same as pandas rank(ascending=False) (ties get their average rank), computed separately for every group
+    values = np.asarray(values, dtype=np.float64)
+    groups = np.zeros(len(values), dtype=np.int64) if groups is None else np.asarray(groups)
+    n = len(values)
+    if n == 0:
+        return np.empty(0)
+    order = np.lexsort((-values, groups))
+    sorted_values = values[order]
+    sorted_groups = groups[order]
+    position, new_group = _position_in_group(sorted_groups)
+    ordinal = position + 1
+    # Average the ordinal ranks over runs of tied values
+    new_tie = new_group | np.r_[True, sorted_values[1:] != sorted_values[:-1]]
+    tie_starts = np.flatnonzero(new_tie)
+    tie_sizes = np.diff(np.append(tie_starts, n))
+    tie_ranks = np.add.reduceat(ordinal, tie_starts) / tie_sizes
+    ranks = np.empty(n)
+    ranks[order] = np.repeat(tie_ranks, tie_sizes)
+    return ranks
+
+
+def rankable_events(events, min_measurements=1):
+    # The events rank_events keeps (a duration and precipitation), with at least min_measurements measurements
+    return select_events(events, (events['duration_hours'] > 0) & (events['total'] > 0)
+                         & (events['measurements'] >= min_measurements))
+
+
+def rank_events(events, weights=(0.45, 0.45, 0.10)):
+    # Keeps the events with a duration and precipitation and ranks them within each grid cell by total
+    # precipitation and average rate. The weighted score is
+    # weights[0] * total rank + weights[1] * rate rank + weights[2] * total rank (lower is better).
+    ranked = rankable_events(events)
+    ranked['total_rank'] = descending_rank(ranked['total'], ranked['cell'])
+    ranked['rate_rank'] = descending_rank(ranked['average_rate'], ranked['cell'])
+    ranked['weighted_score'] = (weights[0] * ranked['total_rank'] + weights[1] * ranked['rate_rank']
+                                + weights[2] * ranked['total_rank'])
+    return ranked
+
+
+def _largest_per_cell(events, values, count):
+    # Keeps the count events with the largest values in every cell, sorted by cell and then by value
+    if len(values) == 0:
+        return events
+    order = np.lexsort((-values, events['cell']))
+    position, _ = _position_in_group(events['cell'][order])
+    return select_events(events, order[position < count])
+
+
+def _candidate_ranks(candidates, key, count):
+    # Ranks the candidates kept by _largest_per_cell. If a cell kept fewer than count events, nothing was
+    # dropped and its ranks are exact. Otherwise the ranks are exact for values above the smallest kept value
+    # (tied values may have been dropped), and every other event of the cell ranks below those exact events.
+    values = candidates[key]
+    cells = candidates['cell']
+    n_cells = cells.max() + 1 if len(cells) else 0
+    full = np.bincount(cells, minlength=n_cells) >= count
+    smallest = np.full(n_cells, np.inf)
+    np.minimum.at(smallest, cells, values)
+    exact = ~full[cells] | (values > smallest[cells])
+    exact_count = np.where(full, np.bincount(cells, weights=exact.astype(np.float64), minlength=n_cells), np.inf)
+    return descending_rank(values, cells), exact, exact_count
+
+
+def _lookup(ids, candidate_ids, candidate_values):
+    # Values of the candidates with the given event IDs, NaN for IDs that are not candidates
+    if len(candidate_ids) == 0:
+        return np.full(len(ids), np.nan)
+    order = np.argsort(candidate_ids)
+    position = np.minimum(np.searchsorted(candidate_ids, ids, sorter=order), len(order) - 1)
+    found = candidate_ids[order[position]] == ids
+    return np.where(found, candidate_values[order[position]], np.nan)
+
+
+def top_events(event_chunks, k=50, weights=(0.45, 0.45, 0.10), min_measurements=1, candidate_factor=4):
+    # Selects the top k events of every cell by total precipitation, average rate and weighted score (see
+    # rank_events) from the event dicts yielded by stream_events, keeping only candidate_factor * k events per
+    # cell and criterion in memory. Only events kept by rankable_events are ranked.
+    # The weighted score needs the ranks of an event among all events, which are only known for the candidates.
+    # An event that is not among the candidates of one criterion ranks below all of its exact candidates, so its
+    # score is at least that bound; if the k-th best score of a cell is not below the bound, a warning is given
+    # and candidate_factor should be increased.
+    # Returns a dict with the event dicts 'total', 'rate' and 'weighted', each sorted best first within a cell.
+    # Ranks that are not known from the candidates are NaN.
+    count = max(k, candidate_factor * k)
+    by_total = None
+    by_rate = None
+    for events in event_chunks:
+        events = rankable_events(events, min_measurements)
+        by_total = events if by_total is None else concatenate_events([by_total, events])
+        by_total = _largest_per_cell(by_total, by_total['total'], count)
+        by_rate = events if by_rate is None else concatenate_events([by_rate, events])
+        by_rate = _largest_per_cell(by_rate, by_rate['average_rate'], count)
+    if by_total is None:
+        raise ValueError("no events were given.")
+
+    total_weight = weights[0] + weights[2]
+    rate_weight = weights[1]
+    total_rank, total_exact, total_exact_count = _candidate_ranks(by_total, 'total', count)
+    rate_rank, rate_exact, rate_exact_count = _candidate_ranks(by_rate, 'average_rate', count)
+
+    # Weighted scores of the events whose ranks are exact for both criteria
+    _, in_total, in_rate = np.intersect1d(by_total['event_id'], by_rate['event_id'], return_indices=True)
+    both_exact = total_exact[in_total] & rate_exact[in_rate]
+    in_total = in_total[both_exact]
+    in_rate = in_rate[both_exact]
+    weighted = select_events(by_total, in_total)
+    weighted['total_rank'] = total_rank[in_total]
+    weighted['rate_rank'] = rate_rank[in_rate]
+    weighted['weighted_score'] = total_weight * weighted['total_rank'] + rate_weight * weighted['rate_rank']
+    weighted = _largest_per_cell(weighted, -weighted['weighted_score'], k)
+
+    # The k-th best exact score of every cell must beat any score an event without exact ranks can have
+    n_cells = len(total_exact_count)
+    kth_score = np.full(n_cells, -np.inf)
+    np.maximum.at(kth_score, weighted['cell'], weighted['weighted_score'])
+    kth_score[np.bincount(weighted['cell'], minlength=n_cells) < k] = np.inf
+    bound = np.minimum(total_weight * (total_exact_count + 1) + rate_weight,
+                       rate_weight * (rate_exact_count + 1) + total_weight)
+    incomplete = np.flatnonzero(kth_score >= bound)
+    if len(incomplete):
+        warnings.warn(f"the top {k} weighted events of cells {incomplete.tolist()} may be incomplete; "
+                      f"increase candidate_factor.")
+
+    top = {'weighted': weighted}
+    for name, candidates, key in [('total', by_total, 'total'), ('rate', by_rate, 'average_rate')]:
+        selected = _largest_per_cell(candidates, candidates[key], k)
+        selected['total_rank'] = _lookup(selected['event_id'], by_total['event_id'], total_rank)
+        selected['rate_rank'] = _lookup(selected['event_id'], by_rate['event_id'], rate_rank)
+        selected['weighted_score'] = total_weight * selected['total_rank'] + rate_weight * selected['rate_rank']
+        top[name] = selected
+    return top
+
+
+def build_event_index(events):
+    # Sorts the events by start time for events_in_range and events_on_dates. Events of one cell never overlap,
+    # but events of different cells do, so the longest event duration bounds how far back a query has to look.
+    index = select_events(events, np.argsort(events['start'], kind='stable'))
+    durations = index['end'] - index['start']
+    index['max_duration'] = durations.max() if len(durations) else np.timedelta64(0, 'ns')
+    return index
+
+
+def event_index_sources(file_paths, **settings):
+    # What an index is built from: every CSV with its size and modification time, and the settings (such as
+    # break_threshold) that change the events. An index saved with other sources is out of date.
+    files = []
+    for file_path in file_paths:
+        source = os.stat(file_path)
+        files.append([os.path.abspath(file_path), source.st_size, source.st_mtime_ns])
+    return json.loads(json.dumps({'files': files, 'settings': settings}))
+
+
+def save_event_index(index_path, index, sources=None):
+    # Saves an index from build_event_index, including any rank columns, to an .npz file, with the sources
+    # (from event_index_sources) it was built from
+    arrays = dict(index)
+    if sources is not None:
+        arrays['sources'] = np.array(json.dumps(sources))
+    np.savez_compressed(index_path, **arrays)
+
+
+def event_index_is_current(index_path, sources):
+    # True if the index file exists and was built from the same sources (see event_index_sources)
+    if not os.path.exists(index_path):
+        return False
+    with np.load(index_path) as data:
+        return 'sources' in data.files and json.loads(str(data['sources'])) == sources
+
+
+def load_event_index(index_path):
+    # Loads an index saved with save_event_index
+    with np.load(index_path) as data:
+        return {key: data[key] for key in data.files if key != 'sources'}
+
+
+def _overlapping_positions(index, start, end):
+    # Positions in the index of the events with a measurement in [start, end)
+    first = np.searchsorted(index['start'], start - index['max_duration'], side='left')
+    last = np.searchsorted(index['start'], end, side='left')
+    candidates = np.arange(first, last)
+    return candidates[index['end'][candidates] >= start]
+
+
+def _index_events(index, positions):
+    return {key: (value[positions] if key != 'max_duration' else value) for key, value in index.items()}
+
+
+def events_in_range(index, start, end):
+    # Returns the events of an index (from build_event_index) that have a measurement in [start, end)
+    return _index_events(index, _overlapping_positions(index, pd.Timestamp(start).to_datetime64(),
+                                                       pd.Timestamp(end).to_datetime64()))
+
+
+def events_on_dates(index, dates):
+    # Returns the events of an index that have a measurement on any of the dates, each event once, sorted by start
+    days = pd.to_datetime(dates).normalize().values
+    positions = [_overlapping_positions(index, day, day + np.timedelta64(1, 'D')) for day in days]
+    return _index_events(index, np.unique(np.concatenate(positions + [np.empty(0, dtype=np.int64)])))
+
+
+def events_to_dataframe(events):
+    # Converts event arrays to a DataFrame with the column names used by the original scripts
+    columns = {
+        'Cell': events['cell'],
+        'Start': events['start'],
+        'End': events['end'],
+        'TotalPrecipitation': events['total'],
+        'EventMeasurements': events['measurements'],
+        'DurationHours': events['duration_hours'],
+        'AverageRate': events['average_rate'],
+    }
+    for key, column in [('total_rank', 'TotalPrecipRank'), ('rate_rank', 'AverageRateRank'), ('weighted_score', 'WeightedScore')]:
+        if key in events:
+            columns[column] = events[key]
+    frame = pd.DataFrame(columns)
+    frame.index = pd.Index(events['event_id'], name='EventID')
+    return frame
@@ -0,0 +1,88 @@
+#Checks the events of precipitation_events.py against the CSV itself and the original pandas groupby code.
+#Run with: python -m pytest test_precipitation_events.py
+import numpy as np
+import pandas as pd
+from precipitation_events import (read_giovanni_csv, cached_giovanni_csv, read_giovanni_files, segment_events, stream_events,
+                                   concatenate_events, select_events, rank_events, build_event_index, save_event_index,
+                                   load_event_index, event_index_sources, event_index_is_current)
+
+
+def write_giovanni_csv(path, values):
+    # A half-hourly Giovanni area-averaged time series CSV with its metadata rows
+    times = pd.date_range('2020-01-01', periods=len(values), freq='30min')
+    with open(path, 'w') as f:
+        f.write('Title:,"Time Series, Area-Averaged (test)"\n')
+        f.write('Fill Value (mean_GPM_3IMERGHH_07_precipitation):, -9999.9\n')
+        f.write('\n')
+        f.write('time, mean_GPM_3IMERGHH_07_precipitation\n')
+        for time, value in zip(times.strftime('%Y-%m-%d %H:%M:%S'), values):
+            f.write(f'{time},{value}\n')
+
+
+def test_cached_events_match_csv(tmp_path):
+    # Values equal to the break threshold are breaks whether they are read from the CSV or from the cache
+    rng = np.random.default_rng(0)
+    values = np.round(rng.gamma(0.5, 1.0, 500), 3)
+    values[::7] = 0.2
+    values[3::11] = 0.89
+    csv_path = str(tmp_path / '2020.csv')
+    write_giovanni_csv(csv_path, values)
+
+    csv_times, csv_precipitation = read_giovanni_csv(csv_path)
+    for cache_pass in range(2):
+        # The first pass writes the cache and the second reads it
+        cached_times, cached_precipitation = cached_giovanni_csv(csv_path, str(tmp_path / 'cache'))
+        np.testing.assert_array_equal(cached_times, csv_times)
+        np.testing.assert_array_equal(cached_precipitation, csv_precipitation)
+        for break_threshold in [0.2, 0.89]:
+            csv_events = segment_events(csv_times, csv_precipitation, break_threshold)
+            cached_events = segment_events(cached_times, cached_precipitation, break_threshold)
+            streamed_events = concatenate_events(stream_events([(cached_times, cached_precipitation)], break_threshold))
+            for key in ['start', 'end', 'total', 'measurements']:
+                np.testing.assert_array_equal(cached_events[key], csv_events[key])
+                np.testing.assert_array_equal(streamed_events[key], csv_events[key])
+
+
+def test_missing_readings_match_pandas():
+    # A NaN reading inside an event is skipped by the total and the measurement count, like the pandas groupby
+    times = pd.date_range('2020-01-01', periods=12, freq='30min').values
+    precipitation = np.array([0.0, 1.5, np.nan, 2.0, 0.1, np.nan, np.nan, 0.0, 3.0, np.nan, 1.0, 0.5])
+    data = pd.DataFrame({'Timestamp': times, 'Precipitation': precipitation})
+    data['IsBreak'] = data['Precipitation'] <= 0.89
+    data['EventID'] = data['IsBreak'].cumsum()
+    expected = data.groupby('EventID').agg(
+        Start=pd.NamedAgg(column='Timestamp', aggfunc='first'),
+        End=pd.NamedAgg(column='Timestamp', aggfunc='last'),
+        TotalPrecipitation=pd.NamedAgg(column='Precipitation', aggfunc='sum'),
+        EventMeasurements=pd.NamedAgg(column='Precipitation', aggfunc='count')
+    )
+
+    # One series and the same series as two grid cells, one of them with more NaN readings
+    gridded = np.column_stack([precipitation, np.where(np.arange(12) % 3 == 0, np.nan, precipitation)])
+    events = segment_events(times, precipitation, 0.89)
+    gridded_events = segment_events(times, gridded, 0.89)
+    first_cell = select_events(gridded_events, gridded_events['cell'] == 0)
+    for result in [events, first_cell]:
+        np.testing.assert_array_equal(result['start'], expected['Start'].values)
+        np.testing.assert_array_equal(result['end'], expected['End'].values)
+        np.testing.assert_allclose(result['total'], expected['TotalPrecipitation'].values)
+        np.testing.assert_array_equal(result['measurements'], expected['EventMeasurements'].values)
+    assert not np.isnan(gridded_events['total']).any()
+    streamed = concatenate_events(stream_events([(times[:6], gridded[:6]), (times[6:], gridded[6:])], 0.89))
+    assert np.isclose(streamed['total'].sum(), np.nansum(gridded))
+
+
+def test_event_index_rebuilt_when_sources_change(tmp_path):
+    # A saved index is only current for the same CSVs and settings it was built from
+    csv_paths = [str(tmp_path / f'{year}.csv') for year in (2019, 2020)]
+    for csv_path in csv_paths:
+        write_giovanni_csv(csv_path, np.linspace(0, 2, 48))
+    index_path = str(tmp_path / 'index.npz')
+    sources = event_index_sources(csv_paths, break_threshold=0.89)
+    index = build_event_index(rank_events(concatenate_events(stream_events(read_giovanni_files(csv_paths), 0.89))))
+    save_event_index(index_path, index, sources)
+
+    assert event_index_is_current(index_path, event_index_sources(csv_paths, break_threshold=0.89))
+    assert set(load_event_index(index_path)) == set(index)
+    assert not event_index_is_current(index_path, event_index_sources(csv_paths[1:], break_threshold=0.89))
+    assert not event_index_is_current(index_path, event_index_sources(csv_paths, break_threshold=0.2))